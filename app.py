@@ -1,111 +1,296 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, render_template, jsonify, request
-import requests
-import xml.etree.ElementTree as ET
-import json
-import os
+from flask import Flask, Response, g, render_template, jsonify, request
 import argparse
+import hashlib
 import socket
 import sys
-import re
+import threading
+import time
 from datetime import datetime
-from util import sanitize_url, get_base_url
-
-DEBUG = False
+import requests
+from cctray import build_cctray_xml
+from config_store import AppConfig, ConfigStore, UserConfig
+from filters import criteria_key, parse_query_filters
+from http_pool import SessionPool
+from json_provider import FastJSONProvider, dumps_bytes
+import metrics
+from poller import FeedPoller, build_status
+from response_cache import ResponseCache, derived_etag, supported_encodings
+from scheduler import AdaptiveScheduler
+from shared_snapshot import SharedSnapshotReader, SharedSnapshotWriter
+from snapshot_store import SnapshotStore
+from summary import StatusSummary
 
 app = Flask(__name__)
+# orjson when installed, stdlib json otherwise
+app.json = FastJSONProvider(app)
+
+
+# Parsed configuration files, reloaded only when they change on disk
+config_store = ConfigStore(["config.json5"], AppConfig)
+# Check for debug config first (higher priority, for local testing)
+user_config_store = ConfigStore(["config_user.debug.json5", "config_user.json5"], UserConfig)
 
 
 # Load configuration
 def load_config():
-    config_path = "config.json5"
-    if os.path.exists(config_path):
-        import json5
-
-        with open(config_path, "r", encoding="utf-8") as f:
-            return json5.load(f)
-    return {}
+    return config_store.get().raw
 
 
 # Load user configuration (feeds)
 def load_user_config():
-    import json5
-    
-    # Check for debug config first (higher priority, for local testing)
-    debug_config_path = "config_user.debug.json5"
-    if os.path.exists(debug_config_path):
-        with open(debug_config_path, "r", encoding="utf-8") as f:
-            return json5.load(f)
-    
-    # Fall back to regular user config
-    config_path = "config_user.json5"
-    if os.path.exists(config_path):
-        with open(config_path, "r", encoding="utf-8") as f:
-            return json5.load(f)
-    return {}
-
-
-# Initialize APPLICATION_ROOT from config.json
+    return user_config_store.get().raw
+
+
+# Server and polling settings are read once at startup (only the UI settings in
+# config_store.get().client_config are reloaded); see "Development Workflow" in
+# README.md for the keys that need a restart
 config = load_config()
 APPLICATION_ROOT = config.get("application_root", "/")
 if APPLICATION_ROOT != "/" and not APPLICATION_ROOT.endswith("/"):
     APPLICATION_ROOT = APPLICATION_ROOT + "/"
 app.config["APPLICATION_ROOT"] = APPLICATION_ROOT
 
+# Prometheus metrics on /metrics (no-ops while disabled)
+metrics.REGISTRY.enabled = config.get("metrics", {}).get("enabled", False)
+
+# Background poller shared by all requests (created lazily on first use)
+poller = None
+_poller_lock = threading.Lock()
+
+# Seconds a poll cycle waits for its feeds before publishing partial results.
+# Also bounds how long a request waits for the very first poll cycle after startup.
+FETCH_DEADLINE = config.get("fetch_deadline", 10)
+
+
+def snapshot_state(snapshot):
+    """Hash of what clients show of a snapshot: its version and the feeds' errors and stale flags"""
+    return hashlib.sha1(repr((snapshot.version, snapshot.feed_state())).encode("utf-8")).hexdigest()
+
+
+def snapshot_etag(snapshot, key):
+    """
+    ETag of an /api/status or /api/summary body
+
+    Follows snapshot_state() and the request, but not "timestamp" and feed ages,
+    which change with every poll cycle: polling clients get 304 until something
+    they show changes.
+    """
+    return derived_etag(snapshot_state(snapshot), key)
+
+
+# Serialized /api/status bodies of the latest snapshot, shared by all clients
+response_cache = ResponseCache(dumps_bytes, etag=snapshot_etag)
+
+# CCTray XML re-export of the snapshot for CCMenu/CCTray clients; rebuilt (and
+# compressed) only when the projects change
+cctray_export_cache = ResponseCache(lambda body: body, size=64, per_version=True, precompress=True)
+
+# Status counts per feed and category, updated from each new snapshot
+status_summary = StatusSummary()
+
+# Multi-process mode (wsgi.py with "workers" > 1): the elected poller process
+# writes every snapshot to shared_writer, the other processes serve them from
+# shared_reader instead of polling
+shared_writer = None
+shared_reader = None
+
+WAITING_MESSAGE = "Waiting for the first poll of the CCTray feeds"
+
+
+def get_poller():
+    """Return the shared FeedPoller, starting it on first use"""
+    global poller
+    with _poller_lock:
+        if poller is None:
+            interval = config.get("poll_interval", config.get("refresh_interval", 5))
+            breaker = config.get("circuit_breaker", {})
+            store_path = config.get("snapshot_store")
+            poller = FeedPoller(
+                lambda: user_config_store.get().feeds,
+                interval=interval,
+                max_workers=config.get("fetch_workers", 4),
+                deadline=FETCH_DEADLINE,
+                sessions=SessionPool(config.get("http")),
+                stream_parse=config.get("stream_parse", False),
+                breaker_threshold=breaker.get("failure_threshold", 3),
+                breaker_cooldown=breaker.get("cooldown", 60),
+                scheduler=AdaptiveScheduler(
+                    interval,
+                    min_interval=config.get("poll_min_interval"),
+                    max_interval=config.get("poll_max_interval"),
+                    backoff=config.get("poll_backoff", 2.0),
+                    jitter=config.get("poll_jitter", 0.0),
+                ),
+                store=SnapshotStore(store_path) if store_path else None,
+                refresh_min_interval=config.get("refresh_min_interval", 10),
+            )
+            poller.add_listener(status_summary.update)
+            if shared_writer is not None:
+                poller.add_listener(publish_shared_snapshot, changes_only=False)
+            # Serve the feeds stored by the previous process until they are polled
+            restored = poller.restore()
+            if restored:
+                print(f"Restored {restored} feed(s) from {store_path}")
+            poller.start()
+    return poller
+
+
+def serve_shared_snapshot(directory):
+    """Serve the snapshots the elected poller process publishes, instead of polling"""
+    global shared_reader
+    shared_reader = SharedSnapshotReader(directory)
+
+
+def start_shared_poller(directory, poller_url=None):
+    """
+    Poll the feeds in this process and publish every snapshot to the other processes
+
+    A process that served shared snapshots until now switches to its own once the
+    first poll (or the snapshot store) has produced one.
+
+    Args:
+        directory: Shared snapshot directory
+        poller_url: Base URL of this process, to which the other processes forward
+            the requests only the poller can answer
+    """
+    global shared_writer, shared_reader
+    shared_writer = SharedSnapshotWriter(directory, poller_url)
+    feed_poller = get_poller()
+    feed_poller.wait_ready(FETCH_DEADLINE)
+    shared_reader = None
+    return feed_poller
+
+
+def publish_shared_snapshot(snapshot):
+    """
+    Queue the response bodies of a snapshot for the other processes (poller listener)
+
+    Called while the poller holds its lock: the bodies are built and written by
+    the writer's thread, and not at all if the snapshot's state didn't change.
+    """
+    feed_poller = poller
+    state = snapshot_state(snapshot)
+
+    def build():
+        documents = {
+            "status": status_response(feed_poller, snapshot),
+            "status_unchanged": status_response(feed_poller, snapshot, since=snapshot.version),
+            "summary": summary_response(snapshot),
+            "cc.xml": cctray_xml_response(snapshot),
+        }
+        for feed in snapshot.feeds:
+            documents["cc.xml/" + feed.name] = cctray_xml_response(snapshot, feed.name)
+        return {
+            "version": snapshot.version,
+            "documents": {name: cached.body for name, cached in documents.items()},
+            "feeds": [feed.name for feed in snapshot.feeds],
+            "etags": {name: cached.etag for name, cached in documents.items()},
+            "state": state,
+        }
 
-def fetch_cctray_feed(feed_url):
-    """Fetch and parse CCTray XML feed"""
-    try:
-        response = requests.get(feed_url, timeout=10)
-        response.raise_for_status()
-        return response.text
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching CCTray feed: {e}")
-        return None
+    shared_writer.submit(state, build)
+
+
+def status_response(feed_poller, snapshot, criteria=None, since=None):
+    """Return the cached /api/status body for a snapshot and request"""
+    criteria = criteria or {}
+    return response_cache.get(
+        snapshot,
+        (criteria_key(criteria), since),
+        lambda: build_status(feed_poller, snapshot, criteria, since),
+    )
 
 
-def parse_cctray_xml(xml_content, feed_name, feed_url, main_url=""):
-    """Parse CCTray XML and extract project information"""
-    if not xml_content:
-        return []
+def summary_response(snapshot):
+    """Return the cached /api/summary body for a snapshot"""
+    status_mapping = config_store.get().client_config["status_mapping"]
+    return response_cache.get(
+        snapshot,
+        ("summary", tuple(status_mapping.items())),
+        lambda: status_summary.build(snapshot, status_mapping),
+    )
+
+
+def cctray_xml_response(snapshot, feed_name=None):
+    """Return the cached CCTray XML of every feed, or of the feed named feed_name"""
+
+    def build():
+        if feed_name is None:
+            return build_cctray_xml(snapshot.projects, qualify_names=True)
+        return build_cctray_xml(snapshot.select({"feed": [feed_name]})[0])
+
+    return cctray_export_cache.get(snapshot, feed_name, build)
+
+
+# Set on requests a worker forwards, so they are never forwarded again (e.g. to
+# a process that has just lost the poller lock)
+FORWARDED_HEADER = "X-CCTray-Forwarded"
+
 
+def request_poller(method, path, query_string=b""):
+    """
+    Send a request to the elected poller process (from another process)
+
+    Returns:
+        requests.Response, or None if the poller process can't be reached
+    """
+    url = shared_reader.poller_url()
+    if url is None or request.headers.get(FORWARDED_HEADER):
+        return None
+    if query_string:
+        path += "?" + query_string.decode("latin-1")
     try:
-        root = ET.fromstring(xml_content)
-        projects = []
-
-        for project in root.findall("Project"):
-            web_url = project.get("webUrl", "")
-            sanitized_url = sanitize_url(web_url, feed_url, main_url) if web_url else ""
-
-            # Debug logging
-            project_name = project.get("name", "Unknown")
-            if DEBUG:
-                print(
-                    f"Project: {project_name}, Original webUrl: {web_url}, Sanitized: {sanitized_url}"
-                )
-
-            # Use main_url for feed base URL if available, otherwise use feed_url base
-            feed_base_url = (
-                get_base_url(main_url) if main_url else get_base_url(feed_url)
-            )
+        return requests.request(
+            method, url + path, headers={FORWARDED_HEADER: "1"}, timeout=FETCH_DEADLINE * 2 + 5
+        )
+    except requests.RequestException as e:
+        print(f"Error forwarding {path} to the poller process: {e}")
+        return None
 
-            project_data = {
-                "name": project_name,
-                "activity": project.get("activity", "Unknown"),
-                "lastBuildStatus": project.get("lastBuildStatus", "Unknown"),
-                "lastBuildLabel": project.get("lastBuildLabel", "N/A"),
-                "lastBuildTime": project.get("lastBuildTime", "N/A"),
-                "webUrl": sanitized_url,
-                "category": project.get("category", ""),
-                "feedName": feed_name,
-                "feedBaseUrl": feed_base_url,
-            }
-            projects.append(project_data)
 
-        return projects
-    except ET.ParseError as e:
-        print(f"Error parsing XML: {e}")
-        return []
+def forward_to_poller():
+    """Answer a request only the elected poller process can serve by forwarding it there"""
+    response = request_poller(request.method, request.path, request.query_string)
+    if response is None:
+        return jsonify({"error": "The process polling the feeds is not reachable"}), 503
+    return Response(
+        response.content,
+        status=response.status_code,
+        content_type=response.headers.get("Content-Type"),
+    )
+
+
+def refresh_through_poller():
+    """?fresh=1 in a worker: refresh every feed in the poller process and wait for the snapshot"""
+    response = request_poller("POST", "/api/refresh")
+    if response is None or response.status_code != 200:
+        return
+    version = response.json().get("version")
+    deadline = time.monotonic() + FETCH_DEADLINE
+    while version is not None and time.monotonic() < deadline:
+        documents = shared_reader.read()
+        if documents is not None and documents.version >= version:
+            return
+        time.sleep(0.05)
+
+
+@app.before_request
+def start_request_timer():
+    if metrics.REGISTRY.enabled:
+        g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or "unknown",
+            status=response.status_code,
+        )
+    return response
 
 
 @app.route("/")
@@ -117,125 +302,214 @@ def index():
 @app.route("/api/config")
 def get_config():
     """API endpoint to get configuration"""
-    config = load_config()
-    colors = config.get(
-        "colors",
-        {
-            "success": "#4CAF50",
-            "failure": "#f44336",
-            "exception": "#ff9800",
-            "unknown": "#9e9e9e",
-            "building": "#2196F3",
-        },
-    )
+    return jsonify(config_store.get().client_config)
+
+
+@app.route("/api/status")
+def get_status():
+    """API endpoint to get current build status from all feeds"""
+    if shared_reader is not None:
+        if request.args.get("fresh") in ("1", "true"):
+            refresh_through_poller()
+        return get_shared_status()
+
+    feed_poller = get_poller()
+    if request.args.get("fresh") in ("1", "true"):
+        # Poll every feed now (shared with concurrent ?fresh=1 callers)
+        feed_poller.refresh(timeout=FETCH_DEADLINE * 2)
+    if not feed_poller.wait_ready(FETCH_DEADLINE):
+        return waiting_status()
+
+    snapshot = feed_poller.snapshot()
+    if not snapshot.feeds:
+        return no_feeds_status()
+
+    # Optional ?feed=, ?status=, ?category=, ?activity= filters and ?since=<version>
+    criteria = parse_query_filters(request.args)
+    since = request.args.get("since", type=int)
+    return cached_response(status_response(feed_poller, snapshot, criteria, since))
+
+
+def get_shared_status():
+    """
+    /api/status from the snapshot published by the poller process
+
+    Clients with an older version get the full list instead of a delta, and query
+    filters are applied to the published list (see shared_snapshot.py).
+    """
+    documents = shared_reader.read()
+    if documents is None:
+        return waiting_status()
+    if not documents.feeds:
+        return no_feeds_status()
+    criteria = parse_query_filters(request.args)
+    if criteria:
+        # Same ETag as the poller process gives the full filtered list
+        key = criteria_key(criteria)
+        etag = derived_etag(documents.state, (key, None))
+        cached = documents.filtered_status(criteria, key, dumps_bytes, etag)
+    elif request.args.get("since", type=int) == documents.version:
+        cached = documents.get("status_unchanged")
+    else:
+        cached = documents.get("status")
+    return cached_response(cached)
 
-    # Create status mapping: color key -> CCTray status name
-    # Map lowercase color keys to proper case status names used in CCTray XML
-    # Standard CCTray statuses: Success, Failure, Exception, Unknown
-    # Building is typically an activity, but we include it if present in colors
-    status_mapping = {}
-    color_to_status = {
-        "success": "Success",
-        "failure": "Failure",
-        "exception": "Exception",
-        "unknown": "Unknown",
-        "building": "Building",  # May not be a standard status, but included if in config
-    }
-
-    for color_key in colors.keys():
-        # Use predefined mapping, or capitalize if not in mapping
-        status_name = color_to_status.get(color_key, color_key.capitalize())
-        status_mapping[color_key] = status_name
 
+def waiting_status():
     return jsonify(
         {
-            "refresh_interval": config.get("refresh_interval", 5)
-            * 1000,  # Convert to milliseconds
-            "font_size": config.get("font_size", 14),
-            "cards_per_row": config.get("cards_per_row", 4),
-            "card_size": config.get(
-                "card_size",
-                {
-                    "min_width": "200px",
-                    "max_width": "320px",
-                    "padding": "15px",
-                    "gap": "15px",
-                },
-            ),
-            "background_color": config.get("background_color", "#666666"),
-            "header_background_image": config.get("header_background_image", ""),
-            "header_text_color": config.get("header_text_color", "#333333"),
-            "colors": colors,
-            "status_mapping": status_mapping,  # Map color keys to CCTray status names
+            "projects": [],
+            "timestamp": datetime.now().isoformat(),
+            "errors": [WAITING_MESSAGE],
+            "feeds": [],
         }
     )
 
 
-@app.route("/api/status")
-def get_status():
-    """API endpoint to get current build status from all feeds"""
-    user_config = load_user_config()
-    feeds = user_config.get("feeds", [])
-
-    if not feeds:
-        return (
-            jsonify(
-                {
-                    "error": "No CCTray feeds configured",
-                    "projects": [],
-                    "timestamp": datetime.now().isoformat(),
-                }
-            ),
-            400,
-        )
+def no_feeds_status():
+    return (
+        jsonify(
+            {
+                "error": "No CCTray feeds configured",
+                "projects": [],
+                "timestamp": datetime.now().isoformat(),
+            }
+        ),
+        400,
+    )
 
-    all_projects = []
-    feed_errors = []
-
-    for feed in feeds:
-        feed_name = feed.get("name", "Unknown Feed")
-        feed_url = feed.get("url", "")
-        main_url = feed.get("main_url", "")
-
-        if not feed_url:
-            feed_errors.append(f"Feed '{feed_name}' has no URL configured")
-            continue
-
-        try:
-            xml_content = fetch_cctray_feed(feed_url)
-            if xml_content:
-                projects = parse_cctray_xml(xml_content, feed_name, feed_url, main_url)
-
-                # Apply filter_regex if specified
-                filter_regex = feed.get("filter_regex", "")
-                if filter_regex:
-                    try:
-                        pattern = re.compile(filter_regex)
-                        filtered_projects = [
-                            p for p in projects if not pattern.search(p.get("name", ""))
-                        ]
-                        projects = filtered_projects
-                    except re.error as e:
-                        feed_errors.append(
-                            f"Invalid filter_regex for feed '{feed_name}': {str(e)}"
-                        )
-                        # Continue with unfiltered projects if regex is invalid
-
-                all_projects.extend(projects)
-            else:
-                feed_errors.append(f"Failed to fetch feed '{feed_name}'")
-        except Exception as e:
-            feed_errors.append(f"Error processing feed '{feed_name}': {str(e)}")
 
+def cached_response(cached, mimetype="application/json"):
+    """
+    Answer a request from a CachedResponse
+
+    Returns 304 if the client already has it, otherwise the stored bytes in the
+    best encoding the client accepts.
+    """
+    if any(request.if_none_match.contains(etag) for etag in cached.etags()):
+        response = Response(status=304)
+        response.set_etag(cached.etag)
+    else:
+        encoding = None
+        for candidate in supported_encodings():
+            if request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        body, etag = cached.variant(encoding)
+        response = Response(body, mimetype=mimetype, direct_passthrough=True)
+        response.set_etag(etag)
+        if etag != cached.etag:
+            response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/api/summary")
+def get_summary():
+    """API endpoint to get project counts per status for every feed and category"""
+    if shared_reader is not None:
+        documents = shared_reader.read()
+        if documents is None:
+            return jsonify({"error": WAITING_MESSAGE}), 503
+        return cached_response(documents.get("summary"))
+
+    feed_poller = get_poller()
+    if not feed_poller.wait_ready(FETCH_DEADLINE):
+        return jsonify({"error": WAITING_MESSAGE}), 503
+    return cached_response(summary_response(feed_poller.snapshot()))
+
+
+@app.route("/cc.xml", defaults={"feed_name": None})
+@app.route("/feeds/<feed_name>/cc.xml")
+def get_cctray_xml(feed_name):
+    """
+    CCTray XML of every feed (project names prefixed with the feed name) or of one feed
+
+    CCMenu/CCTray clients pointed here share the server's poll of the CI servers.
+    """
+    if shared_reader is not None:
+        snapshot = None
+        documents = shared_reader.read()
+        feed_names = documents.feeds if documents is not None else None
+    else:
+        feed_poller = get_poller()
+        documents = None
+        snapshot = feed_poller.snapshot() if feed_poller.wait_ready(FETCH_DEADLINE) else None
+        feed_names = [feed.name for feed in snapshot.feeds] if snapshot is not None else None
+    if feed_names is None:
+        return Response(WAITING_MESSAGE, status=503, mimetype="text/plain")
+
+    if feed_name is not None:
+        names = {name.casefold(): name for name in feed_names}
+        feed_name = names.get(feed_name.casefold())
+        if feed_name is None:
+            return Response("Unknown feed", status=404, mimetype="text/plain")
+
+    if documents is not None:
+        cached = documents.get("cc.xml" if feed_name is None else "cc.xml/" + feed_name)
+    else:
+        cached = cctray_xml_response(snapshot, feed_name)
+    return cached_response(cached, mimetype="application/xml")
+
+
+@app.route("/api/refresh", methods=["POST"], defaults={"feed_name": None})
+@app.route("/api/refresh/<path:feed_name>", methods=["POST"])
+def refresh_feeds(feed_name):
+    """API endpoint to poll one feed (or every feed) now instead of at its next scheduled poll"""
+    if shared_reader is not None:
+        return forward_to_poller()
+    if feed_name is not None:
+        names = {feed.name.casefold(): feed.name for feed in user_config_store.get().feeds}
+        feed_name = names.get(feed_name.casefold())
+        if feed_name is None:
+            return jsonify({"error": "Unknown feed"}), 404
+    feed_poller = get_poller()
+    result = feed_poller.refresh(feed_name, timeout=FETCH_DEADLINE * 2)
+    snapshot = feed_poller.snapshot()
+    result["version"] = snapshot.version if snapshot is not None else None
+    result["timestamp"] = datetime.now().isoformat()
+    return jsonify(result)
+
+
+@app.route("/api/stats")
+def get_stats():
+    """API endpoint to get upstream connection statistics"""
+    if shared_reader is not None:
+        return forward_to_poller()
+    feed_poller = get_poller()
     return jsonify(
         {
-            "projects": all_projects,
+            "http_pool": feed_poller.sessions.stats(),
+            "parsing": feed_poller.parse_stats(),
+            "response_cache": response_cache.stats(),
             "timestamp": datetime.now().isoformat(),
-            "errors": feed_errors if feed_errors else None,
         }
     )
 
 
+@app.route("/api/schedule")
+def get_schedule():
+    """API endpoint to get each feed's poll interval and next poll time"""
+    if shared_reader is not None:
+        return forward_to_poller()
+    feed_poller = get_poller()
+    return jsonify(
+        {
+            "feeds": feed_poller.schedules(),
+            "timestamp": datetime.now().isoformat(),
+        }
+    )
+
+
+@app.route("/metrics")
+def get_metrics():
+    """Prometheus metrics (enabled with "metrics": {"enabled": true} in config.json5)"""
+    if not metrics.REGISTRY.enabled:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
 def is_port_available(host, port):
     """Check if a port is available"""
     try:
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: per-request JSON5 parsing vs the cached ConfigStore
+
+Compares the per-request cost of
+    reparse  - parsing config.json5 and config_user.json5 on every request
+               (what /api/config and the poller used to do)
+    cached   - ConfigStore.get(), which only stats the files once per check interval
+using the repository's config files.
+
+Usage:
+    python benchmarks/bench_config.py
+    python benchmarks/bench_config.py --requests 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config_store import AppConfig, ConfigStore, UserConfig, read_json5  # noqa: E402
+
+CONFIG_PATH = os.path.join(ROOT, "config.json5")
+USER_CONFIG_PATH = os.path.join(ROOT, "config_user.json5")
+
+
+def reparse():
+    """Parse and build both configurations from scratch"""
+    return AppConfig(read_json5(CONFIG_PATH)), UserConfig(read_json5(USER_CONFIG_PATH))
+
+
+def measure(name, function, requests):
+    """Call function once per simulated request and print the mean cost"""
+    started = time.perf_counter()
+    for _ in range(requests):
+        function()
+    elapsed = time.perf_counter() - started
+    print(f"{name:>8} {requests:>9} {elapsed:>8.3f} {elapsed / requests * 1e6:>12.1f}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Config loading benchmark")
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    config_store = ConfigStore([CONFIG_PATH], AppConfig)
+    user_config_store = ConfigStore([USER_CONFIG_PATH], UserConfig)
+
+    print(f"{'mode':>8} {'requests':>9} {'time s':>8} {'per req µs':>12}")
+    slow = measure("reparse", reparse, args.requests)
+    fast = measure(
+        "cached", lambda: (config_store.get(), user_config_store.get()), args.requests
+    )
+    print(f"speedup: {slow / fast:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Load test: the production server against synthetic CCTray servers
+
+Starts local fake CCTray servers (fake_cctray.py) with the given number of
+projects, latency and failure rate, writes a config.json5 and config_user.json5
+pointing at them into a temporary directory, starts wsgi.py (Waitress) there as a
+separate process and drives /api/status with concurrent clients. Reports:
+    latency_ms        - /api/status response time (p50/p90/p99/max)
+    throughput_rps    - completed requests per second
+    errors            - failed requests (connection errors or status >= 400)
+    upstream_requests - requests the fake CCTray servers received (and how many of
+                        them were answered with an injected failure)
+    server_rss_mb     - resident memory of the server process (start/peak/end,
+                        Linux only)
+Results are written as JSON (with the git commit) so runs of different commits
+can be compared with --compare.
+
+Clients request the full project list by default; --dashboard makes them behave
+like the page (?since=<version> deltas and If-None-Match revalidation).
+--workers N runs wsgi.py with "workers": N and spreads the clients over the
+worker ports (server memory is then only that of the supervising process).
+
+Usage:
+    python benchmarks/bench_load.py
+    python benchmarks/bench_load.py --feeds 5 --projects 2000 --clients 50 --duration 30
+    python benchmarks/bench_load.py --latency 0.5 --failure-rate 0.2 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_cctray import FakeCCTrayServer, make_cctray_xml  # noqa: E402
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def port_is_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind(("127.0.0.1", port))
+            return True
+        except OSError:
+            return False
+
+
+def write_configs(directory, servers, port, args):
+    """Write the server and feed configuration used by the load test"""
+    config = {
+        "host": "127.0.0.1",
+        "port": port,
+        "threads": args.threads,
+        "poll_interval": args.poll_interval,
+        "fetch_deadline": max(10, args.latency * 2 + 5),
+        "workers": args.workers,
+    }
+    feeds = [{"name": f"Feed {i}", "url": server.url} for i, server in enumerate(servers)]
+    # JSON is valid JSON5
+    with open(os.path.join(directory, "config.json5"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    with open(os.path.join(directory, "config_user.json5"), "w", encoding="utf-8") as f:
+        json.dump({"feeds": feeds}, f, indent=2)
+
+
+def rss_mb(pid):
+    """Resident memory of a process in MB, or None where /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def wait_for_server(base_url, timeout):
+    """Wait until the first poll has published a snapshot"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = requests.get(base_url + "/api/status", timeout=timeout)
+            if response.ok and response.json().get("version") is not None:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def client_loop(base_url, stop_at, dashboard, latencies, errors, lock):
+    """Request /api/status until stop_at, recording latencies in ms"""
+    session = requests.Session()
+    version = None
+    etag = None
+    local = []
+    failed = 0
+    while time.monotonic() < stop_at:
+        url = base_url + "/api/status"
+        headers = {"Accept-Encoding": "gzip"}
+        if dashboard and version is not None:
+            url += f"?since={version}"
+            if etag:
+                headers["If-None-Match"] = etag
+        started = time.perf_counter()
+        try:
+            response = session.get(url, headers=headers, timeout=30)
+            body = response.content
+            local.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                failed += 1
+            elif dashboard and response.status_code == 200:
+                version = json.loads(body).get("version")
+                etag = response.headers.get("ETag")
+        except requests.RequestException:
+            failed += 1
+    with lock:
+        latencies.extend(local)
+        errors[0] += failed
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+
+def run(args):
+    servers = [
+        FakeCCTrayServer(
+            make_cctray_xml(args.projects, prefix=f"Feed{i} Project"),
+            latency=args.latency,
+            etag=args.etag,
+            failure_rate=args.failure_rate,
+            seed=i,
+        ).start()
+        for i in range(args.feeds)
+    ]
+    port = free_port()
+    while not all(port_is_free(port + i) for i in range(args.workers)):
+        port = free_port()
+    base_urls = [f"http://127.0.0.1:{port + i}" for i in range(args.workers)]
+    with tempfile.TemporaryDirectory() as directory:
+        write_configs(directory, servers, port, args)
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "wsgi.py")],
+            cwd=directory,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            for url in base_urls:
+                if not wait_for_server(url, args.startup_timeout):
+                    raise RuntimeError("The server did not publish a snapshot in time")
+            rss_start = rss_mb(process.pid)
+            upstream_before = sum(server.request_count for server in servers)
+
+            latencies = []
+            errors = [0]
+            lock = threading.Lock()
+            stop_at = time.monotonic() + args.duration
+            threads = [
+                threading.Thread(
+                    target=client_loop,
+                    args=(base_urls[i % len(base_urls)], stop_at, args.dashboard, latencies, errors, lock),
+                )
+                for i in range(args.clients)
+            ]
+            started = time.monotonic()
+            for thread in threads:
+                thread.start()
+            rss_peak = rss_start
+            while any(thread.is_alive() for thread in threads):
+                rss = rss_mb(process.pid)
+                if rss is not None and (rss_peak is None or rss > rss_peak):
+                    rss_peak = rss
+                time.sleep(0.2)
+            elapsed = time.monotonic() - started
+
+            # Only the worker polling the feeds has upstream statistics
+            stats = None
+            for url in base_urls:
+                response = requests.get(url + "/api/stats", timeout=10)
+                if response.ok:
+                    stats = response.json()
+                    break
+            rss_end = rss_mb(process.pid)
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            for server in servers:
+                server.stop()
+
+    return {
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99),
+            "max": round(max(latencies), 2) if latencies else None,
+        },
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "errors": errors[0],
+        "upstream_requests": {
+            "during_run": sum(server.request_count for server in servers) - upstream_before,
+            "total": sum(server.request_count for server in servers),
+            "injected_failures": sum(server.failure_count for server in servers),
+        },
+        "server_rss_mb": {"start": rss_start, "peak": rss_peak, "end": rss_end},
+        "server_stats": stats,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, previous):
+    """Print the change of the headline numbers against an earlier result file"""
+    rows = [
+        ("p50 ms", ("latency_ms", "p50")),
+        ("p99 ms", ("latency_ms", "p99")),
+        ("req/s", ("throughput_rps",)),
+        ("upstream", ("upstream_requests", "during_run")),
+        ("peak MB", ("server_rss_mb", "peak")),
+    ]
+    print(f"Compared with {previous.get('commit')} ({previous.get('timestamp')}):")
+    for label, path in rows:
+        old = previous["results"]
+        new = current["results"]
+        for key in path:
+            old = old.get(key) if isinstance(old, dict) else None
+            new = new.get(key) if isinstance(new, dict) else None
+        change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else "n/a"
+        print(f"  {label:>9}: {old} -> {new} ({change})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/api/status load test against fake CCTray servers")
+    parser.add_argument("--feeds", type=int, default=3, help="Fake CCTray servers (one feed each)")
+    parser.add_argument("--projects", type=int, default=1000, help="Projects per feed")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each upstream response is delayed")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of upstream requests answered with 500")
+    parser.add_argument("--etag", action="store_true", help="Upstream servers send ETags and answer 304")
+    parser.add_argument("--clients", type=int, default=20, help="Concurrent /api/status clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds the clients run")
+    parser.add_argument("--dashboard", action="store_true", help="Clients use ?since= and If-None-Match like the page")
+    parser.add_argument("--threads", type=int, default=8, help="Waitress worker threads")
+    parser.add_argument("--workers", type=int, default=1, help="Server processes (config.json5 \"workers\")")
+    parser.add_argument("--poll-interval", type=float, default=5, help="Background poll interval in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument(
+        "--output",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_results.json"),
+        help="JSON file the results are written to",
+    )
+    parser.add_argument("--compare", help="Earlier results JSON to compare with")
+    args = parser.parse_args()
+
+    results = run(args)
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    summary = {key: value for key, value in results.items() if key != "server_stats"}
+    print(json.dumps(summary, indent=2))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
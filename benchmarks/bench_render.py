@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: dashboard rendering of large snapshots in a browser
+
+Renders benchmarks/templates/render_benchmark.html, which extends the dashboard's
+templates/index.html and replaces its config loading and status polling with
+render_benchmark.js, into a standalone HTML page. The page renders
+synthetic snapshots (1k and 10k projects by default), then refreshes them once
+per animation frame with 1% of the projects changed, and reports per size:
+    first_render_ms     - building the grid from scratch
+    update_ms           - script + layout time of one refresh (median/p95/max)
+    frame_interval_ms   - time between animation frames during the refreshes
+    unchanged_update_ms - a refresh where nothing changed
+    dom_nodes           - elements in the page after the refreshes
+
+If a Chrome/Chromium binary is found (or given with --browser), the page is run
+headless and the results are printed; otherwise open the generated file in the
+browser of the wallboard and read the results at the bottom of the page.
+
+Usage:
+    python benchmarks/bench_render.py
+    python benchmarks/bench_render.py --sizes 1000 10000 --browser /usr/bin/chromium
+    python benchmarks/bench_render.py --virtualize-threshold 500
+"""
+import argparse
+import html
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import ChoiceLoader, FileSystemLoader  # noqa: E402
+
+from app import app  # noqa: E402
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+BROWSERS = ("chromium", "chromium-browser", "google-chrome", "google-chrome-stable", "chrome")
+
+
+def render_page(sizes, frames, virtualize_threshold=0):
+    """Return the benchmark page (the dashboard driven by synthetic snapshots)"""
+    env = app.jinja_env.overlay(loader=ChoiceLoader([FileSystemLoader(TEMPLATES), app.jinja_env.loader]))
+    with app.test_request_context():
+        return env.get_template("render_benchmark.html").render(
+            benchmark_sizes=sizes,
+            benchmark_frames=frames,
+            benchmark_virtualize_threshold=virtualize_threshold,
+        )
+
+
+def run_headless(browser, path, timeout):
+    """Run the page in headless Chrome and return the results JSON text"""
+    output = subprocess.run(
+        [
+            browser,
+            "--headless=new",
+            "--disable-gpu",
+            f"--timeout={timeout * 1000}",
+            "--dump-dom",
+            "file://" + os.path.abspath(path),
+        ],
+        capture_output=True,
+        text=True,
+        timeout=timeout + 60,
+    ).stdout
+    match = re.search(r'<pre id="benchmarkResults">(.*?)</pre>', output, re.S)
+    return html.unescape(match.group(1)) if match else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dashboard render benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument(
+        "--virtualize-threshold", type=int, default=0,
+        help="Render feeds with at least this many projects virtualized (0: never)",
+    )
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_benchmark.html"))
+    parser.add_argument("--browser", help="Chrome/Chromium binary for a headless run")
+    parser.add_argument("--timeout", type=int, default=120, help="Seconds the headless run may take")
+    args = parser.parse_args()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(render_page(args.sizes, args.frames, args.virtualize_threshold))
+    print(f"Benchmark page written to {args.output}")
+
+    browser = args.browser or next(filter(None, (shutil.which(name) for name in BROWSERS)), None)
+    if browser is None:
+        print("No Chrome/Chromium found: open the page in a browser to run the benchmark")
+        return
+    results = run_headless(browser, args.output, args.timeout)
+    print(results if results else "The headless run produced no results")
+
+
+if __name__ == "__main__":
+    main()
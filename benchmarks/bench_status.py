@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: /api/status with and without the serialized response cache
+
+Serves a synthetic snapshot (10k projects by default) through Flask's test client
+and reports requests/sec and body bytes for
+    uncached  - build_status + jsonify on every request (the previous behaviour)
+    identity  - cached bytes, no compression
+    gzip      - cached gzip bytes
+    br        - cached brotli bytes (skipped if brotli is not installed)
+    304       - revalidation with If-None-Match
+
+Usage:
+    python benchmarks/bench_status.py
+    python benchmarks/bench_status.py --projects 1000 --seconds 2
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+from fake_cctray import FakeCCTrayServer, make_cctray_xml  # noqa: E402
+from flask import jsonify  # noqa: E402
+from poller import FeedPoller, build_status  # noqa: E402
+from response_cache import supported_encodings  # noqa: E402
+
+
+def uncached_status():
+    """The /api/status handler before responses were cached"""
+    feed_poller = app_module.poller
+    return jsonify(build_status(feed_poller, feed_poller.snapshot()))
+
+
+def measure(client, path, headers, seconds):
+    """Request path repeatedly for `seconds` and return (requests/sec, body bytes)"""
+    response = client.get(path, headers=headers)  # Warm up (fills the cache)
+    size = len(response.data)
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        client.get(path, headers=headers)
+        count += 1
+    return count / (time.perf_counter() - started), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/api/status response cache benchmark")
+    parser.add_argument("--projects", type=int, default=10000)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    with FakeCCTrayServer(make_cctray_xml(args.projects)) as server:
+        app_module.poller = FeedPoller(lambda: [{"name": "Main", "url": server.url}], interval=3600)
+        app_module.poller.poll_due()
+
+    app_module.app.add_url_rule("/bench/uncached", "bench_uncached", uncached_status)
+    client = app_module.app.test_client()
+    etag = client.get("/api/status").headers["ETag"]
+
+    cases = [
+        ("uncached", "/bench/uncached", {"Accept-Encoding": "gzip, br"}),
+        ("identity", "/api/status", {"Accept-Encoding": "identity"}),
+        ("gzip", "/api/status", {"Accept-Encoding": "gzip"}),
+    ]
+    if "br" in supported_encodings():
+        cases.append(("br", "/api/status", {"Accept-Encoding": "br"}))
+    cases.append(("304", "/api/status", {"If-None-Match": etag}))
+
+    print(f"{args.projects} projects")
+    print(f"{'mode':>9} {'req/s':>10} {'bytes':>11}")
+    for name, path, headers in cases:
+        rate, size = measure(client, path, headers, args.seconds)
+        print(f"{name:>9} {rate:>10.1f} {size:>11}")
+    app_module.poller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+        // Render benchmark (see benchmarks/bench_render.py), included by
+        // render_benchmark.html in place of index.html's config loading and status polling.
+        // For each size it times the first render and then FRAMES refreshes that
+        // each change 1% of the projects, one refresh per animation frame, and
+        // reports script + layout time per refresh and the frame interval.
+        const BENCHMARK_SIZES = {{ benchmark_sizes|tojson }};
+        const FRAMES = {{ benchmark_frames|tojson }};
+        const FEEDS = 10;
+        config.virtualizeThreshold = {{ benchmark_virtualize_threshold|tojson }};
+        const STATUSES = ['Success', 'Failure', 'Exception', 'Unknown'];
+
+        config.statusMapping = {
+            success: 'Success', failure: 'Failure', exception: 'Exception',
+            unknown: 'Unknown', building: 'Building'
+        };
+
+        function syntheticProjects(count) {
+            const projects = [];
+            for (let i = 0; i < count; i++) {
+                const feed = i % FEEDS;
+                projects.push({
+                    name: `Project ${i}`,
+                    activity: 'Sleeping',
+                    lastBuildStatus: STATUSES[i % 7 === 0 ? 1 : 0],
+                    lastBuildLabel: String(1000 + i),
+                    lastBuildTime: '2026-01-13T16:04:33',
+                    webUrl: `http://ci.example.com/viewType.html?buildTypeId=bt${i}`,
+                    category: `Category ${i % 5}`,
+                    feedName: `Feed ${feed}`,
+                    feedBaseUrl: 'http://ci.example.com'
+                });
+            }
+            // Grouped by feed like /api/status
+            return projects.sort((a, b) => a.feedName.localeCompare(b.feedName));
+        }
+
+        function mutate(projects, frame) {
+            const changed = Math.max(1, Math.floor(projects.length / 100));
+            const next = projects.slice();
+            for (let k = 0; k < changed; k++) {
+                const i = (frame * 7919 + k * 104729) % next.length;
+                const project = Object.assign({}, next[i]);
+                project.activity = project.activity === 'Building' ? 'Sleeping' : 'Building';
+                project.lastBuildStatus = STATUSES[(frame + k) % STATUSES.length];
+                project.lastBuildLabel = String(Number(project.lastBuildLabel) + 1);
+                next[i] = project;
+            }
+            return next;
+        }
+
+        function timeRender(projects) {
+            const container = document.getElementById('projectsContainer');
+            const started = performance.now();
+            renderProjects(projects);
+            void container.offsetHeight; // Force style and layout
+            return performance.now() - started;
+        }
+
+        function summarize(values) {
+            const sorted = values.slice().sort((a, b) => a - b);
+            const pick = q => sorted[Math.min(sorted.length - 1, Math.floor(q * sorted.length))];
+            const round = v => Math.round(v * 100) / 100;
+            return { median: round(pick(0.5)), p95: round(pick(0.95)), max: round(sorted[sorted.length - 1]) };
+        }
+
+        function nextFrame() {
+            return new Promise(resolve => requestAnimationFrame(resolve));
+        }
+
+        async function benchmarkSize(size) {
+            renderProjects([]); // Start from an empty grid
+            let projects = syntheticProjects(size);
+            await nextFrame();
+            const firstRender = timeRender(projects);
+
+            const renderTimes = [];
+            const frameIntervals = [];
+            let previous = await nextFrame();
+            for (let frame = 0; frame < FRAMES; frame++) {
+                projects = mutate(projects, frame);
+                renderTimes.push(timeRender(projects));
+                const now = await nextFrame();
+                frameIntervals.push(now - previous);
+                previous = now;
+            }
+            const unchanged = timeRender(projects);
+            return {
+                projects: size,
+                first_render_ms: Math.round(firstRender * 100) / 100,
+                update_ms: summarize(renderTimes),
+                frame_interval_ms: summarize(frameIntervals),
+                unchanged_update_ms: Math.round(unchanged * 100) / 100,
+                dom_nodes: document.getElementsByTagName('*').length
+            };
+        }
+
+        (async () => {
+            const results = [];
+            for (const size of BENCHMARK_SIZES) {
+                results.push(await benchmarkSize(size));
+            }
+            const output = document.createElement('pre');
+            output.id = 'benchmarkResults';
+            output.textContent = JSON.stringify(results, null, 2);
+            document.body.appendChild(output);
+            console.log(output.textContent);
+            document.title = 'benchmark-done';
+        })();
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+CCTray feed fetching and parsing for CCTray Build Status Monitor
+"""
+import requests
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+from models import FeedInfo, Project
+
+DEBUG = False
+
+# Bytes read from the socket at a time when streaming a feed
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class CCTrayResponse:
+    """Body and cache validators of one CCTray feed request"""
+
+    def __init__(
+        self,
+        content=None,
+        etag=None,
+        last_modified=None,
+        not_modified=False,
+        chunks=None,
+        response=None,
+    ):
+        self.content = content  # Raw XML bytes (None when not_modified or streaming)
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = not_modified
+        self.chunks = chunks  # Iterator of body bytes chunks when streaming
+        self._response = response
+
+    def close(self):
+        """Release the underlying connection (needed if chunks are not fully read)"""
+        if self._response is not None:
+            self._response.close()
+
+
+def fetch_cctray_document(
+    feed_url, timeout=10, session=None, etag=None, last_modified=None, stream=False
+):
+    """
+    Fetch a CCTray feed as bytes, sending conditional GET validators when known
+
+    Args:
+        feed_url: The CCTray XML feed URL
+        timeout: Request timeout in seconds
+        session: Optional requests.Session (see http_pool.SessionPool)
+        etag: ETag of the previously fetched document, sent as If-None-Match
+        last_modified: Last-Modified of the previously fetched document, sent as If-Modified-Since
+        stream: Don't read the body; return it as an iterator of chunks for
+            iter_cctray_projects (the caller must consume the chunks or call close())
+
+    Returns:
+        CCTrayResponse (not_modified is True on a 304), or None if the request failed
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    try:
+        response = (session or requests).get(
+            feed_url, timeout=timeout, headers=headers, stream=stream
+        )
+        if response.status_code == 304:
+            response.close()
+            return CCTrayResponse(
+                etag=response.headers.get("ETag", etag),
+                last_modified=response.headers.get("Last-Modified", last_modified),
+                not_modified=True,
+            )
+        if not response.ok:
+            response.close()
+        response.raise_for_status()
+        if stream:
+            return CCTrayResponse(
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                chunks=response.iter_content(STREAM_CHUNK_SIZE),
+                response=response,
+            )
+        return CCTrayResponse(
+            response.content,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching CCTray feed: {e}")
+        return None
+
+
+# Values _project_record() fills in for missing <Project> attributes
+_PLACEHOLDERS = {
+    "activity": "Unknown",
+    "lastBuildStatus": "Unknown",
+    "lastBuildLabel": "N/A",
+    "lastBuildTime": "N/A",
+}
+
+
+def _project_record(project, feed):
+    """Build the Project record for one <Project> element"""
+    web_url = project.get("webUrl", "")
+    sanitized_url = feed.sanitizer.sanitize(web_url)
+
+    # Debug logging
+    project_name = project.get("name", "Unknown")
+    if DEBUG:
+        print(
+            f"Project: {project_name}, Original webUrl: {web_url}, Sanitized: {sanitized_url}"
+        )
+
+    return Project(
+        project_name,
+        project.get("activity", _PLACEHOLDERS["activity"]),
+        project.get("lastBuildStatus", _PLACEHOLDERS["lastBuildStatus"]),
+        project.get("lastBuildLabel", _PLACEHOLDERS["lastBuildLabel"]),
+        project.get("lastBuildTime", _PLACEHOLDERS["lastBuildTime"]),
+        sanitized_url,
+        project.get("category", ""),
+        feed,
+    )
+
+
+def parse_cctray_records(xml_content, feed):
+    """
+    Parse CCTray XML into Project records
+
+    Args:
+        xml_content: XML document as str or bytes
+        feed: FeedInfo shared by every project of the feed
+
+    Returns:
+        List of Project records (empty if the document is invalid)
+    """
+    if not xml_content:
+        return []
+
+    try:
+        root = ET.fromstring(xml_content)
+        elements = root.findall("Project")
+        feed.sanitizer.reserve(len(elements))
+        return [_project_record(project, feed) for project in elements]
+    except ET.ParseError as e:
+        print(f"Error parsing XML: {e}")
+        return []
+
+
+def parse_cctray_xml(xml_content, feed_name, feed_url, main_url=""):
+    """Parse CCTray XML and extract project information"""
+    feed = FeedInfo(feed_name, feed_url, main_url)
+    return [project.to_dict() for project in parse_cctray_records(xml_content, feed)]
+
+
+# <Project> attributes written by build_cctray_xml, in order
+_EXPORT_ATTRIBUTES = (
+    ("activity", "activity"),
+    ("lastBuildStatus", "last_build_status"),
+    ("lastBuildLabel", "last_build_label"),
+    ("lastBuildTime", "last_build_time"),
+    ("webUrl", "web_url"),
+    ("category", "category"),
+)
+
+
+def build_cctray_xml(projects, qualify_names=False):
+    """
+    Write Project records as a CCTray XML document (the inverse of parse_cctray_records)
+
+    Args:
+        projects: Project records, e.g. of a snapshot (web URLs are already sanitized)
+        qualify_names: Prefix project names with their feed name ("Feed :: Project"),
+            so projects of different feeds stay distinct in one document
+
+    Attributes that are empty or still hold the parser's placeholder for a
+    missing value (e.g. lastBuildTime="N/A", not a valid dateTime) are left out,
+    as they were in the original document.
+
+    Returns:
+        UTF-8 encoded XML document
+    """
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<Projects>']
+    for project in projects:
+        name = f"{project.feed.name} :: {project.name}" if qualify_names else project.name
+        attributes = [f"name={quoteattr(name)}"]
+        for key, attribute in _EXPORT_ATTRIBUTES:
+            value = getattr(project, attribute)
+            if value and value != _PLACEHOLDERS.get(key):
+                attributes.append(f"{key}={quoteattr(value)}")
+        parts.append(f"<Project {' '.join(attributes)}/>")
+    parts.append("</Projects>\n")
+    return "\n".join(parts).encode("utf-8")
+
+
+def iter_cctray_records(chunks, feed):
+    """
+    Incrementally parse a CCTray document and yield Project records as they arrive
+
+    Unlike parse_cctray_records, the document is never held as one string or as a
+    full element tree: each <Project> is turned into a record as soon as its end tag
+    has been read and is then dropped, so memory use does not grow with feed size.
+
+    Args:
+        chunks: Iterable of bytes chunks (e.g. response.iter_content())
+        feed: FeedInfo shared by every project of the feed
+
+    Yields:
+        Project records in document order
+
+    Raises:
+        xml.etree.ElementTree.ParseError: If the document is not well-formed
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    depth = 0
+
+    def drain():
+        nonlocal root, depth
+        for event, element in parser.read_events():
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = element
+                continue
+
+            depth -= 1
+            # Only direct children of the root, like root.findall("Project")
+            if depth == 1 and element.tag == "Project":
+                yield _project_record(element, feed)
+                element.clear()
+
+        # Detach finished projects from the root so they can be freed. A project
+        # that is still being parsed keeps its attributes, which is all we read.
+        if root is not None:
+            root.clear()
+
+    for chunk in chunks:
+        if chunk:
+            parser.feed(chunk)
+            yield from drain()
+    parser.close()
+    yield from drain()
+
+
+def parse_cctray_stream_records(chunks, feed):
+    """Parse a CCTray document from bytes chunks into a list of Project records"""
+    try:
+        projects = list(iter_cctray_records(chunks, feed))
+        # The count is only known at the end: the next poll finds every URL cached
+        feed.sanitizer.reserve(len(projects))
+        return projects
+    except ET.ParseError as e:
+        print(f"Error parsing XML: {e}")
+        return []
+
+
+def iter_cctray_projects(chunks, feed_name, feed_url, main_url=""):
+    """Incrementally parse a CCTray document and yield project dicts (see iter_cctray_records)"""
+    feed = FeedInfo(feed_name, feed_url, main_url)
+    for project in iter_cctray_records(chunks, feed):
+        yield project.to_dict()
+
+
+def parse_cctray_stream(chunks, feed_name, feed_url, main_url=""):
+    """Parse a CCTray document from an iterable of bytes chunks (see iter_cctray_projects)"""
+    feed = FeedInfo(feed_name, feed_url, main_url)
+    return [project.to_dict() for project in parse_cctray_stream_records(chunks, feed)]
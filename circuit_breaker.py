@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Per-feed circuit breaker for CCTray Build Status Monitor
+
+After `failure_threshold` consecutive failed polls a feed's circuit opens and the
+poller stops calling its CI server for `cooldown` seconds. Meanwhile the feed
+keeps its last successfully fetched projects, marked stale in /api/status
+(feeds[].stale, with feeds[].age counting from the last success). When the
+cooldown is over, one trial poll is let through: success closes the circuit,
+failure opens it for another cooldown.
+"""
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Track consecutive failures of one upstream and decide whether to call it
+
+    Args:
+        failure_threshold: Consecutive failures that open the circuit (0 disables it)
+        cooldown: Seconds the circuit stays open before a trial call
+        clock: Callable returning the current time in seconds (injectable for tests)
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=60, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0  # Consecutive failures
+        self.opened_at = None
+        self._clock = clock
+
+    @property
+    def retry_at(self):
+        """Time the next trial call is allowed while open, otherwise None"""
+        if self.state != OPEN:
+            return None
+        return self.opened_at + self.cooldown
+
+    def allow(self):
+        """Return True if the upstream may be called now"""
+        if self.state == OPEN:
+            if self._clock() < self.retry_at:
+                return False
+            self.state = HALF_OPEN  # Let one trial call through
+        return True
+
+    def record_success(self):
+        """Close the circuit after a successful call"""
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        """Count a failed call; open the circuit at the threshold or after a failed trial"""
+        self.failures += 1
+        if self.state == HALF_OPEN or (
+            self.failure_threshold and self.failures >= self.failure_threshold
+        ):
+            self.state = OPEN
+            self.opened_at = self._clock()
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Hot-reloading configuration cache for CCTray Build Status Monitor
+
+config.json5 and config_user.json5 are parsed once and kept in memory. A request
+only compares file modification times (at most once per check interval); when a
+file changed it is parsed and validated again, everything derived from it (feed
+regexes, URL sanitizers, schedules, the /api/config payload) is rebuilt, and the
+new object is swapped in atomically. A file that fails to parse or validate keeps
+the previous configuration in place.
+"""
+import os
+import threading
+import time
+
+from filters import ProjectFilter
+from models import FeedInfo
+
+DEFAULT_COLORS = {
+    "success": "#4CAF50",
+    "failure": "#f44336",
+    "exception": "#ff9800",
+    "unknown": "#9e9e9e",
+    "building": "#2196F3",
+}
+
+# Map lowercase color keys to proper case status names used in CCTray XML
+# Standard CCTray statuses: Success, Failure, Exception, Unknown
+# Building is typically an activity, but we include it if present in colors
+COLOR_TO_STATUS = {
+    "success": "Success",
+    "failure": "Failure",
+    "exception": "Exception",
+    "unknown": "Unknown",
+    "building": "Building",  # May not be a standard status, but included if in config
+}
+
+
+def read_json5(path):
+    """Parse a JSON5 file"""
+    import json5
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json5.load(f)
+
+
+class AppConfig:
+    """Parsed config.json5 with the /api/config payload built once"""
+
+    def __init__(self, raw):
+        if not isinstance(raw, dict):
+            raise ValueError("config.json5 must contain an object")
+        self.raw = raw
+        self.client_config = self._build_client_config(raw)
+
+    @staticmethod
+    def _build_client_config(config):
+        colors = config.get("colors", DEFAULT_COLORS)
+
+        # Create status mapping: color key -> CCTray status name
+        status_mapping = {}
+        for color_key in colors.keys():
+            # Use predefined mapping, or capitalize if not in mapping
+            status_name = COLOR_TO_STATUS.get(color_key, color_key.capitalize())
+            status_mapping[color_key] = status_name
+
+        return {
+            "refresh_interval": config.get("refresh_interval", 5)
+            * 1000,  # Convert to milliseconds
+            "font_size": config.get("font_size", 14),
+            "cards_per_row": config.get("cards_per_row", 4),
+            "card_size": config.get(
+                "card_size",
+                {
+                    "min_width": "200px",
+                    "max_width": "320px",
+                    "padding": "15px",
+                    "gap": "15px",
+                },
+            ),
+            "background_color": config.get("background_color", "#666666"),
+            "header_background_image": config.get("header_background_image", ""),
+            "header_text_color": config.get("header_text_color", "#333333"),
+            "colors": colors,
+            "status_mapping": status_mapping,  # Map color keys to CCTray status names
+            # Server-Sent Events channel (stream_server.py); the page polls without it
+            "stream_port": config.get("stream_port"),
+            "stream_url": config.get("stream_url", ""),
+            # Feeds with at least this many projects render only the visible cards
+            "virtualize_threshold": config.get("virtualize_threshold", 0),
+        }
+
+
+class FeedSpec:
+    """
+    Validated settings of one feed from config_user.json5, precompiled once per load
+
+    Args:
+        feed: Feed dict from config_user.json5
+    """
+
+    def __init__(self, feed):
+        if not isinstance(feed, dict):
+            raise ValueError("each feed must be an object")
+        self.name = feed.get("name", "Unknown Feed")
+        self.url = feed.get("url", "")
+        self.main_url = feed.get("main_url", "")
+        self.poll_interval = feed.get("poll_interval")  # None: poller default
+        self.min_poll_interval = feed.get("min_poll_interval")  # None: scheduler default
+        self.max_poll_interval = feed.get("max_poll_interval")  # None: scheduler default
+        self.timeout = feed.get("timeout", 10)
+        self.http = feed.get("http")
+        self.stream_parse = feed.get("stream_parse")  # None: poller default
+        self.filter_regex = feed.get("filter_regex", "")
+
+        # filter_regex and exclude_regex drop matching projects, include_regex keeps
+        # only matching ones; compiled here so polls only look up cached results
+        exclude = ProjectFilter.patterns(self.filter_regex) + ProjectFilter.patterns(
+            feed.get("exclude_regex")
+        )
+        self.project_filter = ProjectFilter(self.name, feed.get("include_regex"), exclude)
+        self.filter_errors = self.project_filter.errors
+
+        # Base URL and URL sanitizer, shared by every project of the feed
+        self.info = FeedInfo(self.name, self.url, self.main_url) if self.url else None
+
+    @property
+    def source(self):
+        """What parsed projects depend on: (feed_name, feed_url, main_url)"""
+        return (self.name, self.url, self.main_url)
+
+    def filter(self, projects):
+        """Apply the feed's include/exclude patterns to parsed projects"""
+        return self.project_filter.apply(projects)
+
+
+class UserConfig:
+    """Parsed config_user.json5 with its feeds precompiled into FeedSpecs"""
+
+    def __init__(self, raw):
+        if not isinstance(raw, dict):
+            raise ValueError("config_user.json5 must contain an object")
+        feeds = raw.get("feeds", [])
+        if not isinstance(feeds, list):
+            raise ValueError('"feeds" must be a list')
+        self.raw = raw
+        self.feeds = [FeedSpec(feed) for feed in feeds]
+
+
+class ConfigStore:
+    """
+    Keep a parsed configuration file in memory and reload it when it changes
+
+    Args:
+        paths: Candidate files in priority order; the first existing one is used
+            (e.g. a local debug config that overrides the regular one)
+        build: Callable turning the parsed dict into the stored object; it may raise
+            to reject an invalid file
+        check_interval: Minimum seconds between file modification checks
+        read: Callable parsing a file path into a dict
+        clock: Callable returning a monotonic time in seconds
+    """
+
+    def __init__(self, paths, build, check_interval=1.0, read=read_json5, clock=time.monotonic):
+        self.paths = list(paths)
+        self.check_interval = check_interval
+        self.version = 0
+        self.last_error = None
+        self._build = build
+        self._read = read
+        self._clock = clock
+        self._signature = None
+        self._current = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the current configuration object, reloading it if its file changed"""
+        if self._current is None or self._clock() >= self._next_check:
+            self._refresh()
+        return self._current
+
+    def _file_signature(self):
+        """Return (path, mtime_ns, size) of the first existing file, or None"""
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            return (path, stat.st_mtime_ns, stat.st_size)
+        return None
+
+    def _refresh(self):
+        with self._lock:
+            now = self._clock()
+            if self._current is not None and now < self._next_check:
+                return  # Another thread just checked
+            self._next_check = now + self.check_interval
+
+            signature = self._file_signature()
+            if self._current is not None and signature == self._signature:
+                return
+
+            try:
+                raw = self._read(signature[0]) if signature else {}
+                current = self._build(raw)
+            except Exception as e:
+                self.last_error = f"Error loading {signature[0] if signature else 'config'}: {e}"
+                print(self.last_error)
+                if self._current is None:
+                    self._current = self._build({})
+                # Keep the previous configuration; retry when the file changes again
+                self._signature = signature
+                return
+
+            self._current = current
+            self._signature = signature
+            self.last_error = None
+            self.version += 1
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned snapshot deltas for CCTray Build Status Monitor
+
+Every snapshot whose projects differ from the previous one gets the next version
+number. A client that already has version N calls /api/status?since=N and gets
+only the projects that were added, changed or removed since then, instead of the
+whole project list. The page applies the delta to its local copy (see
+updateStatus() in templates/index.html, which mirrors apply_delta below).
+
+Delta format:
+    {
+        "added":   [{"index": <position in the new list>, "project": {...}}, ...],
+        "changed": [{...}, ...],                      # full project dicts
+        "removed": [{"feedName": ..., "name": ...}, ...],
+        "order":   [{"feedName": ..., "name": ...}, ...]  # only if projects moved
+    }
+Projects are identified by (feedName, name).
+"""
+import threading
+from collections import OrderedDict
+
+from filters import criteria_key
+
+
+def project_key(project):
+    """Identity of a project dict across snapshots"""
+    return (project["feedName"], project["name"])
+
+
+def _key_dict(key):
+    return {"feedName": key[0], "name": key[1]}
+
+
+def compute_delta(old_projects, new_projects):
+    """
+    Compute the delta turning one project list into another
+
+    Args:
+        old_projects: Project records (or dicts) the client has
+        new_projects: Project records (or dicts) of the current snapshot
+
+    Returns:
+        Delta dict, or None if project keys are not unique and a full list is needed
+    """
+    old = OrderedDict()
+    for project in old_projects:
+        old[project_key(project)] = project
+    new = OrderedDict()
+    for project in new_projects:
+        new[project_key(project)] = project
+    if len(old) != len(old_projects) or len(new) != len(new_projects):
+        return None
+
+    added = []
+    changed = []
+    for index, (key, project) in enumerate(new.items()):
+        previous = old.get(key)
+        if previous is None:
+            added.append({"index": index, "project": _as_dict(project)})
+        elif previous != project:
+            changed.append(_as_dict(project))
+    removed = [_key_dict(key) for key in old if key not in new]
+
+    delta = {"added": added, "changed": changed, "removed": removed}
+
+    # Kept projects normally stay in the same relative order; send the full order
+    # only when they were rearranged (e.g. feeds reordered in config_user.json5)
+    kept_old = [key for key in old if key in new]
+    kept_new = [key for key in new if key in old]
+    if kept_old != kept_new:
+        delta["order"] = [_key_dict(key) for key in new]
+    return delta
+
+
+def _as_dict(project):
+    return project if isinstance(project, dict) else project.to_dict()
+
+
+def apply_delta(projects, delta):
+    """
+    Apply a delta to a list of project dicts
+
+    Args:
+        projects: Project dicts the client has
+        delta: Delta dict from compute_delta()
+
+    Returns:
+        New list of project dicts
+    """
+    by_key = OrderedDict((project_key(p), p) for p in projects)
+    for key in delta["removed"]:
+        by_key.pop(project_key(key), None)
+    for project in delta["changed"]:
+        by_key[project_key(project)] = project
+
+    if "order" in delta:
+        for entry in delta["added"]:
+            by_key[project_key(entry["project"])] = entry["project"]
+        return [by_key[project_key(key)] for key in delta["order"]]
+
+    result = list(by_key.values())
+    for entry in delta["added"]:  # Ascending positions in the new list
+        result.insert(entry["index"], entry["project"])
+    return result
+
+
+class SnapshotHistory:
+    """
+    Recent snapshots by version, with the deltas between them cached
+
+    Args:
+        size: Number of versions kept; clients further behind get a full list
+        cache_size: Number of computed deltas kept
+    """
+
+    def __init__(self, size=30, cache_size=64):
+        self.size = size
+        self.cache_size = cache_size
+        self._snapshots = OrderedDict()  # Version -> Snapshot
+        self._deltas = OrderedDict()  # (since, version, criteria) -> delta
+        self._lock = threading.Lock()
+
+    def record(self, snapshot):
+        """Remember a published snapshot (called by the poller for each new version)"""
+        with self._lock:
+            self._snapshots[snapshot.version] = snapshot
+            while len(self._snapshots) > self.size:
+                self._snapshots.popitem(last=False)
+
+    def delta(self, since, snapshot, criteria=None):
+        """
+        Return the delta from version `since` to `snapshot`
+
+        Args:
+            since: Version the client has
+            snapshot: Current Snapshot
+            criteria: Query filters from filters.parse_query_filters(); the delta
+                then covers only the selected projects
+
+        Returns:
+            Delta dict, or None if `since` is unknown (too old, or from before a
+            restart) and the client needs the full list
+        """
+        criteria = criteria or {}
+        cache_key = (since, snapshot.version, criteria_key(criteria))
+        with self._lock:
+            if cache_key in self._deltas:
+                self._deltas.move_to_end(cache_key)
+                return self._deltas[cache_key]
+            old = self._snapshots.get(since)
+        if old is None or since > snapshot.version:
+            return None
+
+        old_projects = old.select(criteria)[0] if criteria else old.projects
+        new_projects = snapshot.select(criteria)[0] if criteria else snapshot.projects
+        delta = compute_delta(old_projects, new_projects)
+        if delta is None:
+            return None
+
+        with self._lock:
+            self._deltas[cache_key] = delta
+            while len(self._deltas) > self.cache_size:
+                self._deltas.popitem(last=False)
+        return delta
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Local fake CCTray HTTP server for tests and benchmarks
+
+Serves a synthetic CCTray XML document on 127.0.0.1 and counts the requests it
+receives, so tests can prove how often the application talks to the CI server.
+"""
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import quoteattr
+
+from models import Project
+
+
+def make_project(feed, name, status="Success", activity="Sleeping", label="1", category=""):
+    """Build one Project record of `feed` (a FeedInfo) without going through XML"""
+    return Project(name, activity, status, label, "", "", category, feed)
+
+
+def make_cctray_xml(project_count, status="Success", activity="Sleeping", prefix="Project"):
+    """
+    Build a synthetic CCTray XML document
+
+    Args:
+        project_count: Number of <Project> elements to generate
+        status: lastBuildStatus of every project
+        activity: activity of every project
+        prefix: Project name prefix
+
+    Returns:
+        XML document as a str
+    """
+    parts = ["<Projects>"]
+    for i in range(project_count):
+        parts.append(
+            "<Project name={} activity={} lastBuildStatus={} lastBuildLabel={} "
+            "lastBuildTime={} webUrl={} category={}/>".format(
+                quoteattr(f"{prefix} {i}"),
+                quoteattr(activity),
+                quoteattr(status),
+                quoteattr(str(1000 + i)),
+                quoteattr("2026-01-13T16:04:33"),
+                quoteattr(f"http://localhost:8111/viewType.html?buildTypeId=bt{i}"),
+                quoteattr(f"Category {i % 5}"),
+            )
+        )
+    parts.append("</Projects>")
+    return "\n".join(parts)
+
+
+class FakeCCTrayServer:
+    """
+    Threaded HTTP server serving a CCTray XML document
+
+    Usage:
+        with FakeCCTrayServer(make_cctray_xml(10)) as server:
+            url = server.url  # e.g. http://127.0.0.1:54321/projects.xml
+            ...
+            server.request_count
+    """
+
+    def __init__(
+        self,
+        xml_content="",
+        status_code=200,
+        latency=0.0,
+        etag=False,
+        last_modified=None,
+        failure_rate=0.0,
+        seed=None,
+    ):
+        self.xml_content = xml_content
+        self.status_code = status_code
+        self.latency = latency  # Seconds to wait before answering
+        self.failure_rate = failure_rate  # Fraction of requests answered with 500
+        self._random = random.Random(seed)
+        self.etag = etag  # Send an ETag and answer If-None-Match with 304
+        self.last_modified = last_modified  # Last-Modified value honoured in If-Modified-Since
+        self.request_count = 0
+        self.not_modified_count = 0
+        self.failure_count = 0
+        self._count_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """URL of the served feed"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/projects.xml"
+
+    def start(self):
+        """Start serving in a background thread"""
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            name="fake-cctray",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server and release its port"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _record_request(self):
+        with self._count_lock:
+            self.request_count += 1
+
+    def _should_fail(self):
+        """Decide whether this request is answered with an injected 500"""
+        with self._count_lock:
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                self.failure_count += 1
+                return True
+            return False
+
+    def _record_not_modified(self):
+        with self._count_lock:
+            self.not_modified_count += 1
+
+    def _validators(self, body):
+        headers = {}
+        if self.etag:
+            headers["ETag"] = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.last_modified:
+            headers["Last-Modified"] = self.last_modified
+        return headers
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server._record_request()
+                if server.latency:
+                    time.sleep(server.latency)
+                if server._should_fail():
+                    self.send_response(500)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = server.xml_content.encode("utf-8")
+                validators = server._validators(body)
+                etag_matches = (
+                    "ETag" in validators
+                    and self.headers.get("If-None-Match") == validators["ETag"]
+                )
+                date_matches = (
+                    "Last-Modified" in validators
+                    and self.headers.get("If-Modified-Since") == validators["Last-Modified"]
+                )
+                not_modified = server.status_code == 200 and (etag_matches or date_matches)
+
+                self.send_response(304 if not_modified else server.status_code)
+                for name, value in validators.items():
+                    self.send_header(name, value)
+                if not_modified:
+                    server._record_not_modified()
+                    self.end_headers()
+                    return
+                self.send_header("Content-Type", "application/xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Keep test output quiet
+                pass
+
+        return Handler
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Project filtering for CCTray Build Status Monitor
+
+Two kinds of filters live here:
+    ProjectFilter - per-feed include/exclude regexes from config_user.json5. The
+                    patterns are compiled once per config load, the filtered list
+                    of an unchanged document is reused, and every project name's
+                    result is remembered, so a poll only runs the regexes for
+                    names it has not seen before.
+    ProjectIndex  - positions of a snapshot's projects by feed, status, category
+                    and activity, built once per snapshot. /api/status query
+                    filters (?feed=, ?status=, ?category=, ?activity=) are
+                    answered by intersecting these lists instead of scanning
+                    every project.
+"""
+import re
+from collections import OrderedDict
+
+# Query string parameters answered from ProjectIndex
+QUERY_FIELDS = ("feed", "status", "category", "activity")
+
+# Query field -> Project attribute ("feed" is read from the project's FeedInfo)
+_ATTRIBUTES = {
+    "status": "last_build_status",
+    "category": "category",
+    "activity": "activity",
+}
+
+
+class ProjectFilter:
+    """
+    Include/exclude filter of one feed, compiled once per config load
+
+    A project is kept when it matches any include pattern (or there are none) and
+    matches no exclude pattern. Invalid patterns are skipped and reported in
+    `errors` so the feed is still shown.
+
+    Args:
+        feed_name: Feed name used in error messages
+        include: Regex string or list of regex strings (include_regex)
+        exclude: Regex string or list of regex strings (filter_regex/exclude_regex)
+        cache_size: Minimum number of remembered project names (least recently
+            used first out); grows to the size of the largest list filtered
+    """
+
+    def __init__(self, feed_name, include=None, exclude=None, cache_size=4096):
+        self.errors = []
+        self.include = self._compile(feed_name, "include_regex", include)
+        self.exclude = self._compile(feed_name, "filter_regex", exclude)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # Project name -> kept
+        self._last = (None, None)  # (project list, filtered list) of the last apply()
+
+    @staticmethod
+    def patterns(value):
+        """
+        Turn a config value that may be a regex string or a list of them into a list
+
+        Raises:
+            ValueError: If the value is neither
+        """
+        if not value:
+            return []
+        if isinstance(value, str):
+            return [value]
+        if isinstance(value, (list, tuple)) and all(isinstance(p, str) for p in value):
+            return [pattern for pattern in value if pattern]
+        raise ValueError(f"expected a regex string or a list of regex strings, got {value!r}")
+
+    def _compile(self, feed_name, key, value):
+        patterns = []
+        for pattern in self.patterns(value):
+            try:
+                patterns.append(re.compile(pattern))
+            except re.error as e:
+                self.errors.append(f"Invalid {key} for feed '{feed_name}': {str(e)}")
+        return patterns
+
+    @property
+    def active(self):
+        """True if the filter can drop projects"""
+        return bool(self.include or self.exclude)
+
+    def keeps(self, name):
+        """Return True if a project with this name passes the filter"""
+        cache = self._cache
+        kept = cache.get(name)
+        if kept is None:
+            kept = (not self.include or any(p.search(name) for p in self.include)) and not any(
+                p.search(name) for p in self.exclude
+            )
+            if len(cache) >= self.cache_size:
+                cache.popitem(last=False)
+            cache[name] = kept
+        else:
+            cache.move_to_end(name)
+        return kept
+
+    def apply(self, projects):
+        """
+        Return the projects that pass the filter (the same list if none is configured)
+
+        The poller keeps the parsed project list while a feed's document is
+        unchanged, so filtering the same list again returns the previous result.
+        """
+        if not self.active:
+            return projects
+        last_projects, last_result = self._last
+        if projects is last_projects:
+            return last_result
+        # Every name of a feed fits, so an in-order scan never evicts what the
+        # next poll needs
+        self.cache_size = max(self.cache_size, len(projects))
+        keeps = self.keeps
+        result = [p for p in projects if keeps(p.name)]
+        self._last = (projects, result)
+        return result
+
+
+class ProjectIndex:
+    """
+    Positions of a snapshot's projects grouped by feed, status, category and activity
+
+    Keys are compared case-insensitively. Built once per snapshot and only read
+    afterwards, so it can be shared by concurrent requests.
+
+    Args:
+        projects: Project records in snapshot order
+    """
+
+    def __init__(self, projects):
+        self.projects = projects
+        self._positions = {field: {} for field in QUERY_FIELDS}
+        for position, project in enumerate(projects):
+            for field, positions in self._positions.items():
+                key = self._value(project, field).casefold()
+                positions.setdefault(key, []).append(position)
+
+    @staticmethod
+    def _value(project, field):
+        if field == "feed":
+            return project.feed.name
+        return getattr(project, _ATTRIBUTES[field])
+
+    def select(self, criteria):
+        """
+        Return the projects matching all criteria, in snapshot order
+
+        Args:
+            criteria: Dict of query field -> list of accepted values; values of one
+                field are alternatives, different fields must all match
+
+        Returns:
+            List of Project records
+        """
+        selected = None
+        for field, values in criteria.items():
+            positions = self._positions[field]
+            matches = set()
+            for value in values:
+                matches.update(positions.get(value.casefold(), ()))
+            selected = matches if selected is None else selected & matches
+            if not selected:
+                return []
+        if selected is None:
+            return self.projects
+        return [self.projects[position] for position in sorted(selected)]
+
+    def count(self, field, value):
+        """Number of projects with the given field value"""
+        return len(self._positions[field].get(value.casefold(), ()))
+
+
+def criteria_key(criteria):
+    """Hashable form of parse_query_filters() output, for cache keys"""
+    return tuple((field, tuple(values)) for field, values in sorted(criteria.items()))
+
+
+def parse_query_filters(args):
+    """
+    Read ?feed=, ?status=, ?category= and ?activity= from request arguments
+
+    A parameter may be repeated or hold comma-separated values
+    (e.g. ?status=Failure,Exception).
+
+    Args:
+        args: Mapping with a getlist() method (Flask's request.args)
+
+    Returns:
+        Dict of query field -> list of values; empty if no filter was given
+    """
+    criteria = {}
+    for field in QUERY_FIELDS:
+        values = []
+        for raw in args.getlist(field):
+            values.extend(value.strip() for value in raw.split(",") if value.strip())
+        if values:
+            criteria[field] = values
+    return criteria
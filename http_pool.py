@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Pooled keep-alive HTTP sessions for CCTray Build Status Monitor
+
+Every upstream CI host gets its own requests.Session with a sized connection pool
+and a retry/backoff policy, so polls reuse open TCP/TLS connections instead of
+connecting again each time. The poller caps the number of fetches it starts
+against one host at the same time (max_per_host), so many feeds on one CI server
+don't hit it at once.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from util import get_base_url
+
+DEFAULT_HTTP_OPTIONS = {
+    "pool_size": 2,  # Connections kept open per upstream host
+    "retries": 1,  # Retries on connection errors and 502/503/504 responses
+    "backoff_factor": 0.5,  # Seconds; doubled after every retry
+    "keep_alive": True,
+    "max_per_host": 2,  # Concurrent fetches per upstream host (0 = unlimited), pool-wide only
+}
+
+
+class CountingAdapter(HTTPAdapter):
+    """HTTPAdapter that counts opened, reused and failed connections"""
+
+    def __init__(self, *args, **kwargs):
+        self._stats_lock = threading.Lock()
+        self.opened = 0
+        self.attempts = 0
+        self.failed = 0
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        def counting(pool_class):
+            class CountingConnection(pool_class.ConnectionCls):
+                def connect(self):
+                    # Called for every new TCP (and TLS) connection, including
+                    # reconnects of a pooled connection the server closed
+                    adapter._count("opened")
+                    return super().connect()
+
+            class CountingPool(pool_class):
+                ConnectionCls = CountingConnection
+
+                def urlopen(self, *args, **kwargs):
+                    # Retries call urlopen again, so every attempt is counted
+                    adapter._count("attempts")
+                    return super().urlopen(*args, **kwargs)
+
+            return CountingPool
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": counting(HTTPConnectionPool),
+            "https": counting(HTTPSConnectionPool),
+        }
+
+    def send(self, request, **kwargs):
+        try:
+            return super().send(request, **kwargs)
+        except requests.exceptions.RequestException:
+            self._count("failed")
+            raise
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        """Return a dict of connection counters"""
+        with self._stats_lock:
+            return {
+                "opened": self.opened,
+                "reused": max(0, self.attempts - self.opened),
+                "failed": self.failed,
+            }
+
+
+class SessionPool:
+    """
+    Keep one requests.Session per upstream host and HTTP option set
+
+    Args:
+        defaults: Default HTTP options (see DEFAULT_HTTP_OPTIONS), usually the "http"
+            section of config.json5. A feed can override them with its own "http" dict.
+    """
+
+    def __init__(self, defaults=None):
+        self.defaults = dict(DEFAULT_HTTP_OPTIONS)
+        self.defaults.update(defaults or {})
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def options_for(self, overrides=None):
+        """Merge feed-level HTTP options over the pool defaults"""
+        options = dict(self.defaults)
+        options.update(overrides or {})
+        return options
+
+    def session_for(self, url, overrides=None):
+        """
+        Return the shared session for the host of url
+
+        Args:
+            url: Feed URL; credentials are ignored when building the key
+            overrides: Optional feed-level HTTP options
+
+        Returns:
+            requests.Session reused across polls of the same host
+        """
+        options = self.options_for(overrides)
+        key = (get_base_url(url), tuple(sorted(options.items())))
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._create_session(options)
+                self._sessions[key] = session
+            return session
+
+    @property
+    def max_per_host(self):
+        """
+        Fetches allowed to run against one host at the same time (0 = unlimited)
+
+        The limit applies to the whole pool (feed-level "http" options can't raise it).
+        """
+        return self.defaults["max_per_host"]
+
+    @staticmethod
+    def host_key(url):
+        """Host that max_per_host counts a fetch of url against (without credentials)"""
+        return get_base_url(url)
+
+    def stats(self):
+        """Return connection counters per upstream host (without credentials)"""
+        totals = {}
+        with self._lock:
+            items = list(self._sessions.items())
+        for (host, _options), session in items:
+            host_stats = totals.setdefault(host, {"opened": 0, "reused": 0, "failed": 0})
+            # The same adapter is mounted for http:// and https://
+            adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+            for adapter in adapters.values():
+                if isinstance(adapter, CountingAdapter):
+                    for name, value in adapter.stats().items():
+                        host_stats[name] += value
+        return totals
+
+    def close(self):
+        """Close every session and its pooled connections"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+        for session in sessions:
+            session.close()
+
+    def _create_session(self, options):
+        retries = Retry(
+            total=options["retries"],
+            backoff_factor=options["backoff_factor"],
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = CountingAdapter(
+            pool_connections=1,
+            pool_maxsize=options["pool_size"],
+            max_retries=retries,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Connection"] = "keep-alive" if options["keep_alive"] else "close"
+        return session
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+JSON serialization for CCTray Build Status Monitor
+
+/api/status bodies are produced by dumps_bytes(), which uses orjson when it is
+installed and the standard library otherwise. Both backends use compact
+separators, keys in insertion order and non-ASCII characters as UTF-8, so the
+bodies the app produces (strings, integers, plain floats) are the same bytes
+with either. They differ for floats written with an exponent (orjson 1e16 and
+1.5e-7, the stdlib 1e+16 and 1.5e-07) and for NaN and infinities, which orjson
+writes as null and the stdlib as NaN/Infinity. Lists of Project records are not converted to dicts; every record's JSON
+is encoded once (Project.to_json) and the cached fragments are joined, so
+serializing a snapshot whose projects didn't change is mostly a bytes join.
+
+FastJSONProvider plugs the same serializer into Flask, so jsonify() uses it too.
+Like Flask's default provider it sorts keys (sort_keys=True); responses built
+with jsonify() keep the sorted key order they always had.
+
+orjson is optional: install the "orjson" package to enable it.
+"""
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+from models import Project
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ("orjson", "json") if orjson is not None else ("json",)
+DEFAULT_BACKEND = BACKENDS[0]
+
+if orjson is not None:
+    # Let `default` handle what the stdlib can't serialize natively, so both
+    # backends produce the same output for it
+    _ORJSON_OPTIONS = (
+        orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+
+def _stdlib_encoder(default, sort_keys=False):
+    encoder = json.JSONEncoder(
+        ensure_ascii=False, separators=(",", ":"), default=default, sort_keys=sort_keys
+    )
+    return lambda obj: encoder.encode(obj).encode("utf-8")
+
+
+def _orjson_encoder(default, sort_keys=False):
+    fallback = _stdlib_encoder(default, sort_keys)
+    options = _ORJSON_OPTIONS | orjson.OPT_SORT_KEYS if sort_keys else _ORJSON_OPTIONS
+
+    def encode(obj):
+        try:
+            return orjson.dumps(obj, default=default, option=options)
+        except TypeError:
+            # Values orjson doesn't support (e.g. integers beyond 64 bits)
+            return fallback(obj)
+
+    return encode
+
+
+def _project_default(obj):
+    if isinstance(obj, Project):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj, backend=None, default=None, sort_keys=False):
+    """
+    Serialize obj to compact UTF-8 JSON bytes
+
+    Args:
+        obj: Value to serialize; lists of Project records are written from the
+            records' cached JSON fragments
+        backend: "orjson" or "json" (default: orjson if installed)
+        default: Callable for otherwise unsupported objects (like json.dumps' default)
+        sort_keys: Sort the keys of every object; Project records are then encoded
+            from to_dict() instead of their cached fragments, which keep the
+            API's field order
+
+    Returns:
+        bytes
+    """
+    default = default or _project_default
+    if (backend or DEFAULT_BACKEND) == "orjson":
+        encode = _orjson_encoder(default, sort_keys)
+    else:
+        encode = _stdlib_encoder(default, sort_keys)
+    if sort_keys:
+        return encode(obj)
+    return _assemble(obj, encode)
+
+
+def _assemble(obj, encode):
+    """Encode containers of Project records from fragments and everything else with encode"""
+    if isinstance(obj, dict):
+        if not all(isinstance(key, str) for key in obj):
+            return encode(obj)
+        parts = [encode(key) + b":" + _assemble(value, encode) for key, value in obj.items()]
+        return b"{" + b",".join(parts) + b"}"
+    if isinstance(obj, (list, tuple)) and obj and isinstance(obj[0], Project):
+        return b"[" + b",".join(
+            item.to_json() if isinstance(item, Project) else _assemble(item, encode)
+            for item in obj
+        ) + b"]"
+    return encode(obj)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider serializing with dumps_bytes() (orjson when installed)"""
+
+    ensure_ascii = False
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Explicit options (e.g. indent) are only supported by the stdlib
+            kwargs.setdefault("default", self.default)
+            kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+            kwargs.setdefault("sort_keys", self.sort_keys)
+            return json.dumps(obj, **kwargs)
+        return dumps_bytes(obj, default=self._default, sort_keys=self.sort_keys).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = dumps_bytes(obj, default=self._default, sort_keys=self.sort_keys) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+    def _default(self, obj):
+        if isinstance(obj, Project):
+            return obj.to_dict()
+        return self.default(obj)
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus-style metrics for CCTray Build Status Monitor
+
+Counters, gauges and histograms are kept in memory by a MetricsRegistry and
+exposed in the Prometheus text format on /metrics when "metrics": {"enabled": true}
+is set in config.json5. While the registry is disabled every observe/inc/set call
+returns immediately and timers are a shared no-op, so the instrumented code paths
+cost one attribute check.
+
+The metrics of the application are defined at the bottom of this module.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+_NULL_TIMER = nullcontext()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    """Base class of a metric family with a fixed set of label names"""
+
+    type = None
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}  # Label values tuple -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        try:
+            if len(labels) == len(self.label_names):
+                return tuple([str(labels[name]) for name in self.label_names])
+        except KeyError:
+            pass
+        raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+
+    def remove(self, **labels):
+        """Forget the series with these label values (e.g. of a removed feed)"""
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """Return [(suffix, labels string, value)] for the text format"""
+        with self._lock:
+            items = list(self._values.items())
+        return [("", _format_labels(self.label_names, key), value) for key, value in items]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels))
+
+
+class _Timer:
+    """Context manager observing the elapsed time into a histogram"""
+
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets
+
+    Args:
+        buckets: Upper bounds of the buckets in ascending order (+Inf is implied)
+    """
+
+    type = "histogram"
+
+    def __init__(self, registry, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (made cumulative when rendered), sum, count
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        """Return a context manager observing the duration of its block"""
+        if not self.registry.enabled:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        series = self._values.get(self._key(labels))
+        return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(series[0]), series[1], series[2])) for key, series in self._values.items()]
+        samples = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(
+                    ("_bucket", _format_labels(self.label_names, key, ("le", _format_number(float(bound)))), cumulative)
+                )
+            samples.append(("_bucket", _format_labels(self.label_names, key, ("le", "+Inf")), count))
+            labels = _format_labels(self.label_names, key)
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Collection of metric families rendered together
+
+    Args:
+        enabled: Record observations; while False all metric updates are no-ops
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(self, name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(self, name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labels, buckets))
+
+    def clear(self):
+        """Drop every recorded value (for tests)"""
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{labels} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Upstream feeds (recorded by the poller's worker threads)
+FETCH_SECONDS = REGISTRY.histogram(
+    "cctray_fetch_seconds", "Time to fetch a feed document from its CI server", ("feed",)
+)
+FETCH_FAILURES = REGISTRY.counter(
+    "cctray_fetch_failures_total", "Polls of a feed that failed or timed out", ("feed",)
+)
+RESPONSE_BYTES = REGISTRY.histogram(
+    "cctray_response_bytes", "Size of fetched feed documents", ("feed",), SIZE_BUCKETS
+)
+PARSE_SECONDS = REGISTRY.histogram(
+    "cctray_parse_seconds", "Time to parse a feed document (streamed documents include the download)", ("feed",)
+)
+PARSES = REGISTRY.counter(
+    "cctray_parse_total", "Fetched documents by parse outcome (parsed, not_modified, unchanged)", ("feed", "outcome")
+)
+FILTER_SECONDS = REGISTRY.histogram(
+    "cctray_filter_seconds", "Time to apply a feed's include/exclude patterns", ("feed",)
+)
+FEED_PROJECTS = REGISTRY.gauge("cctray_feed_projects", "Projects shown for a feed", ("feed",))
+FEED_STALE = REGISTRY.gauge(
+    "cctray_feed_stale", "1 while a feed shows the projects of an earlier poll because the last one failed", ("feed",)
+)
+
+# Responses
+SERIALIZE_SECONDS = REGISTRY.histogram(
+    "cctray_status_serialize_seconds", "Time to serialize an /api/status body"
+)
+RESPONSE_CACHE = REGISTRY.counter(
+    "cctray_response_cache_requests_total", "/api/status response cache lookups by result (hit, miss)", ("result",)
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "cctray_http_request_seconds", "Time to handle an HTTP request", ("endpoint", "status")
+)
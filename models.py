@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Compact in-memory records for CCTray projects
+
+Projects are kept as __slots__ objects instead of nine-key dicts. Values that repeat
+across projects (status, activity, category) are interned, and the feed name and
+base URL are stored once per feed in a FeedInfo shared by all of its projects. The
+API's JSON shape is only produced when a response is serialized (Project.to_dict),
+and a record's encoded JSON is kept once produced (Project.to_json).
+"""
+import json
+import sys
+from json.encoder import encode_basestring
+
+from util import get_base_url, get_url_sanitizer
+
+
+class FeedInfo:
+    """Feed-level fields shared by every project of one feed"""
+
+    __slots__ = ("name", "feed_url", "main_url", "base_url", "sanitizer")
+
+    def __init__(self, name, feed_url, main_url=""):
+        self.name = name
+        self.feed_url = feed_url  # May contain credentials; never serialized
+        self.main_url = main_url
+        # Use main_url for feed base URL if available, otherwise use feed_url base
+        self.base_url = get_base_url(main_url) if main_url else get_base_url(feed_url)
+        # Prepared once per feed URL pair and shared between polls
+        self.sanitizer = get_url_sanitizer(feed_url, main_url)
+
+    def __eq__(self, other):
+        if not isinstance(other, FeedInfo):
+            return NotImplemented
+        return (self.name, self.base_url) == (other.name, other.base_url)
+
+    def __hash__(self):
+        return hash((self.name, self.base_url))
+
+    def __repr__(self):
+        return f"FeedInfo({self.name!r}, base_url={self.base_url!r})"
+
+
+class Project:
+    """One CCTray project; feed-level fields are read from its FeedInfo"""
+
+    __slots__ = (
+        "name",
+        "activity",
+        "last_build_status",
+        "last_build_label",
+        "last_build_time",
+        "web_url",
+        "category",
+        "feed",
+        "_json",
+    )
+
+    # JSON key -> attribute, in the order of the API response
+    FIELDS = (
+        ("name", "name"),
+        ("activity", "activity"),
+        ("lastBuildStatus", "last_build_status"),
+        ("lastBuildLabel", "last_build_label"),
+        ("lastBuildTime", "last_build_time"),
+        ("webUrl", "web_url"),
+        ("category", "category"),
+    )
+
+    def __init__(
+        self,
+        name,
+        activity,
+        last_build_status,
+        last_build_label,
+        last_build_time,
+        web_url,
+        category,
+        feed,
+    ):
+        self.name = name
+        self.activity = sys.intern(activity)
+        self.last_build_status = sys.intern(last_build_status)
+        self.last_build_label = last_build_label
+        self.last_build_time = last_build_time
+        self.web_url = web_url
+        self.category = sys.intern(category)
+        self.feed = feed
+        self._json = None
+
+    def to_dict(self):
+        """Return the project in the /api/status JSON shape"""
+        return {
+            "name": self.name,
+            "activity": self.activity,
+            "lastBuildStatus": self.last_build_status,
+            "lastBuildLabel": self.last_build_label,
+            "lastBuildTime": self.last_build_time,
+            "webUrl": self.web_url,
+            "category": self.category,
+            "feedName": self.feed.name,
+            "feedBaseUrl": self.feed.base_url,
+        }
+
+    def to_json(self):
+        """
+        Return to_dict() as compact UTF-8 JSON bytes, encoded on first use
+
+        Records are immutable and reused between polls while their feed document
+        doesn't change, so each one is encoded once (see json_provider.py).
+        """
+        encoded = self._json
+        if encoded is None:
+            values = self._values()[:-1] + (self.feed.name, self.feed.base_url)
+            try:
+                encoded = "{%s}" % ",".join(
+                    key + encode_basestring(value) for key, value in zip(_JSON_KEYS, values)
+                )
+            except TypeError:  # A non-string field
+                encoded = _json_encoder.encode(self.to_dict())
+            encoded = self._json = encoded.encode("utf-8")
+        return encoded
+
+    def for_feed(self, feed):
+        """Return a copy of the record belonging to another feed (FeedInfo)"""
+        return Project(*self._values()[:-1], feed)
+
+    def get(self, key, default=None):
+        """Dict-style access by JSON key (e.g. project.get("lastBuildStatus"))"""
+        if key == "feedName":
+            return self.feed.name
+        if key == "feedBaseUrl":
+            return self.feed.base_url
+        attribute = _ATTRIBUTES.get(key)
+        return getattr(self, attribute) if attribute else default
+
+    def __getitem__(self, key):
+        if key not in _ATTRIBUTES and key not in ("feedName", "feedBaseUrl"):
+            raise KeyError(key)
+        return self.get(key)
+
+    def _values(self):
+        return (
+            self.name,
+            self.activity,
+            self.last_build_status,
+            self.last_build_label,
+            self.last_build_time,
+            self.web_url,
+            self.category,
+            self.feed,
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, Project):
+            return NotImplemented
+        return self._values() == other._values()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Project({self.name!r}, {self.last_build_status!r}, feed={self.feed.name!r})"
+
+
+_ATTRIBUTES = dict(Project.FIELDS)
+
+# '"key":' prefixes of to_dict() in order, for Project.to_json
+_JSON_KEYS = tuple(
+    encode_basestring(key) + ":" for key, _ in Project.FIELDS + (("feedName", None), ("feedBaseUrl", None))
+)
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
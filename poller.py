@@ -0,0 +1,939 @@
+# -*- coding: utf-8 -*-
+"""
+Background polling engine for CCTray Build Status Monitor
+
+A single FeedPoller thread fetches every configured feed on its own schedule and
+keeps the parsed projects in an in-process snapshot. /api/status is answered from
+that snapshot, so the number of upstream requests depends on the poll interval
+and not on how many browsers are watching the dashboard.
+"""
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import metrics
+from cctray import fetch_cctray_document, parse_cctray_records, parse_cctray_stream_records
+from circuit_breaker import CLOSED, OPEN, CircuitBreaker
+from config_store import FeedSpec
+from deltas import SnapshotHistory
+from filters import ProjectIndex
+from http_pool import SessionPool
+from scheduler import AdaptiveScheduler, FeedSchedule, has_active_projects
+from snapshot_store import source_key
+
+
+class FeedState:
+    """Last known state of a single configured feed"""
+
+    def __init__(self, name, breaker=None):
+        self.name = name
+        self.projects = []
+        self.errors = []
+        self.updated_at = None  # Time of the last successful fetch
+        self.last_attempt = None
+        self.schedule = FeedSchedule()
+        self.document = None  # ParsedDocument of the last successful fetch
+        self.fetch = None  # Future of the last fetch applied (shared by concurrent cycles)
+        self.stale = False  # True while projects are from before the last failed poll
+        self.breaker = breaker
+        self.circuit = CLOSED  # Breaker state, copied into snapshots
+
+    @property
+    def next_poll(self):
+        """Time the feed is polled next"""
+        return self.schedule.next_poll
+
+    def to_status(self, now=None):
+        """
+        Describe the feed for API responses
+
+        Args:
+            now: Time to compute the snapshot "age" (seconds) for; without it the
+                status has no age, only "last_success", so it stays valid for as
+                long as the snapshot is served (see build_status)
+        """
+        updated = None
+        if self.updated_at is not None:
+            updated = datetime.fromtimestamp(self.updated_at).isoformat()
+        status = {
+            "name": self.name,
+            "updated": updated,
+            "last_success": self.updated_at,
+            "stale": self.stale,
+            "circuit": self.circuit,
+            "errors": list(self.errors) if self.errors else None,
+        }
+        if now is not None:
+            status["age"] = round(max(0.0, now - self.updated_at), 1) if self.updated_at is not None else None
+        return status
+
+
+class ParsedDocument:
+    """
+    Parsed projects of a feed document together with its cache validators
+
+    Kept per feed so that a 304 response, or a body whose hash matches the previous
+    one, reuses the parsed project list instead of parsing the XML again.
+    """
+
+    def __init__(self, source, projects, etag=None, last_modified=None, digest=None):
+        self.source = source  # (feed_name, feed_url, main_url) the projects were parsed for
+        self.projects = projects  # Unfiltered Project records
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+
+
+class FeedResult:
+    """Outcome of polling one feed"""
+
+    def __init__(
+        self,
+        projects=None,
+        errors=None,
+        ok=False,
+        finished_at=None,
+        document=None,
+        parse="failed",
+    ):
+        self.projects = projects if projects is not None else []
+        self.errors = errors if errors is not None else []
+        self.ok = ok
+        self.finished_at = finished_at
+        self.document = document
+        self.parse = parse  # "parsed", "not_modified", "unchanged" or "failed"
+
+
+class FetchedDocument:
+    """Outcome of fetching one upstream URL, shared by every feed that uses it"""
+
+    def __init__(self, document=None, parse="failed", error=None, finished_at=None):
+        self.document = document  # ParsedDocument, or None if the fetch failed
+        self.parse = parse  # "parsed", "not_modified", "unchanged" or "failed"
+        self.error = error  # Exception message if fetching or parsing raised
+        self.finished_at = finished_at
+
+
+class Refresh:
+    """A forced refresh in progress; callers refreshing the same feeds wait for it"""
+
+    def __init__(self, feed, started_at):
+        self.feed = feed  # Feed name, or None for every feed
+        self.started_at = started_at
+        self.done = threading.Event()
+        self.fetched = 0
+        self.error = None
+
+    def to_status(self, outcome):
+        return {
+            "feed": self.feed,
+            "outcome": "failed" if self.error is not None else outcome,
+            "fetched": self.fetched,
+            "error": self.error,
+        }
+
+
+class Snapshot:
+    """
+    Immutable view of every feed, published by the poller after each cycle
+
+    `version` increases whenever the project list differs from the previous
+    snapshot's, so clients can ask for the changes since the version they have.
+
+    Args:
+        feeds: FeedState copies of the feeds
+        created_at: Publication time
+        version: Snapshot version
+        previous: Snapshot published before; if the project lists are equal, its
+            list and index are reused (then `projects is previous.projects`)
+    """
+
+    sequence = 0  # Publication order among the snapshots of one poller
+
+    def __init__(self, feeds, created_at, version=0, previous=None):
+        self.feeds = feeds
+        self.created_at = created_at
+        self.version = version
+        if previous is not None:
+            self.sequence = previous.sequence + 1
+        self.projects = []
+        self.errors = []
+        for feed in feeds:
+            self.projects.extend(feed.projects)
+            self.errors.extend(feed.errors)
+        if previous is not None and self.projects == previous.projects:
+            self.projects = previous.projects
+            self.index = previous.index
+        else:
+            # Built once here, in the poller thread, so filtered requests only look it up
+            self.index = ProjectIndex(self.projects)
+
+    def select(self, criteria):
+        """
+        Return the projects and feeds matching /api/status query filters
+
+        Args:
+            criteria: Dict from filters.parse_query_filters()
+
+        Returns:
+            (projects, feeds) where feeds are the FeedStates of the selected feeds
+        """
+        projects = self.index.select(criteria)
+        feeds = self.feeds
+        if "feed" in criteria:
+            names = {name.casefold() for name in criteria["feed"]}
+            feeds = [feed for feed in feeds if feed.name.casefold() in names]
+        return projects, feeds
+
+    def feed_state(self):
+        """What clients show of the feeds besides their projects (errors, stale, circuit)"""
+        return tuple((feed.name, feed.stale, feed.circuit, tuple(feed.errors)) for feed in self.feeds)
+
+
+class FeedPoller:
+    """
+    Poll CCTray feeds in a background thread and keep the latest results in memory
+
+    Args:
+        load_feeds: Callable returning the configured feeds as FeedSpecs (or feed dicts
+            from config_user.json5). It is called once per poll cycle so feed changes
+            are picked up without a restart.
+        interval: Default poll interval in seconds; a feed may override it with "poll_interval"
+        fetch: Callable with the signature of cctray.fetch_cctray_document, returning
+            a CCTrayResponse or None on failure
+        clock: Callable returning the current time in seconds (injectable for tests)
+        max_workers: Number of feeds fetched in parallel
+        deadline: Seconds a poll cycle waits for its feeds; feeds still running after
+            that are reported with a timeout error and the cycle publishes what it has
+        sessions: SessionPool providing keep-alive sessions per upstream host
+        stream_parse: Parse feeds incrementally while they download instead of loading
+            the whole document first; a feed may override it with "stream_parse"
+        scheduler: AdaptiveScheduler choosing each feed's next poll time (default:
+            every feed is polled at its poll_interval, or `interval`)
+        breaker_threshold: Consecutive failed polls after which a feed's CI server is
+            not called for `breaker_cooldown` seconds (0 disables the circuit breaker)
+        breaker_cooldown: Seconds an open circuit waits before a trial poll
+        store: SnapshotStore the feeds' parsed documents are saved to, and restored
+            from by restore()
+        refresh_min_interval: Seconds between two forced refreshes of the same feed
+            by refresh(); refreshes asked for in between return without fetching
+    """
+
+    def __init__(
+        self,
+        load_feeds,
+        interval=5,
+        fetch=fetch_cctray_document,
+        clock=time.time,
+        max_workers=4,
+        deadline=10,
+        sessions=None,
+        stream_parse=False,
+        scheduler=None,
+        breaker_threshold=3,
+        breaker_cooldown=60,
+        store=None,
+        refresh_min_interval=10,
+    ):
+        self._load_feeds = load_feeds
+        self.interval = interval
+        self.scheduler = scheduler if scheduler is not None else AdaptiveScheduler(interval)
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self.sessions = sessions if sessions is not None else SessionPool()
+        self.stream_parse = stream_parse
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.store = store
+        self.refresh_min_interval = refresh_min_interval
+        self._fetch = fetch
+        self._clock = clock
+        self._executor = None
+        # (url, main_url) -> (Future, monotonic submit time) still running from an earlier cycle
+        self._in_flight = {}
+        self._parse_stats = {"parsed": 0, "not_modified": 0, "unchanged": 0, "shared": 0}
+        self._stats_lock = threading.Lock()
+        self._refreshes = {}  # Feed name (None: all feeds) -> Refresh in progress
+        self._last_refresh = {}  # Feed name (None: all feeds) -> start of the last refresh
+        self._refresh_lock = threading.Lock()
+        self._states = {}
+        self._stored_names = None  # Feed names the snapshot store was last pruned to
+        self._snapshot = None
+        # Versions start from the start time in milliseconds, so a version a client
+        # got from an earlier process is never mistaken for a current one
+        self._version = int(self._clock() * 1000)
+        self.history = SnapshotHistory()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background polling thread (no-op if already running)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="cctray-poller", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the background polling thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.sessions.close()
+        if self.store is not None:
+            self.store.close()
+
+    def restore(self):
+        """
+        Publish the feeds' last documents from the snapshot store, before the first poll
+
+        Restored projects are marked stale until their feed has been polled. Feeds
+        whose name or URLs changed since they were stored are left out.
+
+        Returns:
+            Number of feeds restored
+        """
+        if self.store is None:
+            return 0
+        stored = self.store.load()
+        if not stored:
+            return 0
+        with self._lock:
+            if self._snapshot is not None:
+                return 0  # Already polled; live data wins
+            states = {}
+            for feed in self._load_feeds() or []:
+                if not isinstance(feed, FeedSpec):
+                    feed = FeedSpec(feed)
+                record = stored.get(feed.name)
+                if record is None or feed.info is None or record.source != source_key(feed.source):
+                    continue
+                projects = record.projects(feed.info)
+                breaker = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown, self._clock)
+                state = FeedState(feed.name, breaker)
+                state.document = ParsedDocument(
+                    feed.source, projects, record.etag, record.last_modified, record.digest
+                )
+                state.projects = feed.filter(projects)
+                state.errors = list(feed.filter_errors)
+                state.updated_at = record.updated_at
+                state.stale = True
+                states[feed.name] = state
+                self.store.mark_written(feed.name, projects)
+            if not states:
+                return 0
+            self._states = states
+            self._publish(list(states.values()))
+            return len(states)
+
+    def add_listener(self, callback, changes_only=True):
+        """
+        Call callback(snapshot) from the poller thread whenever a new version is published
+
+        Callbacks must return quickly; they run before the next poll cycle.
+
+        Args:
+            changes_only: Only call it for new versions; otherwise it is called for
+                every published snapshot (feed errors and ages change without a
+                new version)
+        """
+        self._listeners.append((callback, changes_only))
+
+    def wait_ready(self, timeout=None):
+        """Block until the first poll cycle has published a snapshot"""
+        return self._ready.wait(timeout)
+
+    def snapshot(self):
+        """Return the latest published Snapshot, or None before the first cycle"""
+        return self._snapshot
+
+    def feed_statuses(self, feeds=None, now=None):
+        """
+        Return per-feed status dicts (including snapshot age) for the latest snapshot
+
+        Args:
+            feeds: FeedStates to describe instead of every feed of the snapshot
+            now: Time the ages are computed for (default: the current time)
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        if now is None:
+            now = self._clock()
+        return [feed.to_status(now) for feed in (feeds if feeds is not None else snapshot.feeds)]
+
+    def parse_stats(self):
+        """
+        Return how many fetched documents were parsed and how many parses were avoided
+
+        "not_modified" counts 304 responses to conditional GETs and "unchanged" counts
+        bodies whose hash matched the previously parsed document.
+        """
+        with self._stats_lock:
+            stats = dict(self._parse_stats)
+        stats["avoided"] = stats["not_modified"] + stats["unchanged"]
+        return stats
+
+    def refresh(self, feed=None, timeout=None):
+        """
+        Poll feeds now on behalf of a client, with single-flight semantics
+
+        Concurrent callers refreshing the same feed (or every feed) wait for one
+        fetch and share its result, and a caller refreshing one feed while every
+        feed is being refreshed joins that refresh. A refresh within
+        refresh_min_interval seconds of the previous one of the same feed returns
+        without fetching. Feeds with an open circuit breaker are not fetched.
+
+        Args:
+            feed: Name of the feed to refresh, or None for every feed
+            timeout: Seconds to wait for a refresh started by another caller
+
+        Returns:
+            Dict with "outcome" ("refreshed", "joined", "throttled", "timeout" when
+            the refresh that was joined didn't finish within `timeout`, or "failed"),
+            "fetched" (feeds fetched by the refresh), "error" and, when throttled,
+            "retry_after" in seconds
+        """
+        now = self._clock()
+        with self._refresh_lock:
+            flight = self._refreshes.get(feed) or self._refreshes.get(None)
+            joined = flight is not None
+            if not joined:
+                last = max(self._last_refresh.get(feed, 0), self._last_refresh.get(None, 0))
+                if now - last < self.refresh_min_interval:
+                    return {
+                        "feed": feed,
+                        "outcome": "throttled",
+                        "fetched": 0,
+                        "error": None,
+                        "retry_after": round(last + self.refresh_min_interval - now, 3),
+                    }
+                flight = self._refreshes[feed] = Refresh(feed, now)
+                self._last_refresh[feed] = now
+
+        if joined:
+            if not flight.done.wait(timeout):
+                return {
+                    "feed": feed,
+                    "outcome": "timeout",
+                    "fetched": 0,
+                    "error": f"Timed out after {timeout}s waiting for the refresh in progress",
+                }
+            return flight.to_status("joined")
+
+        try:
+            flight.fetched = self.poll_due(force=True, only=None if feed is None else {feed})
+        except Exception as e:
+            flight.error = str(e)
+            print(f"Error refreshing CCTray feeds: {e}")
+        finally:
+            with self._refresh_lock:
+                del self._refreshes[feed]
+            flight.done.set()
+        return flight.to_status("refreshed")
+
+    def poll_due(self, force=False, only=None):
+        """
+        Fetch every feed whose next poll time has passed and publish a new snapshot
+
+        Args:
+            force: Poll every feed regardless of its schedule
+            only: Names of the feeds `force` applies to (default: every feed)
+
+        Returns:
+            Number of feeds fetched in this cycle
+        """
+        # self._lock is only held to update the feed states, not while fetching
+        # (see _fetch_all), so refreshes don't wait for a slow cycle to finish
+        with self._lock:
+            feeds = self._load_feeds() or []
+            now = self._clock()
+            states = {}
+            due = []
+
+            for feed in feeds:
+                if not isinstance(feed, FeedSpec):
+                    feed = FeedSpec(feed)
+                state = self._states.get(feed.name)
+                if state is None:
+                    breaker = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown, self._clock)
+                    state = FeedState(feed.name, breaker)
+                states[feed.name] = state
+                if (force and (only is None or feed.name in only)) or now >= state.next_poll:
+                    if not state.breaker.allow():
+                        # Circuit open: keep serving the last good projects without
+                        # calling the CI server until the cooldown is over
+                        state.schedule.next_poll = state.breaker.retry_at
+                        continue
+                    due.append((feed, state))
+                    # Replaced by the scheduler once the fetch has an outcome
+                    state.schedule.next_poll = now + self.scheduler.limits(feed)[0]
+
+            # Drop feeds that were removed from the configuration
+            for name in self._states.keys() - states.keys():
+                metrics.FEED_PROJECTS.remove(feed=name)
+                metrics.FEED_STALE.remove(feed=name)
+            self._states = states
+            if self.store is not None and states and set(states) != self._stored_names:
+                self._stored_names = set(states)
+                self.store.prune(self._stored_names)
+
+        self._fetch_all(due)
+
+        with self._lock:
+            states = self._states
+            snapshot = self._snapshot
+            if due or snapshot is None or [f.name for f in snapshot.feeds] != list(states):
+                self._publish(list(states.values()))
+        return len(due)
+
+    def seconds_until_next_poll(self):
+        """Seconds until the earliest scheduled feed poll"""
+        if not self._states:
+            return self.interval
+        next_poll = min(state.next_poll for state in self._states.values())
+        return max(0.0, next_poll - self._clock())
+
+    def schedules(self):
+        """Return the scheduling state of every feed (interval, next poll time, reason)"""
+        now = self._clock()
+        return [state.schedule.to_status(name, now) for name, state in list(self._states.items())]
+
+    def _fetch_all(self, due):
+        """
+        Fetch the due feeds in parallel and apply their results to the feed states
+
+        Feeds with the same URL and main_url (e.g. one TeamCity document split up
+        by different filters) are fetched and parsed once; each of them applies its
+        own filter to the shared result.
+
+        At most `max_per_host` fetches (see SessionPool) run against one CI server
+        at a time: the others wait in a per-host queue and are submitted as that
+        host's fetches finish, so workers never sit blocked behind a slow host.
+
+        The cycle waits at most `deadline` seconds. A document that was fetched for
+        the whole deadline keeps downloading in its worker and its feeds are
+        reported with a timeout error in this cycle's snapshot; the late result is
+        picked up by the next poll of that URL. Feeds that were still waiting for a
+        slot, or started too late in the cycle to use the whole deadline, keep their
+        current state and are not counted as failures.
+
+        Called without self._lock: it is taken to submit fetches and to apply their
+        results, not while waiting for them, so a refresh can run alongside a slow
+        cycle. Every submitted fetch is registered in _in_flight right away, so a
+        concurrent cycle awaits it instead of fetching the document again; its result
+        is applied once to each feed, by whichever cycle gets to it first.
+        """
+        if not due:
+            return
+
+        limit = self.sessions.max_per_host
+        host_key = self.sessions.host_key
+        futures = {}  # (url, main_url) -> (Future, monotonic submit time)
+        # Fetches of earlier or concurrent cycles that are still running hold their host's slots
+        running = {}  # Future -> host
+        busy = {}  # Host -> fetches running
+        queues = {}  # Host -> deque of (url, main_url) waiting for a slot
+
+        def submit_queued(host):
+            # Called with self._lock held
+            queue = queues.get(host)
+            while queue and (not limit or busy.get(host, 0) < limit):
+                key = queue.popleft()
+                previous = self._in_flight.get(key)
+                if previous is not None:
+                    # Submitted by a concurrent cycle meanwhile
+                    futures[key] = previous
+                    if not previous[0].done() and previous[0] not in running:
+                        running[previous[0]] = host
+                        busy[host] = busy.get(host, 0) + 1
+                    continue
+                feed, state = self._group_leader(groups[key])
+                future = self._executor.submit(self._fetch_document, feed, state.document)
+                futures[key] = self._in_flight[key] = (future, time.monotonic())
+                running[future] = host
+                busy[host] = busy.get(host, 0) + 1
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="cctray-fetch"
+                )
+
+            started = self._clock()
+            # (url, main_url) -> [(feed, state)] in configuration order; projects
+            # parsed for one feed of a group are valid for the others but for the name
+            groups = {}
+            for feed, state in due:
+                state.last_attempt = started
+                groups.setdefault((feed.url, feed.main_url), []).append((feed, state))
+
+            for key, (future, _) in self._in_flight.items():
+                if not future.done():
+                    host = running[future] = host_key(key[0])
+                    busy[host] = busy.get(host, 0) + 1
+            for key in groups:
+                if not key[0]:
+                    continue
+                # A fetch that missed an earlier deadline, or that a concurrent cycle
+                # started, is awaited (or, if it has finished meanwhile, used)
+                # instead of being started again
+                previous = self._in_flight.get(key)
+                if previous is not None:
+                    futures[key] = previous
+                else:
+                    queues.setdefault(host_key(key[0]), deque()).append(key)
+
+            for host in queues:
+                submit_queued(host)
+
+        def waiting():
+            # Other cycles' fetches in `running` only hold slots; stop once ours are done
+            return any(queues.values()) or any(not future.done() for future, _ in futures.values())
+
+        end = time.monotonic() + self.deadline
+        while running and waiting():
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(list(running), timeout=remaining, return_when=FIRST_COMPLETED)
+            with self._lock:
+                for future in done:
+                    host = running.pop(future)
+                    busy[host] -= 1
+                    submit_queued(host)
+
+        with self._lock:
+            now = time.monotonic()
+            for key, members in groups.items():
+                if key[0] and key not in futures:
+                    continue  # Still waiting for a slot: fetched in a later cycle
+                future, submitted_at = futures.get(key, (None, None))
+                if future is not None and not future.done():
+                    if now - submitted_at < self.deadline:
+                        continue  # Started late in the cycle: awaited by the next one
+                    for feed, state in members:
+                        self.scheduler.update(state.schedule, feed, started, ok=False)
+                        self._record_failure(
+                            feed, state, [f"Timed out fetching feed '{state.name}' after {self.deadline}s"]
+                        )
+                    continue
+
+                fetched = None
+                if future is not None:
+                    fetched = future.result()
+                    if self._in_flight.get(key, (None,))[0] is future:
+                        del self._in_flight[key]
+                        if fetched.document is not None:
+                            with self._stats_lock:
+                                self._parse_stats[fetched.parse] += 1
+                                self._parse_stats["shared"] += len(members) - 1
+                            metrics.PARSES.inc(feed=members[0][1].name, outcome=fetched.parse)
+                    # Skip feeds a concurrent cycle already applied this fetch to
+                    members = [(feed, state) for feed, state in members if state.fetch is not future]
+                for feed, state in members:
+                    state.fetch = future
+                    self._apply_result(feed, state, self._feed_result(feed, state.document, fetched), started)
+
+    @staticmethod
+    def _group_leader(members):
+        """Pick the feed whose previous document can validate the shared fetch"""
+        for feed, state in members:
+            if state.document is not None and state.document.source == feed.source:
+                return feed, state
+        return members[0]
+
+    def _feed_result(self, feed, previous, fetched):
+        """
+        Turn a fetched document into one feed's result (in the poller thread)
+
+        Args:
+            feed: FeedSpec of the feed
+            previous: ParsedDocument of the feed's last successful fetch
+            fetched: FetchedDocument of the feed's URL, or None if it has no URL
+        """
+        if fetched is None:
+            return FeedResult(errors=[f"Feed '{feed.name}' has no URL configured"])
+        if fetched.document is None:
+            if fetched.error is not None:
+                return FeedResult(errors=[f"Error processing feed '{feed.name}': {fetched.error}"])
+            return FeedResult(errors=[f"Failed to fetch feed '{feed.name}'"])
+
+        document = fetched.document
+        if document.source != feed.source:
+            # Parsed for another feed with the same URL: keep this feed's own records
+            # while the body is unchanged, otherwise attach them to this feed
+            if previous is not None and previous.source == feed.source and previous.digest == document.digest:
+                projects = previous.projects
+            else:
+                projects = [project.for_feed(feed.info) for project in document.projects]
+            document = ParsedDocument(
+                feed.source, projects, document.etag, document.last_modified, document.digest
+            )
+
+        # Apply the feed's include/exclude patterns (compiled when the config was
+        # loaded); invalid patterns are reported and skipped
+        with metrics.FILTER_SECONDS.time(feed=feed.name):
+            projects = feed.filter(document.projects)
+        return FeedResult(
+            projects,
+            list(feed.filter_errors),
+            ok=True,
+            finished_at=fetched.finished_at,
+            document=document,
+            parse=fetched.parse,
+        )
+
+    def _apply_result(self, feed, state, result, started):
+        """Update a feed's state, schedule and circuit breaker from its poll result"""
+        self.scheduler.update(
+            state.schedule,
+            feed,
+            started,
+            ok=result.ok,
+            changed=result.projects != state.projects,
+            active=has_active_projects(result.projects),
+        )
+        if not result.ok:
+            self._record_failure(feed, state, result.errors)
+            return
+        state.breaker.record_success()
+        state.projects = result.projects
+        state.errors = result.errors
+        state.stale = False
+        state.updated_at = result.finished_at
+        state.document = result.document
+        if self.store is not None:
+            self.store.save(state.name, feed.source, result.document, result.finished_at)
+        metrics.FEED_PROJECTS.set(len(state.projects), feed=state.name)
+        metrics.FEED_STALE.set(0, feed=state.name)
+
+    def _record_failure(self, feed, state, errors):
+        """
+        Apply a failed poll: count it in the feed's circuit breaker and keep serving
+        the projects of the last successful fetch, marked stale
+        """
+        metrics.FETCH_FAILURES.inc(feed=state.name)
+        breaker = state.breaker
+        breaker.record_failure()
+        state.errors = list(errors)
+        if breaker.state == OPEN:
+            state.errors.append(
+                f"Stopped polling feed '{state.name}' for {breaker.cooldown}s after "
+                f"{breaker.failures} consecutive failures"
+            )
+            state.schedule.next_poll = max(state.schedule.next_poll, breaker.retry_at)
+
+        # The last document is only reused while the feed's name and URLs are unchanged
+        document = state.document
+        if document is not None and document.source == feed.source:
+            state.projects = feed.filter(document.projects)
+            state.stale = True
+        else:
+            state.projects = []
+            state.stale = False
+        metrics.FEED_PROJECTS.set(len(state.projects), feed=state.name)
+        metrics.FEED_STALE.set(int(state.stale), feed=state.name)
+
+    def _fetch_document(self, feed, previous=None):
+        """
+        Fetch and parse the document at a feed's URL (runs in a worker thread)
+
+        Args:
+            feed: FeedSpec of the feed the document is parsed for
+            previous: ParsedDocument from the feed's last successful fetch, used for
+                conditional GET validators and to skip parsing unchanged documents
+        """
+        # Parsed projects depend on the feed name and URLs, so a cached document is
+        # only reused while those are unchanged
+        if previous is not None and previous.source != feed.source:
+            previous = None
+
+        try:
+            session = self.sessions.session_for(feed.url, feed.http)
+            stream = feed.stream_parse if feed.stream_parse is not None else self.stream_parse
+            with metrics.FETCH_SECONDS.time(feed=feed.name):
+                response = self._fetch(
+                    feed.url,
+                    timeout=feed.timeout,
+                    session=session,
+                    etag=previous.etag if previous else None,
+                    last_modified=previous.last_modified if previous else None,
+                    stream=stream,
+                )
+            try:
+                document, parse = self._parse_response(response, previous, feed)
+            finally:
+                if response is not None:
+                    response.close()
+        except Exception as e:
+            return FetchedDocument(error=str(e))
+        return FetchedDocument(document, parse, finished_at=self._clock())
+
+    def _parse_response(self, response, previous, feed):
+        """
+        Turn a CCTrayResponse into a ParsedDocument, reusing the previous parse if possible
+
+        Returns:
+            (ParsedDocument, parse outcome) or (None, "failed") if nothing was fetched
+        """
+        if response is None:
+            return None, "failed"
+
+        if response.not_modified and previous is not None:
+            document = ParsedDocument(
+                feed.source,
+                previous.projects,
+                response.etag,
+                response.last_modified,
+                previous.digest,
+            )
+            return document, "not_modified"
+
+        if response.chunks is not None:
+            return self._parse_stream(response, feed)
+
+        if not response.content:
+            return None, "failed"
+
+        metrics.RESPONSE_BYTES.observe(len(response.content), feed=feed.name)
+        digest = hashlib.sha1(response.content).hexdigest()
+        if previous is not None and previous.digest == digest:
+            projects = previous.projects
+            parse = "unchanged"
+        else:
+            with metrics.PARSE_SECONDS.time(feed=feed.name):
+                projects = parse_cctray_records(response.content, feed.info)
+            parse = "parsed"
+        document = ParsedDocument(
+            feed.source, projects, response.etag, response.last_modified, digest
+        )
+        return document, parse
+
+    def _parse_stream(self, response, feed):
+        """Parse a streamed response while hashing it for the next poll's comparison"""
+        hasher = hashlib.sha1()
+        size = 0
+
+        def hashed_chunks():
+            nonlocal size
+            for chunk in response.chunks:
+                hasher.update(chunk)
+                size += len(chunk)
+                yield chunk
+
+        with metrics.PARSE_SECONDS.time(feed=feed.name):
+            projects = parse_cctray_stream_records(hashed_chunks(), feed.info)
+        if not size:
+            return None, "failed"
+        metrics.RESPONSE_BYTES.observe(size, feed=feed.name)
+        document = ParsedDocument(
+            feed.source,
+            projects,
+            response.etag,
+            response.last_modified,
+            hasher.hexdigest(),
+        )
+        return document, "parsed"
+
+    def _publish(self, states):
+        """Swap in a new snapshot built from copies of the feed states"""
+        feeds = []
+        for state in states:
+            copy = FeedState(state.name)
+            copy.projects = state.projects
+            copy.errors = list(state.errors)
+            copy.updated_at = state.updated_at
+            copy.last_attempt = state.last_attempt
+            copy.stale = state.stale
+            copy.circuit = state.breaker.state if state.breaker is not None else CLOSED
+            feeds.append(copy)
+        previous = self._snapshot
+        snapshot = Snapshot(feeds, self._clock(), self._version, previous)
+        changed = previous is None or snapshot.projects is not previous.projects
+        if changed:
+            self._version += 1
+            snapshot.version = self._version
+            self.history.record(snapshot)
+        self._snapshot = snapshot
+        self._ready.set()
+
+        for callback, changes_only in self._listeners:
+            if changed or not changes_only:
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    print(f"Error notifying snapshot listener: {e}")
+
+    def _run(self):
+        """Background thread loop"""
+        while not self._stop.is_set():
+            try:
+                self.poll_due()
+            except Exception as e:
+                print(f"Error polling CCTray feeds: {e}")
+            # Wake up at the next scheduled poll, but at least every second so
+            # newly added feeds are noticed promptly
+            self._stop.wait(min(1.0, max(0.05, self.seconds_until_next_poll())))
+
+
+def build_status(feed_poller, snapshot, criteria=None, since=None):
+    """
+    Build the /api/status response body for a snapshot
+
+    The body only depends on the snapshot and the arguments ("timestamp" is the
+    snapshot's publication), so it can be serialized once and served to every
+    client asking for the same thing. Feeds have no "age", which would be out of
+    date as long as the body is cached: clients compute it from "last_success".
+
+    Args:
+        feed_poller: FeedPoller that published the snapshot
+        snapshot: Snapshot to describe
+        criteria: Query filters from filters.parse_query_filters(), answered from
+            the snapshot's prebuilt index
+        since: Version the client already has; the body then holds only a delta
+            (or "unchanged": true) unless the version is unknown
+
+    Returns:
+        Response dict
+    """
+    if criteria:
+        projects, feeds = snapshot.select(criteria)
+        errors = [error for feed in feeds for error in feed.errors]
+    else:
+        projects, feeds, errors = snapshot.projects, snapshot.feeds, snapshot.errors
+
+    result = {
+        "version": snapshot.version,
+        "timestamp": datetime.fromtimestamp(snapshot.created_at).isoformat(),
+        "errors": errors if errors else None,
+        "feeds": [feed.to_status() for feed in feeds],
+    }
+
+    # Only send what changed since the version the client has
+    if since is not None:
+        if since == snapshot.version:
+            result["unchanged"] = True
+            return result
+        delta = feed_poller.history.delta(since, snapshot, criteria)
+        if delta is not None:
+            result["since"] = since
+            result["delta"] = delta
+            return result
+        # Unknown or too old version: fall through to the full list
+
+    # Project records are serialized from their cached JSON (json_provider.dumps_bytes)
+    result["projects"] = list(projects)
+    return result
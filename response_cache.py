@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Serialized /api/status responses for CCTray Build Status Monitor
+
+A snapshot is serialized once per distinct request (filters and ?since=) instead
+of once per request. The body is stored as bytes together with an ETag, and gzip
+and brotli variants are compressed the first time a client asks for them.
+Repeated requests are answered with 304 Not Modified, or with the stored bytes
+as they are.
+
+The ETag is a hash of the body, unless the cache is given an `etag` function:
+/api/status bodies carry the poll time and feed ages, which change every cycle,
+so their ETag is derived from what clients act on instead (see app.py).
+
+Brotli is optional: install the "brotli" package to enable it.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+# Content-Encoding -> (ETag suffix, compress function)
+_ENCODERS = {"gzip": ("-gz", lambda body: gzip.compress(body, compresslevel=6, mtime=0))}
+if brotli is not None:
+    _ENCODERS["br"] = ("-br", lambda body: brotli.compress(body, quality=5))
+
+
+def derived_etag(state, key):
+    """
+    ETag of a body from a description of what it shows instead of its bytes
+
+    Args:
+        state: str identifying the data the body describes (e.g. version and feed state)
+        key: Hashable description of the request
+    """
+    return hashlib.sha1(repr((state, key)).encode("utf-8")).hexdigest()
+
+
+def supported_encodings():
+    """Content encodings responses can be compressed with, in order of preference"""
+    return [encoding for encoding in ("br", "gzip") if encoding in _ENCODERS]
+
+
+class CachedResponse:
+    """One serialized response body, with compressed variants created on demand"""
+
+    def __init__(self, body, etag=None):
+        self.body = body
+        self.etag = etag or hashlib.sha1(body).hexdigest()
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def etags(self):
+        """Every ETag this response is known under (one per encoding)"""
+        return [self.etag] + [self.etag + suffix for suffix, _ in _ENCODERS.values()]
+
+    def variant(self, encoding):
+        """
+        Return (body, etag) for a content encoding
+
+        Args:
+            encoding: "gzip", "br" or None for the uncompressed body
+        """
+        if encoding is None or encoding not in _ENCODERS or len(self.body) < MIN_COMPRESS_SIZE:
+            return self.body, self.etag
+        suffix, compress = _ENCODERS[encoding]
+        body = self._variants.get(encoding)
+        if body is None:
+            with self._lock:
+                body = self._variants.get(encoding)
+                if body is None:
+                    body = self._variants[encoding] = compress(self.body)
+        return body, self.etag + suffix
+
+
+def _order(snapshot):
+    """Publication order of a snapshot: (version, sequence); (0, 0) if it has neither"""
+    return getattr(snapshot, "version", 0), getattr(snapshot, "sequence", 0)
+
+
+class ResponseCache:
+    """
+    Serialized responses of the latest snapshot
+
+    Entries belong to one Snapshot object; the cache empties itself when a
+    request for a newer snapshot arrives. Requests still holding an older snapshot
+    are answered without touching the entries of the current one.
+
+    Args:
+        dumps: Callable turning the response dict into a JSON str or bytes
+        size: Number of distinct responses (filter/since combinations) kept
+        per_version: Keep entries while the snapshot version stays the same, for
+            responses that only depend on the projects (not on feed ages or errors)
+        precompress: Compress every supported encoding when a body is stored
+            instead of on the first request for it
+        etag: Optional function (snapshot, key) -> ETag used instead of hashing
+            the body, for bodies with fields that change without mattering to
+            clients
+    """
+
+    def __init__(self, dumps, size=256, per_version=False, precompress=False, etag=None):
+        self.dumps = dumps
+        self.size = size
+        self.per_version = per_version
+        self.precompress = precompress
+        self.etag = etag
+        self.hits = 0
+        self.misses = 0
+        self._snapshot = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, snapshot, key, build):
+        """
+        Return the CachedResponse for a request, serializing it on first use
+
+        Args:
+            snapshot: Snapshot the response describes
+            key: Hashable description of the request (filters, since)
+            build: Callable returning the response dict
+        """
+        with self._lock:
+            current = self._snapshot
+            entries = self._entries
+            if snapshot is not current and not (
+                self.per_version and current is not None and snapshot.version == current.version
+            ):
+                if current is not None and _order(snapshot) < _order(current):
+                    entries = None  # Older snapshot: built for this request only
+                else:
+                    self._snapshot = snapshot
+                    entries = self._entries = OrderedDict()
+            cached = entries.get(key) if entries is not None else None
+            if cached is not None:
+                entries.move_to_end(key)
+                self.hits += 1
+                metrics.RESPONSE_CACHE.inc(result="hit")
+                return cached
+            self.misses += 1
+        metrics.RESPONSE_CACHE.inc(result="miss")
+
+        with metrics.SERIALIZE_SECONDS.time():
+            body = self.dumps(build())
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        cached = CachedResponse(body, self.etag(snapshot, key) if self.etag is not None else None)
+        if self.precompress:
+            for encoding in supported_encodings():
+                cached.variant(encoding)
+
+        with self._lock:
+            if entries is not None and entries is self._entries:
+                entries[key] = cached
+                while len(entries) > self.size:
+                    entries.popitem(last=False)
+        return cached
+
+    def stats(self):
+        """Return cache hit/miss counters"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive per-feed poll scheduling for CCTray Build Status Monitor
+
+Every feed gets its own poll interval between a minimum and a maximum:
+    - while any of its projects is Building or CheckingModifications, the feed is
+      polled at its minimum interval so build results show up quickly
+    - after a change the feed goes back to its base interval (poll_interval)
+    - every poll that brings no change, and every failed poll, multiplies the
+      interval by `backoff` up to the maximum, so idle feeds and unreachable CI
+      servers are polled less and less often
+A random jitter is applied to every interval so feeds that share a base interval
+don't poll in lockstep.
+"""
+import random
+from datetime import datetime
+
+# Project activities that mean a build result is about to change
+ACTIVE_ACTIVITIES = frozenset({"Building", "CheckingModifications"})
+
+# Backoff exponents stop growing here (the interval is capped long before)
+MAX_BACKOFF_STEPS = 30
+
+
+class FeedSchedule:
+    """Scheduling state of one feed, kept by the poller between cycles"""
+
+    def __init__(self):
+        self.interval = None  # Seconds until the next poll (before jitter)
+        self.next_poll = 0.0
+        self.failures = 0  # Consecutive failed polls
+        self.unchanged = 0  # Consecutive successful polls without a change
+        self.reason = "initial"  # Why the current interval was chosen
+
+    def to_status(self, name, now):
+        """Describe the schedule for the /api/schedule response"""
+        return {
+            "name": name,
+            "interval": round(self.interval, 2) if self.interval is not None else None,
+            "next_poll": datetime.fromtimestamp(self.next_poll).isoformat() if self.next_poll else None,
+            "seconds_until_next_poll": round(max(0.0, self.next_poll - now), 1),
+            "reason": self.reason,
+            "failures": self.failures,
+            "unchanged_polls": self.unchanged,
+        }
+
+
+class AdaptiveScheduler:
+    """
+    Choose each feed's next poll time from the outcome of its last poll
+
+    Interval limits come from the feed ("poll_interval", "min_poll_interval" and
+    "max_poll_interval" in config_user.json5) and fall back to the values given
+    here. With the defaults (min = max = base, no jitter) every feed is simply
+    polled at its poll_interval.
+
+    Args:
+        interval: Base interval in seconds
+        min_interval: Interval while projects are building (default: base interval)
+        max_interval: Upper limit of the backoff (default: base interval)
+        backoff: Factor applied to the interval per unchanged or failed poll
+        jitter: Fraction of the interval added or subtracted at random (0.1 = ±10%)
+        rand: Callable returning a float in [0, 1) (injectable for tests)
+    """
+
+    def __init__(
+        self,
+        interval=5,
+        min_interval=None,
+        max_interval=None,
+        backoff=2.0,
+        jitter=0.0,
+        rand=random.random,
+    ):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self._rand = rand
+
+    def limits(self, feed):
+        """
+        Return (base, minimum, maximum) intervals for a feed
+
+        Args:
+            feed: FeedSpec of the feed
+        """
+        base = feed.poll_interval or self.interval
+        minimum = feed.min_poll_interval or self.min_interval or base
+        maximum = feed.max_poll_interval or self.max_interval or base
+        minimum = min(minimum, base)
+        maximum = max(maximum, base)
+        return base, minimum, maximum
+
+    def update(self, schedule, feed, now, ok, changed=False, active=False):
+        """
+        Record the outcome of a poll and set the feed's next poll time
+
+        Args:
+            schedule: FeedSchedule of the feed
+            feed: FeedSpec of the feed
+            now: Time the poll was started
+            ok: True if the feed was fetched and parsed
+            changed: True if the feed's projects differ from the previous poll
+            active: True if any project is building or checking for modifications
+
+        Returns:
+            The next poll time
+        """
+        base, minimum, maximum = self.limits(feed)
+        if not ok:
+            schedule.failures += 1
+            schedule.unchanged = 0
+            interval = base * self.backoff ** min(schedule.failures, MAX_BACKOFF_STEPS)
+            schedule.reason = "failure"
+        elif active:
+            schedule.failures = 0
+            schedule.unchanged = 0
+            interval = minimum
+            schedule.reason = "active"
+        elif changed:
+            schedule.failures = 0
+            schedule.unchanged = 0
+            interval = base
+            schedule.reason = "changed"
+        else:
+            schedule.failures = 0
+            schedule.unchanged += 1
+            interval = base * self.backoff ** min(schedule.unchanged, MAX_BACKOFF_STEPS)
+            schedule.reason = "unchanged"
+
+        schedule.interval = max(minimum, min(maximum, interval))
+        if self.jitter:
+            interval = schedule.interval * (1 + self.jitter * (2 * self._rand() - 1))
+        else:
+            interval = schedule.interval
+        schedule.next_poll = now + interval
+        return schedule.next_poll
+
+
+def has_active_projects(projects):
+    """True if any project is building or checking for modifications"""
+    return any(project.activity in ACTIVE_ACTIVITIES for project in projects)
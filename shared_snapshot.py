@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+Shared snapshot for multi-process deployments of CCTray Build Status Monitor
+
+With "workers" > 1 in config.json5, wsgi.py starts several server processes. One
+of them is elected poller (it holds an exclusive lock on a file); it polls the
+feeds and, whenever it publishes a snapshot, writes the serialized response
+bodies (/api/status, /api/summary, the CCTray XML exports) to a new generation
+file in a shared directory. The other processes don't poll or parse: they serve
+those bytes, read once per generation, and forward the requests only the poller
+can answer (refreshes, statistics) to it, at the address it writes to
+poller.json.
+
+Directory layout:
+    index               - memory-mapped header naming the current generation
+    <generation>.snap   - one file per published snapshot: a JSON header line
+                          (version, document offsets) followed by the bodies
+    poller.lock         - locked by the elected poller process
+    poller.json         - {"url": ...} where the elected poller process serves HTTP
+
+The index is read on every request straight from shared memory. The writer
+updates it with a sequence counter (odd while writing) so readers never see a
+half-written generation number. Generation files are written under a temporary
+name and renamed, and never changed afterwards, so readers can open them at any
+time; the writer removes old ones (on Windows, once no reader has them open).
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+
+from response_cache import CachedResponse
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+INDEX_NAME = "index"
+LOCK_NAME = "poller.lock"
+ADDRESS_NAME = "poller.json"
+MAGIC = b"CCTSNAP1"
+# magic, sequence (odd while the generation is being written), generation
+INDEX_FORMAT = "<8sQQ"
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+# Generation files kept besides the current one, for readers still opening them
+KEEP_GENERATIONS = 2
+
+# /api/status query field -> project key in the response body
+_PROJECT_KEYS = {
+    "feed": "feedName",
+    "status": "lastBuildStatus",
+    "category": "category",
+    "activity": "activity",
+}
+
+
+def _generation_path(directory, generation):
+    return os.path.join(directory, f"{generation:016d}.snap")
+
+
+def _open_index(directory):
+    """Open (creating if needed) the index file and map it into memory"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, INDEX_NAME)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        if os.fstat(fd).st_size < INDEX_SIZE:
+            os.write(fd, struct.pack(INDEX_FORMAT, MAGIC, 0, 0))
+        return mmap.mmap(fd, INDEX_SIZE)
+    finally:
+        os.close(fd)
+
+
+def _read_index(index, fallback=0, attempts=1000):
+    """
+    Return the current generation (0: nothing published yet)
+
+    If no consistent value is read within `attempts` (the writer keeps updating the
+    index), `fallback` is returned rather than a generation read during a write.
+    """
+    for _ in range(attempts):
+        magic, sequence, generation = struct.unpack_from(INDEX_FORMAT, index)
+        if magic != MAGIC:
+            return 0
+        if sequence % 2 == 0 and struct.unpack_from(INDEX_FORMAT, index)[1] == sequence:
+            return generation
+    return fallback
+
+
+class PollerLock:
+    """
+    Exclusive lock electing the one process that polls the feeds
+
+    The operating system releases it when the process exits, so another process
+    can take over.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, LOCK_NAME)
+        self._file = None
+
+    def try_acquire(self):
+        """Take the lock if no other process holds it; True if this process holds it"""
+        if self._file is not None:
+            return True
+        lock_file = open(self.path, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()  # Closing the file releases the lock
+            self._file = None
+
+
+class SharedSnapshotWriter:
+    """
+    Publish serialized snapshots for the other processes (used by the poller process)
+
+    submit() hands a snapshot to a background thread, which serializes it and
+    writes the generation file, so the poller's lock isn't held for disk and
+    compression work. Only the latest submitted snapshot is written, and none
+    whose state equals the last one written.
+
+    Args:
+        directory: Shared directory (created if missing)
+        poller_url: Base URL the other processes forward poller-only requests to
+    """
+
+    def __init__(self, directory, poller_url=None):
+        self.directory = directory
+        self._index = _open_index(directory)
+        # Continue the numbering of an earlier poller process (which may have
+        # stopped halfway through an update)
+        _, sequence, self.generation = struct.unpack_from(INDEX_FORMAT, self._index)
+        struct.pack_into(INDEX_FORMAT, self._index, 0, MAGIC, sequence + sequence % 2, self.generation)
+        self._lock = threading.Lock()
+        self._pending = None  # (state, build) of the latest submitted snapshot
+        self._published_state = None
+        self._wake = threading.Condition(threading.Lock())
+        self._idle = threading.Event()
+        self._idle.set()
+        self._closed = False
+        self._thread = None
+        if poller_url is not None:
+            path = os.path.join(directory, ADDRESS_NAME)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"url": poller_url, "pid": os.getpid()}, f)
+            os.replace(path + ".tmp", path)
+
+    def submit(self, state, build):
+        """
+        Queue a snapshot for publishing (returns immediately)
+
+        Args:
+            state: Hashable state of the snapshot; a snapshot with the same state
+                as the last one published is skipped
+            build: Callable returning the keyword arguments of publish()
+        """
+        with self._wake:
+            if self._closed:
+                return
+            self._pending = (state, build)
+            self._idle.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cctray-shared", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def flush(self, timeout=None):
+        """Wait until the submitted snapshots are published"""
+        return self._idle.wait(timeout)
+
+    def _run(self):
+        while True:
+            with self._wake:
+                while self._pending is None and not self._closed:
+                    self._idle.set()
+                    self._wake.wait()
+                pending, self._pending = self._pending, None
+                closed = self._closed
+            if pending is not None:
+                state, build = pending
+                if state is None or state != self._published_state:
+                    try:
+                        self.publish(**build())
+                        self._published_state = state
+                    except Exception as e:
+                        print(f"Error publishing shared snapshot: {e}")
+            if closed:
+                break
+        self._idle.set()
+
+    def publish(self, version, documents, feeds=(), etags=None, state=None):
+        """
+        Write a new generation and make it the current one
+
+        Args:
+            version: Snapshot version
+            documents: Dict of document name -> body bytes
+            feeds: Feed names of the snapshot (for per-feed documents)
+            etags: Dict of document name -> ETag, for documents whose ETag isn't
+                the hash of their body
+            state: app.snapshot_state() of the snapshot, for ETags of responses
+                the readers build themselves
+        """
+        with self._lock:
+            header = {
+                "version": version,
+                "feeds": list(feeds),
+                "documents": {},
+                "etags": etags or {},
+                "state": state,
+            }
+            offset = 0
+            for name, body in documents.items():
+                header["documents"][name] = [offset, len(body)]
+                offset += len(body)
+
+            generation = self.generation + 1
+            path = _generation_path(self.directory, generation)
+            temporary = path + ".tmp"
+            with open(temporary, "wb") as f:
+                f.write(json.dumps(header).encode("utf-8") + b"\n")
+                for body in documents.values():
+                    f.write(body)
+            os.replace(temporary, path)
+
+            _, sequence, _ = struct.unpack_from(INDEX_FORMAT, self._index)
+            struct.pack_into(INDEX_FORMAT, self._index, 0, MAGIC, sequence + 1, generation)
+            struct.pack_into(INDEX_FORMAT, self._index, 0, MAGIC, sequence + 2, generation)
+            self.generation = generation
+            self._remove_old(generation)
+
+    def _remove_old(self, generation):
+        for name in os.listdir(self.directory):
+            stem, extension = os.path.splitext(name)
+            if extension != ".snap" or not stem.isdigit():
+                continue
+            if int(stem) < generation - KEEP_GENERATIONS:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass  # Still open in a reader (Windows); removed next time
+
+    def close(self, timeout=5):
+        """Publish what is pending, stop the background thread and unmap the index"""
+        with self._wake:
+            self._closed = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._index.close()
+
+
+class SharedDocuments:
+    """The documents of one generation, as CachedResponses"""
+
+    def __init__(self, generation, version, feeds, responses, state=None):
+        self.generation = generation
+        self.version = version
+        self.feeds = feeds
+        self.state = state
+        self.responses = responses  # Document name -> CachedResponse
+        self._filtered = {}  # Criteria key -> CachedResponse
+        self._status = None
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        return self.responses.get(name)
+
+    def filtered_status(self, criteria, key, dumps, etag=None):
+        """
+        Return the /api/status body of the projects matching query filters
+
+        The status document is parsed once per generation, and only when a request
+        with filters arrives.
+
+        Args:
+            criteria: Dict from filters.parse_query_filters()
+            key: Hashable form of criteria
+            dumps: Function serializing the body to bytes
+            etag: ETag of the body (default: hash of the body)
+        """
+        with self._lock:
+            cached = self._filtered.get(key)
+            if cached is not None:
+                return cached
+            if self._status is None:
+                self._status = json.loads(self.responses["status"].body)
+            status = self._status
+        body = filter_status(status, criteria)
+        cached = CachedResponse(dumps(body), etag)
+        with self._lock:
+            if len(self._filtered) < 256:
+                self._filtered[key] = cached
+        return cached
+
+
+def filter_status(status, criteria):
+    """
+    Select the projects and feeds of a full /api/status body matching query filters
+
+    Args:
+        status: Full /api/status response dict
+        criteria: Dict from filters.parse_query_filters()
+    """
+    wanted = {
+        _PROJECT_KEYS[field]: {value.casefold() for value in values}
+        for field, values in criteria.items()
+    }
+    projects = [
+        project
+        for project in status["projects"]
+        if all(str(project.get(key, "")).casefold() in values for key, values in wanted.items())
+    ]
+    feeds = status["feeds"]
+    if "feedName" in wanted:
+        feeds = [feed for feed in feeds if feed["name"].casefold() in wanted["feedName"]]
+    errors = [error for feed in feeds for error in feed.get("errors") or ()]
+    return {
+        "version": status["version"],
+        "timestamp": status["timestamp"],
+        "errors": errors if errors else None,
+        "feeds": feeds,
+        "projects": projects,
+    }
+
+
+class SharedSnapshotReader:
+    """
+    Read the snapshots published by the poller process (used by the other processes)
+
+    Args:
+        directory: Shared directory the poller process writes to
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._index = _open_index(directory)
+        self._documents = None
+        self._lock = threading.Lock()
+
+    def poller_url(self):
+        """Return the base URL of the elected poller process, or None if unknown"""
+        try:
+            with open(os.path.join(self.directory, ADDRESS_NAME), encoding="utf-8") as f:
+                return json.load(f).get("url")
+        except (OSError, ValueError):
+            return None
+
+    def read(self):
+        """
+        Return the SharedDocuments of the current generation
+
+        Returns:
+            SharedDocuments, or None if nothing has been published yet
+        """
+        documents = self._documents
+        generation = _read_index(self._index, documents.generation if documents is not None else 0)
+        if documents is not None and documents.generation == generation:
+            return documents
+        if generation == 0:
+            return None
+        with self._lock:
+            documents = self._documents
+            if documents is None or documents.generation != generation:
+                documents = self._load(generation) or documents
+                self._documents = documents
+        return documents
+
+    def _load(self, generation):
+        try:
+            with open(_generation_path(self.directory, generation), "rb") as f:
+                header = json.loads(f.readline())
+                data = f.read()
+        except (OSError, ValueError) as e:
+            print(f"Error reading shared snapshot {generation}: {e}")
+            return None
+        etags = header.get("etags") or {}
+        responses = {
+            name: CachedResponse(data[offset : offset + length], etags.get(name))
+            for name, (offset, length) in header["documents"].items()
+        }
+        return SharedDocuments(generation, header["version"], header["feeds"], responses, header.get("state"))
+
+    def close(self):
+        self._index.close()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk snapshot store for CCTray Build Status Monitor
+
+The last parsed document of every feed (its projects, cache validators and the
+time it was fetched) is kept in a SQLite file. At startup the poller restores it
+before the first poll, so /api/status has the previous projects, marked stale,
+within milliseconds instead of after every CI server has answered. Restored
+validators make the first poll a conditional GET, and a 304 reuses the restored
+projects without parsing.
+
+Writes happen in a background thread: save() only records the latest document
+of a feed, and the writer stores whatever is pending in one transaction. A
+feed's projects are written again only when they changed; otherwise only its
+validators and timestamp are updated.
+
+Feeds are identified by name and a hash of (name, url, main_url), so a feed
+whose URL changed is not restored and no feed URL (which may contain
+credentials) is written to disk. Rows of feeds removed from the configuration
+are deleted once the poller reports the configured names (see prune()).
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import zlib
+
+from models import Project
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feeds (
+    name TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    digest TEXT,
+    updated_at REAL,
+    projects BLOB NOT NULL
+)
+"""
+
+# Project attributes stored per record (the FeedInfo is rebuilt from the config)
+_FIELDS = tuple(attribute for _, attribute in Project.FIELDS)
+
+
+class StoredFeed:
+    """A feed document read back from the store"""
+
+    def __init__(self, source, etag, last_modified, digest, updated_at, records):
+        self.source = source  # source_key() of the feed it was fetched for
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.updated_at = updated_at
+        self.records = records  # Lists of Project field values in _FIELDS order
+
+    def projects(self, info):
+        """Rebuild the Project records for the feed's FeedInfo"""
+        return [Project(*record, info) for record in self.records]
+
+
+def source_key(source):
+    """Hash of a feed's (name, url, main_url), stored instead of the URLs"""
+    return hashlib.sha1(json.dumps(list(source)).encode("utf-8")).hexdigest()
+
+
+def _encode_projects(projects):
+    records = [[getattr(project, field) for field in _FIELDS] for project in projects]
+    return zlib.compress(json.dumps(records, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _decode_projects(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class SnapshotStore:
+    """
+    Persist each feed's last parsed document in a SQLite file
+
+    Args:
+        path: Database file (created if missing)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.writes = 0  # Transactions committed by the writer
+        self._pending = {}  # Feed name -> (source, document, updated_at)
+        self._written = {}  # Feed name -> project list last written
+        self._keep = None  # Configured feed names, when rows of other feeds should be deleted
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._idle = threading.Event()
+        self._idle.set()
+        self._closed = False
+        self._thread = None
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(_SCHEMA)
+        connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        return connection
+
+    def load(self):
+        """
+        Read every stored feed
+
+        Returns:
+            Dict of feed name -> StoredFeed; empty if the file can't be read
+        """
+        feeds = {}
+        try:
+            connection = self._connect()
+            try:
+                rows = connection.execute(
+                    "SELECT name, source, etag, last_modified, digest, updated_at, projects FROM feeds"
+                ).fetchall()
+            finally:
+                connection.close()
+            for name, source, etag, last_modified, digest, updated_at, blob in rows:
+                feeds[name] = StoredFeed(
+                    source, etag, last_modified, digest, updated_at, _decode_projects(blob)
+                )
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            print(f"Error loading snapshot store {self.path}: {e}")
+            return {}
+        return feeds
+
+    def save(self, name, source, document, updated_at):
+        """
+        Queue a feed's document for writing (returns immediately)
+
+        Args:
+            name: Feed name
+            source: (name, url, main_url) the document was fetched for
+            document: ParsedDocument with the unfiltered projects and validators
+            updated_at: Time of the fetch
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._pending[name] = (source, document, updated_at)
+            self._idle.clear()
+            self._start_writer()
+            self._wake.notify()
+
+    def prune(self, names):
+        """
+        Queue deleting the rows of feeds that are no longer configured (returns immediately)
+
+        Args:
+            names: Names of the configured feeds
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._keep = set(names)
+            self._idle.clear()
+            self._start_writer()
+            self._wake.notify()
+
+    def mark_written(self, name, projects):
+        """Record that these projects are already on disk (e.g. just restored)"""
+        with self._lock:
+            self._written[name] = projects
+
+    def flush(self, timeout=None):
+        """Wait until every queued document is written"""
+        return self._idle.wait(timeout)
+
+    def close(self, timeout=5):
+        """Write what is pending and stop the writer thread"""
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _start_writer(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="cctray-store", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        connection = None
+        while True:
+            with self._lock:
+                while not self._pending and self._keep is None and not self._closed:
+                    self._idle.set()
+                    self._wake.wait()
+                pending, self._pending = self._pending, {}
+                keep, self._keep = self._keep, None
+                closed = self._closed
+            if pending or keep is not None:
+                try:
+                    if connection is None:
+                        connection = self._connect()
+                    if pending:
+                        self._write(connection, pending)
+                    if keep is not None:
+                        self._prune(connection, keep)
+                except (sqlite3.Error, OSError) as e:
+                    print(f"Error writing snapshot store {self.path}: {e}")
+            if closed:
+                break
+        if connection is not None:
+            connection.close()
+        self._idle.set()
+
+    def _write(self, connection, pending):
+        written = {}
+        with connection:
+            for name, (source, document, updated_at) in pending.items():
+                key = source_key(source)
+                if self._written.get(name) is document.projects:
+                    # Same parsed projects as on disk: only validators and time changed
+                    cursor = connection.execute(
+                        "UPDATE feeds SET etag=?, last_modified=?, digest=?, updated_at=? "
+                        "WHERE name=? AND source=?",
+                        (document.etag, document.last_modified, document.digest, updated_at, name, key),
+                    )
+                    if cursor.rowcount:
+                        continue
+                connection.execute(
+                    "INSERT OR REPLACE INTO feeds "
+                    "(name, source, etag, last_modified, digest, updated_at, projects) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        name,
+                        key,
+                        document.etag,
+                        document.last_modified,
+                        document.digest,
+                        updated_at,
+                        _encode_projects(document.projects),
+                    ),
+                )
+                written[name] = document.projects
+        # Only after the commit: if the transaction rolled back, the next write
+        # must store the projects again rather than just update the validators
+        with self._lock:
+            self._written.update(written)
+        self.writes += 1
+
+    def _prune(self, connection, keep):
+        names = [name for (name,) in connection.execute("SELECT name FROM feeds")]
+        removed = [(name,) for name in names if name not in keep]
+        if removed:
+            with connection:
+                connection.executemany("DELETE FROM feeds WHERE name=?", removed)
+        with self._lock:
+            for name in self._written.keys() - keep:
+                del self._written[name]
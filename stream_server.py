@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Server-Sent Events push channel for CCTray Build Status Monitor
+
+Browsers that keep an EventSource open get a message only when the poller
+publishes a new snapshot version, instead of requesting /api/status every few
+seconds. The connections are held by a single asyncio event loop in its own
+thread and on its own port ("stream_port" in config.json5), so hundreds of idle
+dashboards cost one socket each and never occupy a Waitress worker thread.
+
+Each message carries the same JSON body as /api/status: the full project list on
+connect (or a delta if the browser reconnects with Last-Event-ID / ?since=), then
+a delta per new version. A feed going stale, failing or recovering doesn't make a
+new version; it is pushed as an "unchanged" message with the feeds' state. The
+event id is the snapshot version. A comment line is sent every `heartbeat`
+seconds so proxies keep idle connections open.
+"""
+import asyncio
+import threading
+from urllib.parse import parse_qsl, urlsplit
+
+from werkzeug.datastructures import MultiDict
+
+from filters import criteria_key, parse_query_filters
+from json_provider import dumps_bytes
+from poller import build_status
+
+MAX_REQUEST_HEAD = 16 * 1024
+STREAM_PATH = "/api/stream"
+
+
+class StreamServer:
+    """
+    Serve /api/stream Server-Sent Events from an asyncio loop in a background thread
+
+    Args:
+        poller: FeedPoller whose snapshots are pushed
+        host: Address to bind to
+        port: Port to bind to (0 picks a free port, see `port` after start())
+        heartbeat: Seconds between keep-alive comments on idle connections
+        max_clients: Connections beyond this are refused with 503 so the page
+            falls back to polling
+        retry: Milliseconds browsers wait before reconnecting
+        status_body: Optional function (snapshot, criteria, since) -> /api/status
+            body bytes, e.g. reading the app's response cache so streams and
+            /api/status share one serialization; defaults to serializing here
+        allow_origin: Access-Control-Allow-Origin value sent with the stream, for
+            pages served from another origin (None sends no header)
+    """
+
+    def __init__(
+        self,
+        poller,
+        host="127.0.0.1",
+        port=0,
+        heartbeat=15,
+        max_clients=500,
+        retry=5000,
+        status_body=None,
+        allow_origin=None,
+    ):
+        self.poller = poller
+        self.status_body = status_body or self._serialize
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        self.max_clients = max_clients
+        self.retry = retry
+        self.allow_origin = allow_origin
+        self.clients = 0
+        self._loop = None
+        self._server = None
+        self._changed = None  # asyncio.Event replaced after every new version
+        self._payloads = {}  # (since, filters) -> Future of the encoded event, current snapshot only
+        self._payload_snapshot = None
+        self._thread = None
+        self._started = threading.Event()
+        self._start_error = None
+
+    def start(self):
+        """Start the event loop thread and wait until the port is bound"""
+        self._thread = threading.Thread(target=self._run, name="cctray-stream", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+        # Every snapshot: feed errors and stale flags change without a new version
+        self.poller.add_listener(self._on_snapshot, changes_only=False)
+        return self
+
+    def stop(self, timeout=5):
+        """Close every stream and stop the event loop"""
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._changed = asyncio.Event()
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port)
+            )
+        except OSError as e:
+            self._start_error = e
+            self._started.set()
+            loop.close()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    def _on_snapshot(self, snapshot):
+        """Poller listener (poller thread): wake every stream in the event loop"""
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                return
+            if len(head) > MAX_REQUEST_HEAD:
+                return
+            lines = head.decode("latin-1").split("\r\n")
+            parts = lines[0].split(" ")
+            if len(parts) != 3 or parts[0] != "GET":
+                writer.write(b"HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            url = urlsplit(parts[1])
+            if url.path != STREAM_PATH:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            if self.clients >= self.max_clients:
+                writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+
+            args = MultiDict(parse_qsl(url.query))
+            since = headers.get("last-event-id") or args.get("since")
+            try:
+                since = int(since) if since else None
+            except ValueError:
+                since = None
+
+            self.clients += 1
+            try:
+                await self._stream(writer, parse_query_filters(args), since)
+            finally:
+                self.clients -= 1
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def _stream(self, writer, criteria, since):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: keep-alive\r\n"
+            b"X-Accel-Buffering: no\r\n"  # Disable nginx response buffering
+        )
+        if self.allow_origin:
+            writer.write(f"Access-Control-Allow-Origin: {self.allow_origin}\r\n".encode("latin-1"))
+        writer.write(b"\r\n")
+        writer.write(f"retry: {self.retry}\n\n".encode("ascii"))
+        await writer.drain()
+
+        version = since
+        sent_state = None  # Snapshot.feed_state() of the last message
+        while True:
+            # Take the wake-up event before reading the snapshot so a version
+            # published in between is not missed
+            changed = self._changed
+            snapshot = self.poller.snapshot()
+            if snapshot is not None and snapshot.feeds:
+                state = snapshot.feed_state()
+                if snapshot.version != version or state != sent_state:
+                    # Same version: an "unchanged" body with the feeds' errors and stale flags
+                    writer.write(await self._payload(snapshot, criteria, version))
+                    version = snapshot.version
+                    sent_state = state
+                    await writer.drain()
+            try:
+                await asyncio.wait_for(changed.wait(), self.heartbeat)
+            except asyncio.TimeoutError:
+                writer.write(b": heartbeat\n\n")
+                await writer.drain()
+
+    async def _payload(self, snapshot, criteria, since):
+        """
+        Encode the event for clients at version `since`, shared by all of them
+
+        The body is built in a worker thread, once per snapshot and request shape,
+        so a large snapshot doesn't hold up the event loop and the other streams.
+        """
+        if self._payload_snapshot is not snapshot:
+            self._payloads = {}
+            self._payload_snapshot = snapshot
+        key = (since, criteria_key(criteria))
+        payload = self._payloads.get(key)
+        if payload is None or (payload.done() and payload.exception() is not None):
+            payload = self._loop.run_in_executor(None, self._encode, snapshot, criteria, since)
+            self._payloads[key] = payload
+        # Shielded: a stream closing while it waits doesn't cancel the others' event
+        return await asyncio.shield(payload)
+
+    def _encode(self, snapshot, criteria, since):
+        body = self.status_body(snapshot, criteria, since)
+        return f"id: {snapshot.version}\ndata: ".encode("ascii") + body + b"\n\n"
+
+    def _serialize(self, snapshot, criteria, since):
+        return dumps_bytes(build_status(self.poller, snapshot, criteria, since))
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregated build status counts for CCTray Build Status Monitor
+
+/api/summary reports how many projects are in each status, per feed, per category
+and in total, so wallboards and external monitors can poll a few hundred bytes
+instead of the full project list. Counts are keyed by the color keys of
+config.json5, using the same color key -> status name mapping as /api/config, and
+a building project only counts as Building (see isBuildingProject() and
+countStatuses() in templates/index.html).
+
+StatusSummary keeps the counters between snapshots and updates them from what
+changed: a feed whose project list is the one it had in the previous snapshot is
+skipped, and in a changed feed only projects whose record changed are recounted.
+"""
+import threading
+from collections import Counter
+from datetime import datetime
+
+from scheduler import ACTIVE_ACTIVITIES
+
+
+def status_name(project):
+    """CCTray status a project is counted under (Building while it builds)"""
+    if project.activity in ACTIVE_ACTIVITIES or project.last_build_status == "Building":
+        return "Building"
+    return project.last_build_status or "Unknown"
+
+
+def color_counts(statuses, status_mapping):
+    """
+    Map counts per status name to counts per color key
+
+    Args:
+        statuses: Counter of status name -> projects
+        status_mapping: Dict of color key -> status name (client_config["status_mapping"])
+    """
+    return {color_key: statuses.get(name, 0) for color_key, name in status_mapping.items()}
+
+
+def all_success(counts, projects):
+    """True if a feed has projects and none of them is in a non-success color key"""
+    return projects > 0 and counts.get("success", 0) > 0 and not any(
+        count for key, count in counts.items() if key != "success"
+    )
+
+
+class FeedCounts:
+    """Status counters of one feed's projects"""
+
+    def __init__(self):
+        self.projects = None  # Project list the counters describe
+        self.entries = {}  # Project name -> (record, category, status name)
+        self.statuses = Counter()  # Status name -> projects
+        self.categories = Counter()  # (category, status name) -> projects
+
+    def update(self, projects, categories):
+        """
+        Bring the counters up to date with a new project list
+
+        Args:
+            projects: The feed's projects in the new snapshot
+            categories: Counter of (category, status name) across all feeds,
+                adjusted by the same differences
+        """
+        if projects is self.projects:
+            return
+        if self.projects and not self.entries:
+            # Last counted from scratch: there are no entries to compare with
+            self.clear(categories)
+        self.projects = projects
+        entries = {}
+        for project in projects:
+            if project.name in entries:
+                # Project names aren't unique in this feed
+                self._recount(projects, categories)
+                return
+            entry = self.entries.get(project.name)
+            if entry is None or entry[0] is not project:
+                key = (project.category, status_name(project))
+                if entry is None or entry[1:] != key:
+                    if entry is not None:
+                        self._count(entry[1:], -1, categories)
+                    self._count(key, 1, categories)
+                entry = (project, *key)
+            entries[project.name] = entry
+        for name, entry in self.entries.items():
+            if name not in entries:
+                self._count(entry[1:], -1, categories)
+        self.entries = entries
+
+    def clear(self, categories):
+        """Remove the feed's projects from the shared category counters"""
+        categories.subtract(self.categories)
+        self.statuses.clear()
+        self.categories.clear()
+        self.entries = {}
+        self.projects = None
+
+    def _count(self, key, amount, categories):
+        self.statuses[key[1]] += amount
+        self.categories[key] += amount
+        categories[key] += amount
+
+    def _recount(self, projects, categories):
+        """Count a project list from scratch, without per-project entries"""
+        self.clear(categories)
+        self.projects = projects
+        for project in projects:
+            self._count((project.category, status_name(project)), 1, categories)
+
+
+class StatusSummary:
+    """
+    Status counters per feed and category, kept up to date across snapshots
+
+    update() is called by the poller for every new snapshot version (and by the
+    endpoint for snapshots it hasn't seen yet, e.g. with only stale flags changed).
+    """
+
+    def __init__(self):
+        self._feeds = {}  # Feed name -> FeedCounts
+        self._categories = Counter()  # (category, status name) -> projects
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def update(self, snapshot):
+        """Apply the differences between the last snapshot seen and this one"""
+        with self._lock:
+            self._update(snapshot)
+
+    def _update(self, snapshot):
+        if snapshot is self._snapshot:
+            return
+        names = set()
+        for feed in snapshot.feeds:
+            names.add(feed.name)
+            counts = self._feeds.get(feed.name)
+            if counts is None:
+                counts = self._feeds[feed.name] = FeedCounts()
+            counts.update(feed.projects, self._categories)
+        for name in list(self._feeds.keys() - names):
+            self._feeds.pop(name).clear(self._categories)
+        self._categories = +self._categories  # Drop categories that emptied
+        self._snapshot = snapshot
+
+    def build(self, snapshot, status_mapping):
+        """
+        Build the /api/summary response body for a snapshot
+
+        Args:
+            snapshot: Snapshot to describe
+            status_mapping: Dict of color key -> CCTray status name
+
+        Returns:
+            Response dict
+        """
+        with self._lock:
+            self._update(snapshot)
+            feeds = []
+            totals = Counter()
+            for feed in snapshot.feeds:
+                statuses = self._feeds[feed.name].statuses
+                totals.update(statuses)
+                counts = color_counts(statuses, status_mapping)
+                feeds.append(
+                    {
+                        "name": feed.name,
+                        "projects": len(feed.projects),
+                        "counts": counts,
+                        "all_success": all_success(counts, len(feed.projects)),
+                        "stale": feed.stale,
+                        "errors": len(feed.errors),
+                    }
+                )
+            by_category = {}
+            for (category, name), count in self._categories.items():
+                by_category.setdefault(category, Counter())[name] += count
+
+        counts = color_counts(totals, status_mapping)
+        return {
+            "version": snapshot.version,
+            "timestamp": datetime.fromtimestamp(snapshot.created_at).isoformat(),
+            "projects": len(snapshot.projects),
+            "counts": counts,
+            "all_success": all_success(counts, len(snapshot.projects)),
+            "feeds": feeds,
+            "categories": [
+                {
+                    "name": category,
+                    "projects": sum(statuses.values()),
+                    "counts": color_counts(statuses, status_mapping),
+                }
+                for category, statuses in sorted(by_category.items())
+            ],
+        }
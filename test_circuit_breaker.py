@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the per-feed circuit breaker and stale feed results
+"""
+import unittest
+
+import app as app_module
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from fake_cctray import FakeCCTrayServer, make_cctray_xml
+from poller import FeedPoller
+from test_poller import FakeClock
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Test cases for breaker state transitions"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=3, cooldown=60, clock=self.clock)
+
+    def test_opens_after_threshold(self):
+        """Test that the circuit opens after consecutive failures only"""
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_at, self.clock.now + 60)
+
+    def test_trial_after_cooldown(self):
+        """Test that one trial call is allowed after the cooldown and decides the state"""
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.advance(59)
+        self.assertFalse(self.breaker.allow())
+        self.clock.advance(1)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+        # A failed trial opens the circuit for another cooldown
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.retry_at, self.clock.now + 60)
+
+        self.clock.advance(60)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_threshold_zero_disables(self):
+        """Test that failure_threshold 0 never opens the circuit"""
+        breaker = CircuitBreaker(failure_threshold=0, clock=self.clock)
+        for _ in range(100):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+    """Test cases for the poller serving stale projects of a failing feed"""
+
+    def setUp(self):
+        self.server = FakeCCTrayServer(make_cctray_xml(3)).start()
+        self.clock = FakeClock()
+        self.feeds = [{"name": "Main", "url": self.server.url}]
+        self.poller = FeedPoller(
+            lambda: self.feeds,
+            interval=5,
+            clock=self.clock,
+            breaker_threshold=3,
+            breaker_cooldown=60,
+        )
+        self.poller.poll_due()
+
+    def tearDown(self):
+        self.poller.stop()
+        self.server.stop()
+
+    def _fail(self, polls):
+        """Let the CI server fail for the given number of polls"""
+        self.server.status_code = 500
+        for _ in range(polls):
+            self.clock.advance(5)
+            self.poller.poll_due()
+
+    def test_failed_poll_keeps_last_projects(self):
+        """Test that a failed poll serves the previous projects marked stale"""
+        version = self.poller.snapshot().version
+        self._fail(1)
+        snapshot = self.poller.snapshot()
+        self.assertEqual(len(snapshot.projects), 3)
+        self.assertEqual(snapshot.version, version)
+        self.assertEqual(snapshot.errors, ["Failed to fetch feed 'Main'"])
+        status = self.poller.feed_statuses()[0]
+        self.assertTrue(status["stale"])
+        self.assertEqual(status["age"], 5.0)
+        self.assertEqual(status["circuit"], CLOSED)
+
+    def test_open_circuit_stops_calling_host(self):
+        """Test that an open circuit serves stale data without calling the CI server"""
+        self._fail(3)
+        requests = self.server.request_count
+        status = self.poller.feed_statuses()[0]
+        self.assertEqual(status["circuit"], OPEN)
+        self.assertIn("Stopped polling feed 'Main' for 60s after 3 consecutive failures", status["errors"])
+
+        for _ in range(11):
+            self.clock.advance(5)
+            self.poller.poll_due()
+        self.poller.poll_due(force=True)
+        self.assertEqual(self.server.request_count, requests)
+        self.assertEqual(len(self.poller.snapshot().projects), 3)
+        self.assertEqual(self.poller.feed_statuses()[0]["age"], 70.0)
+
+    def test_status_body_has_last_success(self):
+        """Test that /api/status gives the last success, not an age frozen at publication"""
+        self._fail(3)
+        age = self.poller.feed_statuses()[0]["age"]
+        previous_poller = app_module.poller
+        app_module.poller = self.poller
+        try:
+            with app_module.app.test_client() as client:
+                first = client.get("/api/status")
+                self.clock.advance(50)
+                self.poller.poll_due()  # Circuit open: nothing is fetched or published
+                second = client.get("/api/status")
+        finally:
+            app_module.poller = previous_poller
+        feed = second.get_json()["feeds"][0]
+        self.assertNotIn("age", feed)
+        self.assertTrue(feed["stale"])
+        self.assertEqual(self.clock.now - feed["last_success"], age + 50)
+        self.assertEqual(self.poller.feed_statuses()[0]["age"], age + 50)
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+
+    def test_recovery_after_cooldown(self):
+        """Test that a successful trial poll closes the circuit and clears the stale mark"""
+        self._fail(3)
+        self.server.status_code = 200
+        self.server.xml_content = make_cctray_xml(4)
+        self.clock.advance(60)
+        self.assertEqual(self.poller.poll_due(), 1)
+        status = self.poller.feed_statuses()[0]
+        self.assertFalse(status["stale"])
+        self.assertEqual(status["circuit"], CLOSED)
+        self.assertIsNone(status["errors"])
+        self.assertEqual(len(self.poller.snapshot().projects), 4)
+
+    def test_failed_trial_reopens(self):
+        """Test that a failed trial poll opens the circuit for another cooldown"""
+        self._fail(3)
+        requests = self.server.request_count
+        self.clock.advance(60)
+        self.poller.poll_due()
+        self.assertEqual(self.server.request_count, requests + 1)
+        self.clock.advance(30)
+        self.poller.poll_due()
+        self.assertEqual(self.server.request_count, requests + 1)
+        self.assertEqual(self.poller.feed_statuses()[0]["circuit"], OPEN)
+
+    def test_changed_url_is_not_served_stale(self):
+        """Test that projects of a previous feed URL are not shown for a new one"""
+        self.feeds[0]["url"] = self.server.url.replace("projects.xml", "other.xml")
+        self._fail(1)
+        self.assertEqual(self.poller.snapshot().projects, [])
+        self.assertFalse(self.poller.feed_statuses()[0]["stale"])
+
+    def test_status_endpoint_reports_stale_feed(self):
+        """Test that /api/status answers from the stale snapshot without calling the CI server"""
+        self._fail(3)
+        requests = self.server.request_count
+        previous = app_module.poller
+        app_module.poller = self.poller
+        try:
+            with app_module.app.test_client() as client:
+                data = client.get("/api/status").get_json()
+        finally:
+            app_module.poller = previous
+        self.assertEqual(self.server.request_count, requests)
+        self.assertEqual(len(data["projects"]), 3)
+        self.assertTrue(data["feeds"][0]["stale"])
+        self.assertEqual(data["feeds"][0]["circuit"], OPEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
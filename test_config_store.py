@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the hot-reloading configuration cache
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from config_store import AppConfig, ConfigStore, FeedSpec, UserConfig
+from fake_cctray import make_cctray_xml
+from cctray import parse_cctray_records
+from test_poller import FakeClock
+
+
+class TestConfigStore(unittest.TestCase):
+    """Test cases for ConfigStore reloading"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "config_user.json5")
+        self.debug_path = os.path.join(self.directory, "config_user.debug.json5")
+        self.clock = FakeClock(0.0)
+        self.reads = 0
+        self._write(self.path, '{feeds: [{name: "A", url: "http://ci/a.xml"}]}')
+        self.store = ConfigStore(
+            [self.debug_path, self.path], UserConfig, check_interval=1.0,
+            read=self._counting_read, clock=self.clock,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _counting_read(self, path):
+        self.reads += 1
+        from config_store import read_json5
+
+        return read_json5(path)
+
+    def _write(self, path, content, mtime_offset=0):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        # Make every write visible to mtime checks regardless of timestamp resolution
+        stat = os.stat(path)
+        mtime_ns = stat.st_mtime_ns + mtime_offset * 1_000_000_000
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_parsed_once(self):
+        """Test that repeated get() calls don't parse the file again"""
+        first = self.store.get()
+        for _ in range(100):
+            self.clock.now += 2
+            self.assertIs(self.store.get(), first)
+        self.assertEqual(self.reads, 1)
+        self.assertEqual([feed.name for feed in first.feeds], ["A"])
+
+    def test_reload_on_change(self):
+        """Test that a modified file is swapped in after the check interval"""
+        first = self.store.get()
+        self._write(self.path, '{feeds: [{name: "B", url: "http://ci/b.xml"}]}', 10)
+        self.clock.now += 0.5
+        self.assertIs(self.store.get(), first)  # Not checked yet
+        self.clock.now += 0.5
+        second = self.store.get()
+        self.assertEqual([feed.name for feed in second.feeds], ["B"])
+        self.assertEqual(self.store.version, 2)
+
+    def test_invalid_file_keeps_previous(self):
+        """Test that a broken file keeps the last good configuration"""
+        first = self.store.get()
+        self._write(self.path, "{feeds: [", 10)
+        self.clock.now += 1
+        self.assertIs(self.store.get(), first)
+        self.assertIn("Error loading", self.store.last_error)
+        self._write(self.path, '{feeds: "not a list"}', 20)
+        self.clock.now += 1
+        self.assertIs(self.store.get(), first)
+
+    def test_debug_file_takes_priority(self):
+        """Test that the first existing path wins"""
+        self.store.get()
+        self._write(self.debug_path, '{feeds: [{name: "Debug", url: "http://ci/d.xml"}]}')
+        self.clock.now += 1
+        self.assertEqual([feed.name for feed in self.store.get().feeds], ["Debug"])
+
+    def test_missing_file(self):
+        """Test that a missing file gives an empty configuration"""
+        store = ConfigStore([os.path.join(self.directory, "missing.json5")], UserConfig)
+        self.assertEqual(store.get().feeds, [])
+
+
+class TestFeedSpec(unittest.TestCase):
+    """Test cases for precompiled feed settings"""
+
+    def test_defaults(self):
+        """Test default values of optional feed settings"""
+        spec = FeedSpec({"url": "http://ci.example.com/cc.xml"})
+        self.assertEqual(spec.name, "Unknown Feed")
+        self.assertEqual(spec.timeout, 10)
+        self.assertIsNone(spec.poll_interval)
+        self.assertEqual(spec.info.base_url, "http://ci.example.com")
+
+    def test_filter_compiled_once(self):
+        """Test that filter_regex is compiled when the spec is built"""
+        spec = FeedSpec({"name": "A", "url": "http://ci/a.xml", "filter_regex": "Project [12]"})
+        projects = parse_cctray_records(make_cctray_xml(4), spec.info)
+        self.assertEqual([p.name for p in spec.filter(projects)], ["Project 0", "Project 3"])
+
+    def test_invalid_filter(self):
+        """Test that an invalid filter_regex is reported and filters nothing"""
+        spec = FeedSpec({"name": "A", "url": "http://ci/a.xml", "filter_regex": "("})
+        self.assertTrue(spec.filter_errors[0].startswith("Invalid filter_regex for feed 'A'"))
+        projects = parse_cctray_records(make_cctray_xml(2), spec.info)
+        self.assertEqual(spec.filter(projects), projects)
+
+
+class TestAppConfig(unittest.TestCase):
+    """Test cases for the prebuilt /api/config payload"""
+
+    def test_status_mapping(self):
+        """Test that color keys are mapped to CCTray status names"""
+        client = AppConfig({"colors": {"success": "#0f0", "queued": "#ccc"}}).client_config
+        self.assertEqual(client["status_mapping"], {"success": "Success", "queued": "Queued"})
+
+    def test_defaults(self):
+        """Test default values"""
+        client = AppConfig({}).client_config
+        self.assertEqual(client["refresh_interval"], 5000)
+        self.assertEqual(client["status_mapping"]["building"], "Building")
+
+
+if __name__ == "__main__":
+    unittest.main()
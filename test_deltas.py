@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for versioned snapshot deltas
+"""
+import random
+import unittest
+
+from deltas import SnapshotHistory, apply_delta, compute_delta
+from fake_cctray import make_project
+from models import FeedInfo
+from poller import FeedState, Snapshot
+
+STATUSES = ("Success", "Failure", "Exception", "Unknown")
+FEEDS = {name: FeedInfo(name, f"http://ci.example.com/{name}.xml") for name in ("Main", "Nightly")}
+MAIN, NIGHTLY = FEEDS["Main"], FEEDS["Nightly"]
+
+
+def mutate(projects, rng):
+    """Randomly add, remove and change projects, keeping keys unique"""
+    projects = list(projects)
+    for _ in range(rng.randint(0, 3)):
+        if projects:
+            projects.pop(rng.randrange(len(projects)))
+    for _ in range(rng.randint(0, 3)):
+        if projects:
+            i = rng.randrange(len(projects))
+            p = projects[i]
+            projects[i] = make_project(
+                p.feed, p.name, rng.choice(STATUSES), label=str(rng.randint(1, 99))
+            )
+    names = {(p.feed.name, p.name) for p in projects}
+    for _ in range(rng.randint(0, 3)):
+        feed_name = rng.choice(list(FEEDS))
+        name = f"Project {rng.randint(0, 500)}"
+        if (feed_name, name) not in names:
+            names.add((feed_name, name))
+            projects.insert(rng.randint(0, len(projects)), make_project(FEEDS[feed_name], name))
+    return projects
+
+
+def to_dicts(projects):
+    return [p.to_dict() for p in projects]
+
+
+class TestDeltas(unittest.TestCase):
+    """Test cases for compute_delta and apply_delta"""
+
+    def test_delta_contents(self):
+        """Test that added, changed and removed projects are reported"""
+        old = [make_project(MAIN, "a"), make_project(MAIN, "b"), make_project(MAIN, "c")]
+        new = [make_project(MAIN, "a", "Failure"), make_project(MAIN, "c"), make_project(NIGHTLY, "d")]
+        delta = compute_delta(old, new)
+        self.assertEqual(delta["changed"], [new[0].to_dict()])
+        self.assertEqual(delta["removed"], [{"feedName": "Main", "name": "b"}])
+        self.assertEqual(delta["added"], [{"index": 2, "project": new[2].to_dict()}])
+        self.assertNotIn("order", delta)
+
+    def test_no_change(self):
+        """Test that identical lists give an empty delta"""
+        projects = [make_project(MAIN, "a")]
+        self.assertEqual(
+            compute_delta(projects, list(projects)), {"added": [], "changed": [], "removed": []}
+        )
+
+    def test_sequence_reproduces_snapshot(self):
+        """Test that applying a sequence of deltas reproduces every full snapshot"""
+        rng = random.Random(42)
+        snapshot = [make_project(MAIN, f"Project {i}") for i in range(20)]
+        client = to_dicts(snapshot)
+        for _ in range(200):
+            new = mutate(snapshot, rng)
+            client = apply_delta(client, compute_delta(snapshot, new))
+            self.assertEqual(client, to_dicts(new))
+            snapshot = new
+
+    def test_reordered_projects(self):
+        """Test that moved projects are sent with the full order"""
+        old = [make_project(MAIN, "a"), make_project(NIGHTLY, "b")]
+        new = [make_project(NIGHTLY, "b"), make_project(MAIN, "c"), make_project(MAIN, "a")]
+        delta = compute_delta(old, new)
+        self.assertEqual(len(delta["order"]), 3)
+        self.assertEqual(apply_delta(to_dicts(old), delta), to_dicts(new))
+
+    def test_duplicate_keys_need_full_list(self):
+        """Test that duplicate project names disable deltas"""
+        old = [make_project(MAIN, "a"), make_project(MAIN, "a")]
+        self.assertIsNone(compute_delta(old, [make_project(MAIN, "a")]))
+
+
+class TestSnapshotHistory(unittest.TestCase):
+    """Test cases for SnapshotHistory"""
+
+    def make_snapshot(self, version, projects):
+        state = FeedState("Main")
+        state.projects = projects
+        return Snapshot([state], 0.0, version)
+
+    def test_delta_between_versions(self):
+        """Test deltas across several versions and unknown versions"""
+        history = SnapshotHistory(size=2)
+        first = self.make_snapshot(1, [make_project(MAIN, "a")])
+        second = self.make_snapshot(2, [make_project(MAIN, "a", "Failure")])
+        third = self.make_snapshot(3, [make_project(MAIN, "b")])
+        for snapshot in (first, second, third):
+            history.record(snapshot)
+
+        delta = history.delta(2, third)
+        self.assertEqual(apply_delta(to_dicts(second.projects), delta), to_dicts(third.projects))
+        self.assertIs(history.delta(2, third), delta)  # Cached
+        self.assertIsNone(history.delta(1, third))  # Dropped from history
+        self.assertIsNone(history.delta(99, third))
+
+    def test_filtered_delta(self):
+        """Test that query filters restrict the delta to the selected projects"""
+        history = SnapshotHistory()
+        first = self.make_snapshot(1, [make_project(MAIN, "a"), make_project(MAIN, "b")])
+        second = self.make_snapshot(
+            2, [make_project(MAIN, "a", "Failure"), make_project(MAIN, "b", "Failure")]
+        )
+        history.record(first)
+        delta = history.delta(1, second, {"status": ["Success"]})
+        self.assertEqual(delta["removed"], [{"feedName": "Main", "name": "a"}, {"feedName": "Main", "name": "b"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for project filters and snapshot indexes
+"""
+import itertools
+import unittest
+
+from werkzeug.datastructures import MultiDict
+
+from filters import ProjectFilter, ProjectIndex, parse_query_filters
+from models import FeedInfo, Project
+
+STATUSES = ("Success", "Failure", "Exception", "Unknown")
+ACTIVITIES = ("Sleeping", "Building")
+
+
+def make_projects(feed_names=("Main", "Nightly"), per_feed=20):
+    """Build projects with varied statuses, activities and categories"""
+    projects = []
+    for feed_name in feed_names:
+        feed = FeedInfo(feed_name, f"http://ci.example.com/{feed_name}.xml")
+        for i in range(per_feed):
+            projects.append(
+                Project(
+                    f"{feed_name} {i}",
+                    ACTIVITIES[i % 2],
+                    STATUSES[i % 4],
+                    str(i),
+                    "2026-01-13T16:04:33",
+                    "",
+                    f"Category {i % 3}",
+                    feed,
+                )
+            )
+    return projects
+
+
+def linear_select(projects, criteria):
+    """Reference implementation of ProjectIndex.select scanning every project"""
+    values = {
+        "feed": lambda p: p.feed.name,
+        "status": lambda p: p.last_build_status,
+        "category": lambda p: p.category,
+        "activity": lambda p: p.activity,
+    }
+    return [
+        p
+        for p in projects
+        if all(
+            values[field](p).casefold() in {v.casefold() for v in accepted}
+            for field, accepted in criteria.items()
+        )
+    ]
+
+
+class TestProjectFilter(unittest.TestCase):
+    """Test cases for ProjectFilter"""
+
+    def test_no_patterns(self):
+        """Test that a filter without patterns returns the same list"""
+        projects = make_projects()
+        self.assertIs(ProjectFilter("Main").apply(projects), projects)
+
+    def test_exclude(self):
+        """Test that exclude patterns drop matching projects"""
+        project_filter = ProjectFilter("Main", exclude=["Main 1", "Nightly"])
+        names = [p.name for p in project_filter.apply(make_projects(per_feed=3))]
+        self.assertEqual(names, ["Main 0", "Main 2"])
+
+    def test_include_and_exclude(self):
+        """Test that include patterns keep only matches, minus excluded ones"""
+        project_filter = ProjectFilter("Main", include=r"^Main 1\d$", exclude="Main 15")
+        names = [p.name for p in project_filter.apply(make_projects())]
+        self.assertEqual(names, [f"Main {i}" for i in range(10, 20) if i != 15])
+
+    def test_results_cached_between_polls(self):
+        """Test that each project name is matched only once"""
+        project_filter = ProjectFilter("Main", exclude="Main 1")
+        calls = []
+
+        class CountingPattern:
+            def search(self, name):
+                calls.append(name)
+                return "Main 1" in name
+
+        project_filter.exclude = [CountingPattern()]
+        projects = make_projects(per_feed=5)
+        first = project_filter.apply(projects)
+        self.assertIs(project_filter.apply(projects), first)  # Same document
+        second = project_filter.apply(list(projects))  # New document, same names
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), len(projects))
+
+    def test_cache_sized_to_feed(self):
+        """Test that a feed larger than cache_size still hits the cache on every poll"""
+        project_filter = ProjectFilter("Main", exclude="Main 1", cache_size=8)
+        calls = []
+        pattern = project_filter.exclude[0]
+
+        class CountingPattern:
+            def search(self, name):
+                calls.append(name)
+                return pattern.search(name)
+
+        project_filter.exclude = [CountingPattern()]
+        projects = make_projects(per_feed=50)
+        first = project_filter.apply(projects)
+        second = project_filter.apply(list(projects))
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), len(projects))
+
+    def test_least_recently_used_evicted(self):
+        """Test that a full cache drops the name used longest ago"""
+        project_filter = ProjectFilter("Main", exclude="x", cache_size=2)
+        project_filter.keeps("a")
+        project_filter.keeps("b")
+        project_filter.keeps("a")
+        project_filter.keeps("c")
+        self.assertEqual(list(project_filter._cache), ["a", "c"])
+
+    def test_invalid_pattern_reported(self):
+        """Test that invalid patterns are skipped and reported"""
+        project_filter = ProjectFilter("Main", include="(", exclude=["Main 1", "["])
+        self.assertEqual(len(project_filter.errors), 2)
+        self.assertTrue(project_filter.errors[0].startswith("Invalid include_regex for feed 'Main'"))
+        names = [p.name for p in project_filter.apply(make_projects(per_feed=3))]
+        self.assertEqual(names, ["Main 0", "Main 2", "Nightly 0", "Nightly 1", "Nightly 2"])
+
+    def test_invalid_config_type(self):
+        """Test that non-string patterns are rejected"""
+        with self.assertRaises(ValueError):
+            ProjectFilter("Main", include=[1, 2])
+
+
+class TestProjectIndex(unittest.TestCase):
+    """Test cases for ProjectIndex"""
+
+    def setUp(self):
+        self.projects = make_projects()
+        self.index = ProjectIndex(self.projects)
+
+    def test_no_criteria(self):
+        """Test that empty criteria select every project"""
+        self.assertIs(self.index.select({}), self.projects)
+
+    def test_matches_linear_scan(self):
+        """Test that index lookups equal a linear scan for combinations of filters"""
+        choices = {
+            "feed": [None, ["Main"], ["main", "Nightly"], ["Missing"]],
+            "status": [None, ["Failure"], ["failure", "Exception"]],
+            "category": [None, ["Category 0"], ["Category 1", "Category 2"]],
+            "activity": [None, ["Building"]],
+        }
+        for combination in itertools.product(*choices.values()):
+            criteria = {
+                field: values
+                for field, values in zip(choices, combination)
+                if values is not None
+            }
+            with self.subTest(criteria=criteria):
+                self.assertEqual(
+                    self.index.select(criteria), linear_select(self.projects, criteria)
+                )
+
+    def test_count(self):
+        """Test per-value counts"""
+        self.assertEqual(self.index.count("status", "FAILURE"), 10)
+        self.assertEqual(self.index.count("feed", "Main"), 20)
+        self.assertEqual(self.index.count("category", "Missing"), 0)
+
+
+class TestParseQueryFilters(unittest.TestCase):
+    """Test cases for parse_query_filters"""
+
+    def test_values(self):
+        """Test repeated and comma-separated values"""
+        args = MultiDict(
+            [("status", "Failure, Exception"), ("feed", "Main"), ("feed", "Nightly"), ("x", "1")]
+        )
+        self.assertEqual(
+            parse_query_filters(args),
+            {"feed": ["Main", "Nightly"], "status": ["Failure", "Exception"]},
+        )
+
+    def test_empty(self):
+        """Test that empty parameters are ignored"""
+        self.assertEqual(parse_query_filters(MultiDict([("status", "")])), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
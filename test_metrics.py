@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the metrics registry and the /metrics endpoint
+"""
+import unittest
+
+import app as app_module
+import metrics
+from fake_cctray import FakeCCTrayServer, make_cctray_xml
+from metrics import MetricsRegistry
+from poller import FeedPoller
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    """Test cases for recording and rendering metrics"""
+
+    def setUp(self):
+        self.registry = MetricsRegistry(enabled=True)
+
+    def test_disabled_registry_records_nothing(self):
+        """Test that updates are no-ops while the registry is disabled"""
+        registry = MetricsRegistry(enabled=False)
+        counter = registry.counter("requests_total", "Requests", ("endpoint",))
+        histogram = registry.histogram("latency_seconds", "Latency")
+        counter.inc(endpoint="status")
+        with histogram.time():
+            pass
+        self.assertEqual(counter.value(endpoint="status"), 0)
+        self.assertEqual(histogram.count(), 0)
+        self.assertIs(histogram.time(), histogram.time())  # Shared no-op timer
+
+    def test_counter_and_gauge(self):
+        """Test counters accumulate and gauges keep the last value per label set"""
+        counter = self.registry.counter("hits_total", "Hits", ("result",))
+        gauge = self.registry.gauge("projects", "Projects", ("feed",))
+        counter.inc(result="hit")
+        counter.inc(2, result="hit")
+        counter.inc(result="miss")
+        gauge.set(5, feed="Main")
+        gauge.set(7, feed="Main")
+        self.assertEqual(counter.value(result="hit"), 3)
+        self.assertEqual(counter.value(result="miss"), 1)
+        self.assertEqual(gauge.value(feed="Main"), 7)
+        gauge.remove(feed="Main")
+        self.assertIsNone(gauge.value(feed="Main"))
+
+    def test_wrong_labels_rejected(self):
+        """Test that a metric only accepts its declared labels"""
+        counter = self.registry.counter("hits_total", "Hits", ("result",))
+        with self.assertRaises(ValueError):
+            counter.inc(status="hit")
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_histogram_text_format(self):
+        """Test that histograms render cumulative buckets, sum and count"""
+        histogram = self.registry.histogram("fetch_seconds", "Fetch time", ("feed",), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, feed='A "quoted" feed')
+        text = self.registry.render()
+        self.assertIn("# TYPE fetch_seconds histogram", text)
+        self.assertIn('fetch_seconds_bucket{feed="A \\"quoted\\" feed",le="0.1"} 2', text)
+        self.assertIn('fetch_seconds_bucket{feed="A \\"quoted\\" feed",le="1"} 3', text)
+        self.assertIn('fetch_seconds_bucket{feed="A \\"quoted\\" feed",le="+Inf"} 4', text)
+        self.assertIn('fetch_seconds_sum{feed="A \\"quoted\\" feed"} 3.65', text)
+        self.assertIn('fetch_seconds_count{feed="A \\"quoted\\" feed"} 4', text)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    """Test cases for the instrumented poller and /metrics"""
+
+    def setUp(self):
+        metrics.REGISTRY.enabled = True
+        metrics.REGISTRY.clear()
+        self.server = FakeCCTrayServer(make_cctray_xml(4)).start()
+        feeds = [{"name": "Main", "url": self.server.url}]
+        self.previous_poller = app_module.poller
+        app_module.poller = FeedPoller(lambda: feeds, interval=3600)
+        app_module.poller.poll_due()
+
+    def tearDown(self):
+        app_module.poller.stop()
+        app_module.poller = self.previous_poller
+        self.server.stop()
+        metrics.REGISTRY.clear()
+        metrics.REGISTRY.enabled = False
+
+    def test_metrics_exposed(self):
+        """Test that feed, cache and request metrics appear on /metrics"""
+        with app_module.app.test_client() as client:
+            client.get("/api/status")
+            client.get("/api/status")
+            response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        text = response.get_data(as_text=True)
+        self.assertIn('cctray_fetch_seconds_count{feed="Main"} 1', text)
+        self.assertIn('cctray_parse_total{feed="Main",outcome="parsed"} 1', text)
+        self.assertIn('cctray_feed_projects{feed="Main"} 4', text)
+        self.assertIn('cctray_response_bytes_count{feed="Main"} 1', text)
+        self.assertIn('cctray_response_cache_requests_total{result="miss"} 1', text)
+        self.assertIn('cctray_response_cache_requests_total{result="hit"} 1', text)
+        self.assertIn("cctray_status_serialize_seconds_count 1", text)
+        self.assertIn('cctray_http_request_seconds_count{endpoint="get_status",status="200"} 2', text)
+
+    def test_failures_counted(self):
+        """Test that failed polls are counted per feed"""
+        self.server.status_code = 500
+        app_module.poller.poll_due(force=True)
+        self.assertEqual(metrics.FETCH_FAILURES.value(feed="Main"), 1)
+        self.assertEqual(metrics.FEED_STALE.value(feed="Main"), 1)
+
+    def test_disabled_endpoint(self):
+        """Test that /metrics is not served while metrics are disabled"""
+        metrics.REGISTRY.enabled = False
+        with app_module.app.test_client() as client:
+            self.assertEqual(client.get("/metrics").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
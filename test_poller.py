@@ -0,0 +1,557 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the background feed poller
+"""
+import threading
+import time
+import unittest
+
+import app as app_module
+from fake_cctray import FakeCCTrayServer, make_cctray_xml
+from http_pool import SessionPool
+from poller import FeedPoller
+
+
+class FakeClock:
+    """Manually advanced clock for deterministic scheduling tests"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class TestFeedPoller(unittest.TestCase):
+    """Test cases for FeedPoller scheduling and snapshots"""
+
+    def setUp(self):
+        self.server = FakeCCTrayServer(make_cctray_xml(3)).start()
+        self.clock = FakeClock()
+        self.feeds = [{"name": "Main", "url": self.server.url, "poll_interval": 10}]
+        self.poller = FeedPoller(lambda: self.feeds, interval=5, clock=self.clock)
+
+    def tearDown(self):
+        self.poller.stop()
+        self.server.stop()
+
+    def test_snapshot_before_first_poll(self):
+        """Test that no snapshot is published before the first cycle"""
+        self.assertIsNone(self.poller.snapshot())
+        self.assertFalse(self.poller.wait_ready(0))
+
+    def test_first_poll_publishes_projects(self):
+        """Test that the first cycle fetches the feed and publishes its projects"""
+        self.assertEqual(self.poller.poll_due(), 1)
+        snapshot = self.poller.snapshot()
+        self.assertTrue(self.poller.wait_ready(0))
+        self.assertEqual(len(snapshot.projects), 3)
+        self.assertEqual(snapshot.projects[0]["feedName"], "Main")
+        self.assertEqual(snapshot.errors, [])
+
+    def test_feed_is_polled_on_its_own_schedule(self):
+        """Test that a feed is not fetched again before its poll_interval elapses"""
+        self.poller.poll_due()
+        self.clock.advance(9)
+        self.assertEqual(self.poller.poll_due(), 0)
+        self.assertEqual(self.server.request_count, 1)
+        self.clock.advance(1)
+        self.assertEqual(self.poller.poll_due(), 1)
+        self.assertEqual(self.server.request_count, 2)
+
+    def test_unchanged_poll_reuses_index(self):
+        """Test that a poll without project changes keeps the previous snapshot's index"""
+        self.poller.poll_due()
+        first = self.poller.snapshot()
+        self.poller.poll_due(force=True)
+        second = self.poller.snapshot()
+        self.assertIsNot(second, first)
+        self.assertIs(second.index, first.index)
+        self.assertEqual(second.version, first.version)
+        self.server.xml_content = make_cctray_xml(4)
+        self.poller.poll_due(force=True)
+        third = self.poller.snapshot()
+        self.assertIsNot(third.index, first.index)
+        self.assertEqual(len(third.select({"feed": ["main"]})[0]), 4)
+
+    def test_feed_age_is_reported(self):
+        """Test that feed statuses report the age of the snapshot"""
+        self.poller.poll_due()
+        self.clock.advance(4)
+        status = self.poller.feed_statuses()[0]
+        self.assertEqual(status["name"], "Main")
+        self.assertEqual(status["age"], 4.0)
+        self.assertIsNone(status["errors"])
+
+    def test_failed_fetch_reports_error(self):
+        """Test that an unreachable feed is reported as an error"""
+        self.server.status_code = 500
+        self.poller.poll_due()
+        snapshot = self.poller.snapshot()
+        self.assertEqual(snapshot.projects, [])
+        self.assertEqual(snapshot.errors, ["Failed to fetch feed 'Main'"])
+        self.assertIsNone(self.poller.feed_statuses()[0]["age"])
+
+    def test_injected_failures(self):
+        """Test that the fake server fails the configured fraction of polls"""
+        server = FakeCCTrayServer(make_cctray_xml(1), failure_rate=0.5, seed=1).start()
+        feeds = [{"name": "Flaky", "url": server.url}]
+        poller = FeedPoller(lambda: feeds, clock=self.clock, breaker_threshold=0)
+        failures = 0
+        for _ in range(40):
+            poller.poll_due(force=True)
+            failures += bool(poller.snapshot().feeds[0].errors)
+        poller.stop()
+        server.stop()
+        self.assertEqual(failures, server.failure_count)
+        self.assertTrue(10 <= failures <= 30)
+
+    def test_filter_regex_applied(self):
+        """Test that filter_regex removes matching projects"""
+        self.feeds[0]["filter_regex"] = "Project 1$"
+        self.poller.poll_due()
+        names = [p["name"] for p in self.poller.snapshot().projects]
+        self.assertEqual(names, ["Project 0", "Project 2"])
+
+    def test_removed_feed_is_dropped(self):
+        """Test that feeds removed from the configuration disappear from the snapshot"""
+        self.poller.poll_due()
+        self.feeds.clear()
+        self.poller.poll_due()
+        self.assertEqual(self.poller.snapshot().feeds, [])
+
+
+class TestConcurrentFetching(unittest.TestCase):
+    """Test cases for parallel fetching under a global deadline"""
+
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def _server(self, latency=0.0):
+        server = FakeCCTrayServer(make_cctray_xml(2), latency=latency).start()
+        self.servers.append(server)
+        return server
+
+    def test_feeds_fetched_in_parallel(self):
+        """Test that cycle time is set by the slowest feed, not the sum of all feeds"""
+        feeds = [
+            {"name": f"Feed {i}", "url": self._server(latency=0.3).url}
+            for i in range(4)
+        ]
+        poller = FeedPoller(lambda: feeds, max_workers=4, deadline=5)
+        started = time.monotonic()
+        poller.poll_due()
+        elapsed = time.monotonic() - started
+        poller.stop()
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(len(poller.snapshot().projects), 8)
+
+    def test_slow_feed_misses_deadline(self):
+        """Test that a feed missing the deadline yields a partial result with a timeout error"""
+        feeds = [
+            {"name": "Fast", "url": self._server().url},
+            {"name": "Slow", "url": self._server(latency=2.0).url},
+        ]
+        poller = FeedPoller(lambda: feeds, max_workers=2, deadline=0.3)
+        started = time.monotonic()
+        poller.poll_due()
+        elapsed = time.monotonic() - started
+        poller.stop()
+        snapshot = poller.snapshot()
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual({p["feedName"] for p in snapshot.projects}, {"Fast"})
+        self.assertEqual(snapshot.errors, ["Timed out fetching feed 'Slow' after 0.3s"])
+
+    def test_slow_feed_not_submitted_twice(self):
+        """Test that a feed still in flight is not fetched again by the next cycle"""
+        slow = self._server(latency=0.5)
+        feeds = [{"name": "Slow", "url": slow.url}]
+        poller = FeedPoller(lambda: feeds, max_workers=2, deadline=0.1)
+        poller.poll_due(force=True)
+        poller.poll_due(force=True)
+        self.assertEqual(slow.request_count, 1)
+        time.sleep(0.6)
+        poller.poll_due(force=True)
+        poller.stop()
+        self.assertEqual(len(poller.snapshot().projects), 2)
+
+    def test_shared_url_fetched_once(self):
+        """Test that feeds with the same URL share one fetch and keep their own filters"""
+        server = self._server()
+        feeds = [
+            {"name": "First", "url": server.url, "filter_regex": "Project 1$"},
+            {"name": "Second", "url": server.url, "filter_regex": "Project 0$"},
+        ]
+        poller = FeedPoller(lambda: feeds, max_workers=2)
+        poller.poll_due()
+        poller.poll_due(force=True)
+        poller.stop()
+        self.assertEqual(server.request_count, 2)
+        projects = [(p["feedName"], p["name"]) for p in poller.snapshot().projects]
+        self.assertEqual(projects, [("First", "Project 0"), ("Second", "Project 1")])
+        stats = poller.parse_stats()
+        self.assertEqual(stats["parsed"] + stats["unchanged"], 2)
+        self.assertEqual(stats["shared"], 2)
+
+    def test_fetches_per_host_capped(self):
+        """Test that max_per_host limits concurrent fetches from one CI server"""
+        server = self._server(latency=0.3)
+        feeds = [{"name": f"Feed {i}", "url": f"{server.url}?view={i}"} for i in range(4)]
+        poller = FeedPoller(
+            lambda: feeds, max_workers=4, deadline=5, sessions=SessionPool({"max_per_host": 1})
+        )
+        started = time.monotonic()
+        poller.poll_due()
+        elapsed = time.monotonic() - started
+        poller.stop()
+        self.assertGreaterEqual(elapsed, 1.2)
+        self.assertEqual(server.request_count, 4)
+        self.assertEqual(len(poller.snapshot().projects), 8)
+
+    def test_slow_host_does_not_hold_up_other_hosts(self):
+        """Test that feeds waiting for a slow host's slot neither block workers nor count as failures"""
+        slow = self._server(latency=0.6)
+        fast = self._server()
+        feeds = [{"name": f"Slow {i}", "url": f"{slow.url}?view={i}"} for i in range(3)]
+        feeds.append({"name": "Fast", "url": fast.url})
+        poller = FeedPoller(
+            lambda: feeds, max_workers=2, deadline=1.0, sessions=SessionPool({"max_per_host": 1})
+        )
+        poller.poll_due()
+        # The fast host got a worker although the slow host's feeds were queued first
+        self.assertEqual(fast.request_count, 1)
+        self.assertEqual(slow.request_count, 2)  # The third one never got a slot
+        statuses = {status["name"]: status for status in poller.feed_statuses()}
+        for name, status in statuses.items():
+            self.assertIsNone(status["errors"], name)
+            self.assertEqual(status["circuit"], "closed", name)
+        self.assertEqual(poller._states["Slow 1"].breaker.failures, 0)
+        self.assertEqual({p["feedName"] for p in poller.snapshot().projects}, {"Slow 0", "Fast"})
+
+        # The fetch started late in the first cycle is awaited by the next one
+        time.sleep(0.3)
+        poller.poll_due(force=True)
+        poller.stop()
+        self.assertIn("Slow 1", {p["feedName"] for p in poller.snapshot().projects})
+
+
+class TestRefresh(unittest.TestCase):
+    """Test cases for single-flight on-demand refreshes"""
+
+    def setUp(self):
+        self.server = FakeCCTrayServer(make_cctray_xml(2), latency=0.3).start()
+        self.other = FakeCCTrayServer(make_cctray_xml(2)).start()
+        self.clock = FakeClock()
+        self.feeds = [
+            {"name": "Main", "url": self.server.url},
+            {"name": "Other", "url": self.other.url},
+        ]
+        self.poller = FeedPoller(lambda: self.feeds, interval=3600, clock=self.clock, refresh_min_interval=10)
+        self.poller.poll_due()
+
+    def tearDown(self):
+        self.poller.stop()
+        self.server.stop()
+        self.other.stop()
+
+    def _refresh_concurrently(self, caller_count, feed=None):
+        barrier = threading.Barrier(caller_count)
+        results = []
+
+        def caller():
+            barrier.wait()
+            results.append(self.poller.refresh(feed, timeout=5))
+
+        threads = [threading.Thread(target=caller) for _ in range(caller_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [result["outcome"] for result in results]
+
+    def test_concurrent_callers_share_one_fetch(self):
+        """Test that N simultaneous refreshes of a feed produce one upstream request"""
+        before = self.server.request_count, self.other.request_count
+        outcomes = self._refresh_concurrently(20, "Main")
+        self.assertEqual(self.server.request_count, before[0] + 1)
+        self.assertEqual(self.other.request_count, before[1])
+        self.assertEqual(outcomes.count("refreshed"), 1)
+        self.assertEqual(outcomes.count("refreshed") + outcomes.count("joined") + outcomes.count("throttled"), 20)
+
+    def test_feed_refresh_joins_refresh_of_all_feeds(self):
+        """Test that refreshing one feed while all feeds refresh does not fetch it again"""
+        thread = threading.Thread(target=self.poller.refresh)
+        thread.start()
+        time.sleep(0.1)
+        result = self.poller.refresh("Main", timeout=5)
+        thread.join()
+        self.assertEqual(result["outcome"], "joined")
+        self.assertEqual(result["fetched"], 2)
+        self.assertEqual(self.server.request_count, 2)
+
+    def test_joined_refresh_timeout(self):
+        """Test that a caller giving up on the refresh it joined gets a timeout"""
+        thread = threading.Thread(target=self.poller.refresh, args=("Main",))
+        thread.start()
+        time.sleep(0.1)
+        result = self.poller.refresh("Main", timeout=0.01)
+        thread.join()
+        self.assertEqual(result["outcome"], "timeout")
+        self.assertEqual(result["fetched"], 0)
+        self.assertIsNotNone(result["error"])
+
+    def test_refresh_during_slow_cycle(self):
+        """Test that a refresh doesn't wait for a cycle fetching a slow feed"""
+        thread = threading.Thread(target=self.poller.poll_due, kwargs={"force": True, "only": {"Main"}})
+        thread.start()
+        time.sleep(0.05)
+        started = time.monotonic()
+        result = self.poller.refresh("Other", timeout=5)
+        elapsed = time.monotonic() - started
+        thread.join()
+        self.assertEqual(result["outcome"], "refreshed")
+        self.assertLess(elapsed, 0.2)
+
+    def test_refresh_awaits_fetch_of_running_cycle(self):
+        """Test that a refresh of a feed the running cycle is fetching doesn't fetch it again"""
+        thread = threading.Thread(target=self.poller.poll_due, kwargs={"force": True})
+        thread.start()
+        time.sleep(0.1)
+        result = self.poller.refresh("Main", timeout=5)
+        thread.join()
+        self.assertEqual(result["outcome"], "refreshed")
+        self.assertEqual(self.server.request_count, 2)
+        self.assertEqual(self.poller.parse_stats()["parsed"] + self.poller.parse_stats()["avoided"], 4)
+
+    def test_refresh_min_interval(self):
+        """Test that forced refreshes are throttled per feed"""
+        self.assertEqual(self.poller.refresh("Main")["outcome"], "refreshed")
+        self.clock.advance(4)
+        result = self.poller.refresh("Main")
+        self.assertEqual(result["outcome"], "throttled")
+        self.assertEqual(result["retry_after"], 6)
+        self.assertEqual(self.poller.refresh("Other")["outcome"], "refreshed")
+        self.clock.advance(6)
+        self.assertEqual(self.poller.refresh("Main")["outcome"], "refreshed")
+        self.assertEqual(self.server.request_count, 3)
+
+    def test_refresh_endpoint(self):
+        """Test POST /api/refresh/<feed> and /api/status?fresh=1"""
+        previous_poller = app_module.poller
+        app_module.poller = self.poller
+        try:
+            with app_module.app.test_client() as client:
+                self.assertEqual(client.post("/api/refresh/No such feed").status_code, 404)
+                data = client.post("/api/refresh").get_json()
+                self.assertEqual(data["outcome"], "refreshed")
+                self.assertEqual(data["version"], self.poller.snapshot().version)
+                self.clock.advance(10)
+                data = client.get("/api/status?fresh=1").get_json()
+                self.assertEqual(len(data["projects"]), 4)
+        finally:
+            app_module.poller = previous_poller
+        self.assertEqual(self.server.request_count, 3)
+
+
+class TestConditionalGet(unittest.TestCase):
+    """Test cases for conditional GET and skipped parses"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.server = None
+
+    def tearDown(self):
+        self.poller.stop()
+        self.server.stop()
+
+    def _poll_twice(self, **server_options):
+        self.server = FakeCCTrayServer(make_cctray_xml(3), **server_options).start()
+        self.feeds = [{"name": "Main", "url": self.server.url, "filter_regex": "Project 0"}]
+        self.poller = FeedPoller(lambda: self.feeds, interval=5, clock=self.clock)
+        self.poller.poll_due()
+        first = self.poller.snapshot().projects
+        self.clock.advance(5)
+        self.poller.poll_due()
+        return first, self.poller.snapshot().projects
+
+    def test_etag_not_modified_reuses_projects(self):
+        """Test that a 304 on If-None-Match reuses the parsed project list"""
+        first, second = self._poll_twice(etag=True)
+        self.assertEqual(self.server.request_count, 2)
+        self.assertEqual(self.server.not_modified_count, 1)
+        self.assertEqual(second, first)
+        self.assertEqual(len(second), 2)
+        stats = self.poller.parse_stats()
+        self.assertEqual(stats["parsed"], 1)
+        self.assertEqual(stats["not_modified"], 1)
+        self.assertEqual(stats["avoided"], 1)
+
+    def test_last_modified_not_modified(self):
+        """Test that a 304 on If-Modified-Since reuses the parsed project list"""
+        first, second = self._poll_twice(last_modified="Tue, 13 Jan 2026 16:04:33 GMT")
+        self.assertEqual(self.server.not_modified_count, 1)
+        self.assertEqual(second, first)
+        self.assertEqual(self.poller.parse_stats()["not_modified"], 1)
+
+    def test_unchanged_body_skips_parse(self):
+        """Test that an identical body without validators is not parsed again"""
+        first, second = self._poll_twice()
+        self.assertEqual(self.server.not_modified_count, 0)
+        self.assertEqual(second, first)
+        stats = self.poller.parse_stats()
+        self.assertEqual(stats["parsed"], 1)
+        self.assertEqual(stats["unchanged"], 1)
+
+    def test_changed_body_is_parsed(self):
+        """Test that a changed document is parsed again"""
+        self._poll_twice(etag=True)
+        self.server.xml_content = make_cctray_xml(4, status="Failure")
+        self.clock.advance(5)
+        self.poller.poll_due()
+        projects = self.poller.snapshot().projects
+        self.assertEqual(len(projects), 3)
+        self.assertEqual(projects[0]["lastBuildStatus"], "Failure")
+        self.assertEqual(self.poller.parse_stats()["parsed"], 2)
+
+    def test_stream_parse(self):
+        """Test that stream_parse feeds give the same projects and still use validators"""
+        self.server = FakeCCTrayServer(make_cctray_xml(3), etag=True).start()
+        self.feeds = [{"name": "Main", "url": self.server.url}]
+        self.poller = FeedPoller(lambda: self.feeds, interval=5, clock=self.clock)
+        self.poller.poll_due()
+        expected = self.poller.snapshot().projects
+
+        self.feeds[0]["stream_parse"] = True
+        self.poller._states["Main"].document = None
+        self.clock.advance(5)
+        self.poller.poll_due()
+        self.assertEqual(self.poller.snapshot().projects, expected)
+
+        self.clock.advance(5)
+        self.poller.poll_due()
+        self.assertEqual(self.server.not_modified_count, 1)
+        self.assertEqual(self.poller.snapshot().projects, expected)
+
+    def test_changed_main_url_is_not_reused(self):
+        """Test that changing main_url parses again instead of reusing old webUrls"""
+        self._poll_twice(etag=True)
+        self.feeds[0]["main_url"] = "http://main.example.com:9000"
+        self.clock.advance(5)
+        self.poller.poll_due()
+        self.assertEqual(self.server.not_modified_count, 1)
+        self.assertEqual(self.poller.parse_stats()["parsed"], 2)
+        project = self.poller.snapshot().projects[0]
+        self.assertEqual(project["feedBaseUrl"], "http://main.example.com:9000")
+
+
+class TestStatusEndpoint(unittest.TestCase):
+    """Test cases for /api/status served from the poller snapshot"""
+
+    def setUp(self):
+        self.servers = [
+            FakeCCTrayServer(make_cctray_xml(5, prefix=f"Feed{i}")).start()
+            for i in range(2)
+        ]
+        feeds = [
+            {"name": f"Feed {i}", "url": server.url}
+            for i, server in enumerate(self.servers)
+        ]
+        self.previous_poller = app_module.poller
+        app_module.poller = FeedPoller(lambda: feeds, interval=3600)
+        app_module.poller.poll_due()
+
+    def tearDown(self):
+        app_module.poller.stop()
+        app_module.poller = self.previous_poller
+        for server in self.servers:
+            server.stop()
+
+    def _upstream_requests(self):
+        return sum(server.request_count for server in self.servers)
+
+    def _hit_status(self, client_count):
+        """Call /api/status from client_count concurrent clients"""
+        results = []
+
+        def client():
+            with app_module.app.test_client() as test_client:
+                response = test_client.get("/api/status")
+                results.append((response.status_code, len(response.get_json()["projects"])))
+
+        threads = [threading.Thread(target=client) for _ in range(client_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_status_served_from_snapshot(self):
+        """Test that /api/status returns projects and each feed's last successful poll"""
+        with app_module.app.test_client() as client:
+            data = client.get("/api/status").get_json()
+        self.assertEqual(len(data["projects"]), 10)
+        self.assertIsNone(data["errors"])
+        self.assertEqual([feed["name"] for feed in data["feeds"]], ["Feed 0", "Feed 1"])
+        self.assertIsNotNone(data["feeds"][0]["last_success"])
+
+    def test_query_filters(self):
+        """Test that ?feed= and ?category= select a subset of projects and feeds"""
+        with app_module.app.test_client() as client:
+            data = client.get("/api/status?feed=Feed 1&category=Category 0,Category 3").get_json()
+        self.assertEqual([p["name"] for p in data["projects"]], ["Feed1 0", "Feed1 3"])
+        self.assertEqual([feed["name"] for feed in data["feeds"]], ["Feed 1"])
+
+        with app_module.app.test_client() as client:
+            data = client.get("/api/status?status=Failure").get_json()
+        self.assertEqual(data["projects"], [])
+        self.assertEqual(len(data["feeds"]), 2)
+
+    def test_since_version(self):
+        """Test that ?since= returns unchanged, a delta, or the full list"""
+        with app_module.app.test_client() as client:
+            full = client.get("/api/status").get_json()
+            version = full["version"]
+            data = client.get(f"/api/status?since={version}").get_json()
+            self.assertTrue(data["unchanged"])
+            self.assertNotIn("projects", data)
+
+            self.servers[1].xml_content = make_cctray_xml(6, status="Failure", prefix="Feed1")
+            app_module.poller.poll_due(force=True)
+            data = client.get(f"/api/status?since={version}").get_json()
+            self.assertEqual(data["version"], version + 1)
+            self.assertEqual(len(data["delta"]["changed"]), 5)
+            self.assertEqual(len(data["delta"]["added"]), 1)
+            self.assertEqual(data["delta"]["removed"], [])
+
+            data = client.get("/api/status?since=1").get_json()
+            self.assertEqual(len(data["projects"]), 11)
+
+    def test_upstream_requests_flat_as_clients_grow(self):
+        """Test that upstream request counts do not grow with the number of clients"""
+        baseline = self._upstream_requests()
+        self.assertEqual(baseline, 2)
+        for client_count in (1, 10, 40):
+            results = self._hit_status(client_count)
+            self.assertEqual(results, [(200, 10)] * client_count)
+            self.assertEqual(self._upstream_requests(), baseline)
+
+    def test_no_feeds_configured(self):
+        """Test that an empty feed list is reported as an error"""
+        app_module.poller.stop()  # tearDown stops the replacement
+        app_module.poller = FeedPoller(lambda: [], interval=3600)
+        app_module.poller.poll_due()
+        with app_module.app.test_client() as client:
+            response = client.get("/api/status")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "No CCTray feeds configured")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the serialized /api/status response cache
+"""
+import gzip
+import json
+import unittest
+
+import app as app_module
+from fake_cctray import FakeCCTrayServer, make_cctray_xml
+from poller import FeedPoller, Snapshot
+from response_cache import ResponseCache, brotli
+
+
+class TestResponseCache(unittest.TestCase):
+    """Test cases for ResponseCache"""
+
+    def setUp(self):
+        self.builds = 0
+        self.cache = ResponseCache(json.dumps)
+
+    def build(self, value):
+        def build():
+            self.builds += 1
+            return {"value": value, "padding": "x" * 2000}
+
+        return build
+
+    def test_serialized_once_per_snapshot(self):
+        """Test that a response is built once per snapshot and key"""
+        snapshot = object()
+        first = self.cache.get(snapshot, "a", self.build(1))
+        self.assertIs(self.cache.get(snapshot, "a", self.build(1)), first)
+        self.cache.get(snapshot, "b", self.build(2))
+        self.assertEqual(self.builds, 2)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 2, "entries": 2})
+
+    def test_new_snapshot_clears_entries(self):
+        """Test that entries of an older snapshot are not served"""
+        first = self.cache.get(object(), "a", self.build(1))
+        second = self.cache.get(object(), "a", self.build(2))
+        self.assertNotEqual(first.etag, second.etag)
+        self.assertEqual(self.builds, 2)
+
+    def test_compressed_variants(self):
+        """Test that compressed variants decode to the body and have their own ETag"""
+        cached = self.cache.get(object(), "a", self.build(1))
+        body, etag = cached.variant("gzip")
+        self.assertEqual(gzip.decompress(body), cached.body)
+        self.assertEqual(etag, cached.etag + "-gz")
+        self.assertIs(cached.variant("gzip")[0], body)
+        self.assertEqual(cached.variant(None), (cached.body, cached.etag))
+
+    @unittest.skipIf(brotli is None, "brotli is not installed")
+    def test_brotli_variant(self):
+        """Test the brotli variant"""
+        cached = self.cache.get(object(), "a", self.build(1))
+        body, etag = cached.variant("br")
+        self.assertEqual(brotli.decompress(body), cached.body)
+        self.assertEqual(etag, cached.etag + "-br")
+
+    def test_per_version_entries(self):
+        """Test that a per-version cache keeps entries across snapshots of one version"""
+        cache = ResponseCache(json.dumps, per_version=True, precompress=True)
+        snapshots = [Snapshot([], 0, version) for version in (1, 1, 2)]
+        first = cache.get(snapshots[0], "a", self.build(1))
+        self.assertIs(cache.get(snapshots[1], "a", self.build(1)), first)
+        self.assertIsNot(cache.get(snapshots[2], "a", self.build(2)), first)
+        self.assertEqual(self.builds, 2)
+        self.assertIn("gzip", first._variants)
+
+    def test_older_snapshot_keeps_entries(self):
+        """Test that a request holding an older snapshot does not empty the cache"""
+        older = Snapshot([], 0, 1)
+        newer = Snapshot([], 0, 1, previous=older)
+        latest = self.cache.get(newer, "a", self.build(2))
+        self.assertIsNot(self.cache.get(older, "a", self.build(1)), latest)
+        self.assertIs(self.cache.get(newer, "a", self.build(2)), latest)
+        self.assertEqual(self.builds, 2)
+        self.assertIsNot(self.cache.get(Snapshot([], 0, 2), "a", self.build(3)), latest)
+
+    def test_small_bodies_not_compressed(self):
+        """Test that tiny bodies are sent as they are"""
+        cached = self.cache.get(object(), "a", lambda: {"value": 1})
+        self.assertEqual(cached.variant("gzip"), (cached.body, cached.etag))
+
+
+class TestCachedStatusEndpoint(unittest.TestCase):
+    """Test cases for /api/status answered from the response cache"""
+
+    def setUp(self):
+        self.server = FakeCCTrayServer(make_cctray_xml(50)).start()
+        feeds = [{"name": "Main", "url": self.server.url}]
+        self.previous_poller = app_module.poller
+        app_module.poller = FeedPoller(lambda: feeds, interval=3600)
+        app_module.poller.poll_due()
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        app_module.poller.stop()
+        app_module.poller = self.previous_poller
+        self.server.stop()
+
+    def test_not_modified(self):
+        """Test that a repeated request with If-None-Match gets 304"""
+        response = self.client.get("/api/status")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        etag = response.headers["ETag"]
+
+        response = self.client.get("/api/status", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+        # A new snapshot with different data gets a new ETag
+        self.server.xml_content = make_cctray_xml(50, status="Failure")
+        app_module.poller.poll_due(force=True)
+        response = self.client.get("/api/status", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_etag_stable_across_unchanged_polls(self):
+        """Test that a poll without changes keeps the ETag although the timestamp moved"""
+        for url in ("/api/status", "/api/summary"):
+            etag = self.client.get(url).headers["ETag"]
+            app_module.poller.poll_due(force=True)
+            response = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304, url)
+
+        # A feed going stale changes what clients show
+        etag = self.client.get("/api/status").headers["ETag"]
+        self.server.status_code = 500
+        app_module.poller.poll_due(force=True)
+        response = self.client.get("/api/status", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()["feeds"][0]["stale"])
+
+    def test_gzip(self):
+        """Test that gzip is used when accepted and decodes to the plain body"""
+        plain = self.client.get("/api/status", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", plain.headers)
+        compressed = self.client.get("/api/status", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(compressed.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertLess(len(compressed.data), len(plain.data))
+
+        # The ETag of any variant revalidates
+        response = self.client.get(
+            "/api/status", headers={"If-None-Match": compressed.headers["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    @unittest.skipIf(brotli is None, "brotli is not installed")
+    def test_brotli_preferred(self):
+        """Test that brotli is preferred when the client accepts it"""
+        response = self.client.get("/api/status", headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(len(json.loads(brotli.decompress(response.data))["projects"]), 50)
+
+    def test_cctray_xml_export(self):
+        """Test /cc.xml and /feeds/<feed>/cc.xml with ETags and gzip"""
+        response = self.client.get("/cc.xml", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/xml")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn(b'name="Main :: Project 0"', gzip.decompress(response.data))
+        self.assertEqual(
+            self.client.get("/cc.xml", headers={"If-None-Match": response.headers["ETag"]}).status_code, 304
+        )
+
+        feed = self.client.get("/feeds/main/cc.xml")
+        self.assertIn(b'name="Project 0"', feed.data)
+        self.assertEqual(feed.data.count(b"<Project "), 50)
+        self.assertEqual(self.client.get("/feeds/Other/cc.xml").status_code, 404)
+
+        # Polls without changes keep the generated XML
+        misses = app_module.cctray_export_cache.stats()["misses"]
+        app_module.poller.poll_due(force=True)
+        self.client.get("/cc.xml")
+        self.assertEqual(app_module.cctray_export_cache.stats()["misses"], misses)
+
+    def test_filters_cached_separately(self):
+        """Test that different query filters get different cached bodies"""
+        everything = self.client.get("/api/status").get_json()
+        subset = self.client.get("/api/status?category=Category 0").get_json()
+        self.assertEqual(len(everything["projects"]), 50)
+        self.assertEqual(len(subset["projects"]), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for adaptive per-feed poll scheduling
+"""
+import unittest
+
+import app as app_module
+from config_store import FeedSpec
+from fake_cctray import FakeCCTrayServer, make_cctray_xml
+from poller import FeedPoller
+from scheduler import AdaptiveScheduler, FeedSchedule
+from test_poller import FakeClock
+
+
+def make_feed(**options):
+    return FeedSpec(dict({"name": "Main", "url": "http://ci.example.com/cctray.xml"}, **options))
+
+
+class TestAdaptiveScheduler(unittest.TestCase):
+    """Test cases for interval decisions"""
+
+    def setUp(self):
+        self.scheduler = AdaptiveScheduler(10, min_interval=2, max_interval=60, backoff=2)
+        self.schedule = FeedSchedule()
+        self.feed = make_feed()
+
+    def test_defaults_poll_at_base_interval(self):
+        """Test that without limits every outcome keeps the base interval"""
+        scheduler = AdaptiveScheduler(10)
+        for ok, changed, active in ((True, True, False), (True, False, False), (False, False, False)):
+            self.assertEqual(scheduler.update(self.schedule, self.feed, 100, ok, changed, active), 110)
+
+    def test_active_projects_poll_at_min_interval(self):
+        """Test that building projects shorten the interval to the minimum"""
+        self.scheduler.update(self.schedule, self.feed, 100, ok=True, active=True)
+        self.assertEqual(self.schedule.interval, 2)
+        self.assertEqual(self.schedule.next_poll, 102)
+        self.assertEqual(self.schedule.reason, "active")
+
+    def test_unchanged_polls_back_off_up_to_max(self):
+        """Test that polls without a change double the interval until the maximum"""
+        intervals = []
+        for _ in range(5):
+            self.scheduler.update(self.schedule, self.feed, 100, ok=True, changed=False)
+            intervals.append(self.schedule.interval)
+        self.assertEqual(intervals, [20, 40, 60, 60, 60])
+        self.assertEqual(self.schedule.unchanged, 5)
+
+        self.scheduler.update(self.schedule, self.feed, 100, ok=True, changed=True)
+        self.assertEqual(self.schedule.interval, 10)
+        self.assertEqual(self.schedule.unchanged, 0)
+
+    def test_failures_back_off(self):
+        """Test that consecutive failures back off exponentially and a success resets them"""
+        intervals = []
+        for _ in range(3):
+            self.scheduler.update(self.schedule, self.feed, 100, ok=False)
+            intervals.append(self.schedule.interval)
+        self.assertEqual(intervals, [20, 40, 60])
+        self.assertEqual(self.schedule.failures, 3)
+        self.assertEqual(self.schedule.reason, "failure")
+
+        self.scheduler.update(self.schedule, self.feed, 100, ok=True, changed=True)
+        self.assertEqual(self.schedule.failures, 0)
+        self.assertEqual(self.schedule.interval, 10)
+
+    def test_long_outage_does_not_overflow(self):
+        """Test that thousands of failures keep the interval at the maximum"""
+        for _ in range(5000):
+            self.scheduler.update(self.schedule, self.feed, 100, ok=False)
+        self.assertEqual(self.schedule.interval, 60)
+
+    def test_feed_overrides_limits(self):
+        """Test that a feed's own poll_interval and limits take precedence"""
+        feed = make_feed(poll_interval=30, min_poll_interval=5, max_poll_interval=600)
+        self.assertEqual(self.scheduler.limits(feed), (30, 5, 600))
+        # Limits never exclude the base interval
+        self.assertEqual(self.scheduler.limits(make_feed(poll_interval=100)), (100, 2, 100))
+
+    def test_jitter_bounds(self):
+        """Test that jitter spreads next poll times within the configured fraction"""
+        for rand, expected in ((0.0, 109), (0.5, 110), (0.9999999, 111)):
+            scheduler = AdaptiveScheduler(10, jitter=0.1, rand=lambda r=rand: r)
+            next_poll = scheduler.update(FeedSchedule(), self.feed, 100, ok=True, changed=True)
+            self.assertAlmostEqual(next_poll, expected, places=4)
+
+
+class TestPollerScheduling(unittest.TestCase):
+    """Test cases for the poller following the scheduler"""
+
+    def setUp(self):
+        self.server = FakeCCTrayServer(make_cctray_xml(3)).start()
+        self.clock = FakeClock()
+        self.feeds = [{"name": "Main", "url": self.server.url}]
+        scheduler = AdaptiveScheduler(10, min_interval=2, max_interval=80, backoff=2)
+        self.poller = FeedPoller(lambda: self.feeds, interval=10, clock=self.clock, scheduler=scheduler)
+
+    def tearDown(self):
+        self.poller.stop()
+        self.server.stop()
+
+    def _next_poll_in(self):
+        return self.poller.schedules()[0]["seconds_until_next_poll"]
+
+    def test_building_feed_is_polled_fast(self):
+        """Test that a feed with building projects is polled at the minimum interval"""
+        self.server.xml_content = make_cctray_xml(3, activity="Building")
+        self.poller.poll_due()
+        self.assertEqual(self._next_poll_in(), 2)
+        self.clock.advance(2)
+        self.assertEqual(self.poller.poll_due(), 1)
+
+    def test_idle_feed_backs_off(self):
+        """Test that an unchanged feed is polled less often"""
+        self.poller.poll_due()
+        self.assertEqual(self._next_poll_in(), 10)  # First poll is a change
+        self.clock.advance(10)
+        self.poller.poll_due()
+        self.assertEqual(self._next_poll_in(), 20)
+        self.clock.advance(19)
+        self.assertEqual(self.poller.poll_due(), 0)
+        self.assertEqual(self.server.request_count, 2)
+
+    def test_failing_feed_backs_off(self):
+        """Test that a failing CI server is not polled at the full rate"""
+        self.server.status_code = 500
+        self.poller.poll_due()
+        status = self.poller.schedules()[0]
+        self.assertEqual(status["reason"], "failure")
+        self.assertEqual(status["failures"], 1)
+        self.assertEqual(status["seconds_until_next_poll"], 20)
+
+    def test_schedule_endpoint(self):
+        """Test that /api/schedule lists every feed's next poll"""
+        previous = app_module.poller
+        app_module.poller = self.poller
+        try:
+            self.poller.poll_due()
+            with app_module.app.test_client() as client:
+                data = client.get("/api/schedule").get_json()
+        finally:
+            app_module.poller = previous
+        feed = data["feeds"][0]
+        self.assertEqual(feed["name"], "Main")
+        self.assertEqual(feed["interval"], 10)
+        self.assertEqual(feed["reason"], "changed")
+        self.assertIsNotNone(feed["next_poll"])
+
+
+if __name__ == "__main__":
+    unittest.main()
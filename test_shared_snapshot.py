@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the shared snapshot of multi-process deployments
+"""
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import app as app_module
+from fake_cctray import FakeCCTrayServer, make_cctray_xml
+from poller import FeedPoller
+from shared_snapshot import (
+    INDEX_FORMAT,
+    KEEP_GENERATIONS,
+    MAGIC,
+    PollerLock,
+    SharedSnapshotReader,
+    SharedSnapshotWriter,
+    _read_index,
+    filter_status,
+)
+
+
+class TestSharedSnapshot(unittest.TestCase):
+    """Test cases for publishing generations and reading them back"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.closing = []
+
+    def tearDown(self):
+        for item in self.closing:
+            item.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _writer(self):
+        writer = SharedSnapshotWriter(self.directory)
+        self.closing.append(writer)
+        return writer
+
+    def _reader(self):
+        reader = SharedSnapshotReader(self.directory)
+        self.closing.append(reader)
+        return reader
+
+    def test_nothing_published(self):
+        """Test that a reader returns None until the poller process publishes"""
+        self.assertIsNone(self._reader().read())
+
+    def test_round_trip(self):
+        """Test that readers get the published bodies, loaded once per generation"""
+        writer = self._writer()
+        reader = self._reader()
+        writer.publish(7, {"status": b'{"version": 7}', "cc.xml": b"<Projects/>"}, ["Main"])
+        documents = reader.read()
+        self.assertEqual(documents.version, 7)
+        self.assertEqual(documents.feeds, ["Main"])
+        self.assertEqual(documents.get("status").body, b'{"version": 7}')
+        self.assertEqual(documents.get("cc.xml").body, b"<Projects/>")
+        self.assertIsNone(documents.get("summary"))
+        self.assertIs(reader.read(), documents)
+
+        writer.publish(8, {"status": b'{"version": 8}'}, ["Main"])
+        self.assertEqual(reader.read().version, 8)
+        self.assertEqual(reader.read().get("status").body, b'{"version": 8}')
+
+    def test_submit_skips_unchanged_state(self):
+        """Test that submitted snapshots are published in the background, once per state"""
+        writer = self._writer()
+        reader = self._reader()
+        built = []
+
+        def build(version):
+            built.append(version)
+            return {"version": version, "documents": {"status": b"{}"}}
+
+        writer.submit("a", lambda: build(1))
+        writer.flush(5)
+        writer.submit("a", lambda: build(2))
+        writer.flush(5)
+        self.assertEqual(built, [1])
+        self.assertEqual(reader.read().version, 1)
+        writer.submit("b", lambda: build(3))
+        writer.flush(5)
+        self.assertEqual(reader.read().version, 3)
+
+    def test_old_generations_removed(self):
+        """Test that the writer only keeps the last few generation files"""
+        writer = self._writer()
+        for version in range(10):
+            writer.publish(version, {"status": b"{}"})
+        files = [name for name in os.listdir(self.directory) if name.endswith(".snap")]
+        self.assertEqual(len(files), KEEP_GENERATIONS + 1)
+        self.assertEqual(self._reader().read().version, 9)
+
+    def test_new_writer_continues_numbering(self):
+        """Test that a process taking over publishes after the previous poller's generations"""
+        self._writer().publish(1, {"status": b"{}"})
+        reader = self._reader()
+        self.assertEqual(reader.read().version, 1)
+        self._writer().publish(2, {"status": b"{}"})
+        self.assertEqual(reader.read().version, 2)
+
+    def test_index_during_write(self):
+        """Test that an index the writer is updating gives the known generation"""
+        index = bytearray(struct.pack(INDEX_FORMAT, MAGIC, 4, 2))
+        self.assertEqual(_read_index(index, 1), 2)
+        struct.pack_into(INDEX_FORMAT, index, 0, MAGIC, 5, 3)  # Odd sequence: write in progress
+        self.assertEqual(_read_index(index, 2, attempts=10), 2)
+
+    def test_poller_lock(self):
+        """Test that only one holder gets the poller lock until it releases it"""
+        first = PollerLock(self.directory)
+        second = PollerLock(self.directory)
+        self.assertTrue(first.try_acquire())
+        self.assertTrue(first.try_acquire())
+        self.assertFalse(second.try_acquire())
+        first.release()
+        self.assertTrue(second.try_acquire())
+        second.release()
+
+    def test_filter_status(self):
+        """Test that query filters select projects and feeds case-insensitively"""
+        status = {
+            "version": 3,
+            "timestamp": "2026-01-13T16:04:33",
+            "errors": ["Other: timeout"],
+            "feeds": [{"name": "Main", "errors": None}, {"name": "Other", "errors": ["Other: timeout"]}],
+            "projects": [
+                {"name": "A", "feedName": "Main", "lastBuildStatus": "Success"},
+                {"name": "B", "feedName": "Main", "lastBuildStatus": "Failure"},
+                {"name": "C", "feedName": "Other", "lastBuildStatus": "Failure"},
+            ],
+        }
+        body = filter_status(status, {"feed": ["main"], "status": ["failure"]})
+        self.assertEqual([project["name"] for project in body["projects"]], ["B"])
+        self.assertEqual([feed["name"] for feed in body["feeds"]], ["Main"])
+        self.assertIsNone(body["errors"])
+        body = filter_status(status, {"status": ["Failure"]})
+        self.assertEqual([project["name"] for project in body["projects"]], ["B", "C"])
+        self.assertEqual(body["errors"], ["Other: timeout"])
+
+
+class FakePollerProcess:
+    """HTTP server standing in for the poller process: records requests, answers JSON"""
+
+    def __init__(self, version):
+        self.version = version
+        self.requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _answer(self):
+                fake.requests.append((self.command, self.path, self.headers.get(app_module.FORWARDED_HEADER)))
+                body = json.dumps({"outcome": "refreshed", "version": fake.version}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _answer
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestSharedMode(unittest.TestCase):
+    """Test cases for a worker process serving the poller process's snapshots"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = FakeCCTrayServer(make_cctray_xml(6, status="Failure")).start()
+        feeds = [{"name": "Main", "url": self.server.url}]
+        self.previous = (app_module.poller, app_module.shared_writer, app_module.shared_reader)
+        app_module.shared_writer = SharedSnapshotWriter(self.directory)
+        app_module.poller = FeedPoller(lambda: feeds, interval=3600)
+        app_module.poller.add_listener(app_module.publish_shared_snapshot, changes_only=False)
+        app_module.poller.poll_due()
+        app_module.shared_writer.flush(5)
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        app_module.poller.stop()
+        app_module.shared_writer.close()
+        if app_module.shared_reader is not None:
+            app_module.shared_reader.close()
+        app_module.poller, app_module.shared_writer, app_module.shared_reader = self.previous
+        self.server.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _get_both(self, url):
+        """Request url from the poller process, then from a worker process"""
+        from_poller = self.client.get(url)
+        app_module.serve_shared_snapshot(self.directory)
+        try:
+            from_worker = self.client.get(url)
+        finally:
+            app_module.shared_reader.close()
+            app_module.shared_reader = None
+        return from_poller, from_worker
+
+    def test_same_responses(self):
+        """Test that a worker serves the bytes and ETags the poller process would"""
+        for url in ("/api/status", "/api/summary", "/cc.xml", "/feeds/main/cc.xml"):
+            from_poller, from_worker = self._get_both(url)
+            self.assertEqual(from_worker.status_code, 200, url)
+            self.assertEqual(from_worker.data, from_poller.data, url)
+            self.assertEqual(from_worker.headers["ETag"], from_poller.headers["ETag"], url)
+
+    def test_unchanged_since_version(self):
+        """Test that ?since=<current version> gets the unchanged answer"""
+        version = app_module.poller.snapshot().version
+        from_poller, from_worker = self._get_both(f"/api/status?since={version}")
+        self.assertEqual(from_worker.data, from_poller.data)
+        self.assertTrue(from_worker.get_json()["unchanged"])
+
+    def test_older_version_gets_full_list(self):
+        """Test that a delta request for an older version is answered with every project"""
+        app_module.serve_shared_snapshot(self.directory)
+        data = self.client.get("/api/status?since=1").get_json()
+        self.assertEqual(len(data["projects"]), 6)
+        self.assertNotIn("unchanged", data)
+
+    def test_filters(self):
+        """Test that query filters are applied to the published project list"""
+        from_poller, from_worker = self._get_both("/api/status?status=failure")
+        self.assertEqual(from_worker.data, from_poller.data)
+        self.assertEqual(from_worker.headers["ETag"], from_poller.headers["ETag"])
+        app_module.serve_shared_snapshot(self.directory)
+        data = self.client.get("/api/status?status=failure&feed=MAIN").get_json()
+        self.assertEqual(len(data["projects"]), 6)
+        self.assertEqual(self.client.get("/api/status?status=Success").get_json()["projects"], [])
+
+    def test_new_snapshot_published(self):
+        """Test that a worker switches to the next version the poller publishes"""
+        app_module.serve_shared_snapshot(self.directory)
+        first = self.client.get("/api/status").get_json()["version"]
+        self.server.xml_content = make_cctray_xml(3)
+        app_module.poller.poll_due(force=True)
+        app_module.shared_writer.flush(5)
+        data = self.client.get("/api/status").get_json()
+        self.assertGreater(data["version"], first)
+        self.assertEqual(len(data["projects"]), 3)
+        self.assertEqual(data["version"], app_module.poller.snapshot().version)
+
+    def test_unchanged_poll_not_published(self):
+        """Test that a poll that changed nothing doesn't write a new generation"""
+        generation = app_module.shared_writer.generation
+        app_module.poller.poll_due(force=True)
+        app_module.shared_writer.flush(5)
+        self.assertEqual(app_module.shared_writer.generation, generation)
+
+    def test_poller_only_endpoints_forwarded(self):
+        """Test that a worker forwards refreshes and statistics to the poller process"""
+        version = app_module.poller.snapshot().version
+        fake = FakePollerProcess(version)
+        SharedSnapshotWriter(self.directory, fake.url).close()
+        app_module.serve_shared_snapshot(self.directory)
+        try:
+            self.assertEqual(self.client.get("/api/stats").get_json()["version"], version)
+            self.assertEqual(self.client.get("/api/schedule?x=1").status_code, 200)
+            self.assertEqual(self.client.post("/api/refresh/Main").get_json()["outcome"], "refreshed")
+            data = self.client.get("/api/status?fresh=1").get_json()
+        finally:
+            fake.stop()
+        self.assertEqual(data["version"], version)
+        self.assertEqual(
+            fake.requests,
+            [
+                ("GET", "/api/stats", "1"),
+                ("GET", "/api/schedule?x=1", "1"),
+                ("POST", "/api/refresh/Main", "1"),
+                ("POST", "/api/refresh", "1"),
+            ],
+        )
+
+    def test_poller_unreachable(self):
+        """Test that poller-only endpoints answer 503 while no poller process is reachable"""
+        app_module.serve_shared_snapshot(self.directory)
+        self.assertEqual(self.client.get("/api/stats").status_code, 503)
+        self.assertEqual(self.client.get("/api/schedule").status_code, 503)
+        self.assertEqual(self.client.post("/api/refresh").status_code, 503)
+        self.assertEqual(self.client.get("/feeds/Nope/cc.xml").status_code, 404)
+
+    def test_waiting_for_first_publish(self):
+        """Test that a worker started before any publish asks clients to wait"""
+        empty = tempfile.mkdtemp()
+        try:
+            app_module.serve_shared_snapshot(empty)
+            data = self.client.get("/api/status").get_json()
+            self.assertEqual(data["errors"], [app_module.WAITING_MESSAGE])
+            self.assertEqual(self.client.get("/api/summary").status_code, 503)
+        finally:
+            app_module.shared_reader.close()
+            app_module.shared_reader = None
+            shutil.rmtree(empty, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the on-disk snapshot store and warm restarts
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from fake_cctray import FakeCCTrayServer, make_cctray_xml
+from poller import FeedPoller
+from snapshot_store import SnapshotStore
+from test_poller import FakeClock
+
+
+class TestSnapshotStore(unittest.TestCase):
+    """Test cases for saving feeds and restoring them in a new poller"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "snapshots.sqlite3")
+        self.server = FakeCCTrayServer(make_cctray_xml(5), etag=True).start()
+        self.clock = FakeClock()
+        self.feeds = [{"name": "Main", "url": self.server.url, "filter_regex": "Project 4$"}]
+        self.pollers = []
+
+    def tearDown(self):
+        for poller in self.pollers:
+            poller.stop()
+        self.server.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _poller(self):
+        poller = FeedPoller(lambda: self.feeds, interval=5, clock=self.clock, store=SnapshotStore(self.path))
+        self.pollers.append(poller)
+        return poller
+
+    def _run_first_process(self):
+        poller = self._poller()
+        poller.poll_due()
+        poller.stop()  # Writes what is pending
+        return poller
+
+    def test_restore_publishes_before_first_poll(self):
+        """Test that a new poller serves the stored projects, marked stale, without polling"""
+        first = self._run_first_process()
+        requests = self.server.request_count
+
+        self.clock.advance(30)
+        poller = self._poller()
+        self.assertEqual(poller.restore(), 1)
+        self.assertTrue(poller.wait_ready(0))
+        self.assertEqual(self.server.request_count, requests)
+        snapshot = poller.snapshot()
+        self.assertEqual(snapshot.projects, first.snapshot().projects)
+        self.assertEqual([p.name for p in snapshot.projects], ["Project 0", "Project 1", "Project 2", "Project 3"])
+        status = poller.feed_statuses()[0]
+        self.assertTrue(status["stale"])
+        self.assertEqual(status["age"], 30.0)
+
+    def test_first_poll_after_restore_is_conditional(self):
+        """Test that restored validators turn the first poll into a 304 without parsing"""
+        self._run_first_process()
+        poller = self._poller()
+        poller.restore()
+        poller.poll_due()
+        self.assertEqual(self.server.not_modified_count, 1)
+        self.assertEqual(poller.parse_stats()["not_modified"], 1)
+        self.assertFalse(poller.feed_statuses()[0]["stale"])
+        self.assertEqual(len(poller.snapshot().projects), 4)
+
+    def test_changed_feed_url_is_not_restored(self):
+        """Test that projects stored for another URL are ignored"""
+        self._run_first_process()
+        self.feeds[0]["url"] = self.server.url + "?other"
+        poller = self._poller()
+        self.assertEqual(poller.restore(), 0)
+        self.assertIsNone(poller.snapshot())
+
+    def test_unchanged_documents_only_update_timestamps(self):
+        """Test that a poll without changes keeps the stored projects and updates the fetch time"""
+        store = SnapshotStore(self.path)
+        poller = FeedPoller(lambda: self.feeds, interval=5, clock=self.clock, store=store)
+        self.pollers.append(poller)
+        poller.poll_due()
+        store.flush(5)
+        self.clock.advance(5)
+        poller.poll_due()  # 304: same projects, new timestamp
+        store.flush(5)
+
+        restored = SnapshotStore(self.path).load()["Main"]
+        self.assertEqual(restored.updated_at, self.clock.now)
+        self.assertEqual(len(restored.records), 5)
+
+    def test_rolled_back_write_stores_projects_again(self):
+        """Test that projects of a rolled back transaction are written again by the next save"""
+        feeds = self.feeds + [{"name": "Other", "url": self.server.url}]
+        store = SnapshotStore(self.path)
+        poller = FeedPoller(lambda: feeds, interval=5, clock=self.clock, store=store)
+        self.pollers.append(poller)
+        poller.poll_due()
+        store.flush(5)
+
+        self.server.xml_content = make_cctray_xml(3)
+        changed = FeedPoller(lambda: feeds, interval=5, clock=self.clock)
+        self.pollers.append(changed)
+        changed.poll_due()
+        documents = {name: state.document for name, state in changed._states.items()}
+        connection = store._connect()
+        try:
+            connection.execute(
+                "CREATE TRIGGER fail BEFORE INSERT ON feeds WHEN NEW.name = 'Other' "
+                "BEGIN SELECT RAISE(ABORT, 'disk full'); END"
+            )
+            pending = {name: (document.source, document, self.clock.now) for name, document in documents.items()}
+            with self.assertRaises(sqlite3.IntegrityError):
+                store._write(connection, pending)  # Main is written, then rolled back
+            connection.execute("DROP TRIGGER fail")
+        finally:
+            connection.close()
+        store.save("Main", documents["Main"].source, documents["Main"], self.clock.now)
+        store.flush(5)
+
+        self.assertEqual(len(SnapshotStore(self.path).load()["Main"].records), 3)
+
+    def test_removed_feeds_pruned(self):
+        """Test that rows of feeds removed from the configuration are deleted"""
+        store = SnapshotStore(self.path)
+        feeds = self.feeds + [{"name": "Other", "url": self.server.url}]
+        poller = FeedPoller(lambda: feeds, interval=5, clock=self.clock, store=store)
+        self.pollers.append(poller)
+        poller.poll_due()
+        store.flush(5)
+        self.assertEqual(sorted(SnapshotStore(self.path).load()), ["Main", "Other"])
+        del feeds[1]
+        poller.poll_due()
+        store.flush(5)
+        self.assertEqual(list(SnapshotStore(self.path).load()), ["Main"])
+
+    def test_credentials_not_stored(self):
+        """Test that feed URLs are not written to the database"""
+        self.feeds[0]["url"] = self.server.url.replace("http://", "http://user:secret@")
+        self._run_first_process()
+        for name in os.listdir(self.directory):  # Including WAL files
+            with open(os.path.join(self.directory, name), "rb") as f:
+                self.assertNotIn(b"secret", f.read())
+
+    def test_unreadable_store(self):
+        """Test that a corrupt file is reported and ignored"""
+        with open(self.path, "wb") as f:
+            f.write(b"not a database" * 100)
+        self.assertEqual(SnapshotStore(self.path).load(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the Server-Sent Events push channel
+"""
+import json
+import socket
+import threading
+import time
+import unittest
+
+from fake_cctray import FakeCCTrayServer, make_cctray_xml
+from poller import FeedPoller
+from stream_server import StreamServer
+
+
+class SSEClient:
+    """Minimal blocking Server-Sent Events client"""
+
+    def __init__(self, port, path="/api/stream", headers=""):
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+        self.sock.sendall(f"GET {path} HTTP/1.1\r\nHost: test\r\n{headers}\r\n".encode("ascii"))
+        self.buffer = b""
+
+    def read_head(self):
+        """Return the response status line"""
+        while b"\r\n\r\n" not in self.buffer:
+            self._receive()
+        head, self.buffer = self.buffer.split(b"\r\n\r\n", 1)
+        status, *self.headers = head.decode("latin-1").split("\r\n")
+        return status
+
+    def read_block(self):
+        """Return the next event block as a str"""
+        while b"\n\n" not in self.buffer:
+            self._receive()
+        block, self.buffer = self.buffer.split(b"\n\n", 1)
+        return block.decode("utf-8")
+
+    def read_event(self):
+        """Return (id, data) of the next data event, skipping comments and retry"""
+        while True:
+            fields = dict(
+                line.split(": ", 1) for line in self.read_block().split("\n") if ": " in line
+            )
+            if "data" in fields:
+                return int(fields["id"]), json.loads(fields["data"])
+
+    def _receive(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("stream closed")
+        self.buffer += data
+
+    def close(self):
+        self.sock.close()
+
+
+class TestStreamServer(unittest.TestCase):
+    """Test cases for StreamServer"""
+
+    def setUp(self):
+        self.server = FakeCCTrayServer(make_cctray_xml(3)).start()
+        self.feeds = [{"name": "Main", "url": self.server.url}]
+        self.poller = FeedPoller(lambda: self.feeds, interval=3600)
+        self.poller.poll_due()
+        self.stream = StreamServer(self.poller, heartbeat=0.2, max_clients=3).start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.stream.stop()
+        self.poller.stop()
+        self.server.stop()
+
+    def connect(self, path="/api/stream", headers=""):
+        client = SSEClient(self.stream.port, path, headers)
+        self.clients.append(client)
+        return client
+
+    def test_full_list_then_deltas(self):
+        """Test that a stream starts with the full list and then pushes deltas"""
+        client = self.connect()
+        self.assertEqual(client.read_head(), "HTTP/1.1 200 OK")
+        version, data = client.read_event()
+        self.assertEqual(version, self.poller.snapshot().version)
+        self.assertEqual(len(data["projects"]), 3)
+
+        self.server.xml_content = make_cctray_xml(3, status="Failure")
+        self.poller.poll_due(force=True)
+        next_version, data = client.read_event()
+        self.assertEqual(next_version, version + 1)
+        self.assertEqual(data["since"], version)
+        self.assertEqual(len(data["delta"]["changed"]), 3)
+
+    def test_no_message_without_changes(self):
+        """Test that unchanged polls only produce heartbeats"""
+        client = self.connect()
+        client.read_head()
+        client.read_event()
+        self.poller.poll_due(force=True)  # Same document, same version
+        for _ in range(2):
+            self.assertEqual(client.read_block(), ": heartbeat")
+
+    def test_feed_failure_pushed(self):
+        """Test that a feed going stale and recovering is pushed without a new version"""
+        client = self.connect()
+        client.read_head()
+        version, _ = client.read_event()
+        self.server.status_code = 500
+        self.poller.poll_due(force=True)
+        failed_version, data = client.read_event()
+        self.assertEqual(failed_version, version)
+        self.assertTrue(data["unchanged"])
+        self.assertTrue(data["feeds"][0]["stale"])
+        self.assertTrue(data["errors"])
+
+        self.server.status_code = 200
+        self.poller.poll_due(force=True)
+        _, data = client.read_event()
+        self.assertFalse(data["feeds"][0]["stale"])
+        self.assertIsNone(data["errors"])
+
+    def test_resume_from_last_event_id(self):
+        """Test that a reconnecting browser gets only the changes it missed"""
+        version = self.poller.snapshot().version
+        self.server.xml_content = make_cctray_xml(4)
+        self.poller.poll_due(force=True)
+        client = self.connect(headers=f"Last-Event-ID: {version}\r\n")
+        client.read_head()
+        _, data = client.read_event()
+        self.assertEqual(len(data["delta"]["added"]), 1)
+        self.assertNotIn("projects", data)
+
+    def test_query_filters(self):
+        """Test that stream messages honour /api/status query filters"""
+        client = self.connect("/api/stream?category=Category%201")
+        client.read_head()
+        _, data = client.read_event()
+        self.assertEqual([p["name"] for p in data["projects"]], ["Project 1"])
+
+    def test_client_limit(self):
+        """Test that connections beyond max_clients are refused"""
+        for _ in range(3):
+            client = self.connect()
+            client.read_head()
+            client.read_event()
+        self.assertEqual(self.stream.clients, 3)
+        self.assertEqual(self.connect().read_head(), "HTTP/1.1 503 Service Unavailable")
+
+    def test_many_idle_clients(self):
+        """Test that hundreds of open streams are held by the single event loop thread"""
+        self.stream.max_clients = 300
+        clients = [self.connect() for _ in range(200)]
+        for client in clients:
+            client.read_head()
+            client.read_event()
+        self.assertEqual(self.stream.clients, 200)
+
+        self.server.xml_content = make_cctray_xml(2)
+        self.poller.poll_due(force=True)
+        for client in clients:
+            _, data = client.read_event()
+            self.assertEqual(data["delta"]["removed"], [{"feedName": "Main", "name": "Project 2"}])
+
+    def test_shared_status_bodies(self):
+        """Test that streams take their bodies from status_body, once per snapshot, off the loop"""
+        calls = []
+
+        def status_body(snapshot, criteria, since):
+            calls.append(threading.current_thread())
+            return json.dumps({"version": snapshot.version, "cached": True}).encode("utf-8")
+
+        self.stream.status_body = status_body
+        clients = [self.connect() for _ in range(3)]
+        for client in clients:
+            client.read_head()
+            self.assertTrue(client.read_event()[1]["cached"])
+        self.assertEqual(len(calls), 1)
+        self.assertIsNot(calls[0], self.stream._thread)
+
+    def test_unknown_path(self):
+        """Test that only /api/stream is served"""
+        self.assertEqual(self.connect("/api/status").read_head(), "HTTP/1.1 404 Not Found")
+        self.assertEqual(self.connect("/").read_head(), "HTTP/1.1 404 Not Found")
+        self.assertEqual(self.stream.clients, 0)
+
+    def test_allow_origin(self):
+        """Test that Access-Control-Allow-Origin is only sent when configured"""
+        client = self.connect()
+        client.read_head()
+        self.assertNotIn("access-control-allow-origin", [h.split(":")[0].lower() for h in client.headers])
+        self.stream.allow_origin = "http://ci-dashboard:5000"
+        client = self.connect()
+        client.read_head()
+        self.assertIn("Access-Control-Allow-Origin: http://ci-dashboard:5000", client.headers)
+
+    def test_disconnected_clients_released(self):
+        """Test that closed connections are noticed and released"""
+        client = self.connect()
+        client.read_head()
+        client.read_event()
+        client.close()
+        deadline = time.monotonic() + 5
+        while self.stream.clients and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.stream.clients, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the incremental status summary and /api/summary
+"""
+import unittest
+from collections import Counter
+from unittest import mock
+
+import app as app_module
+import summary
+from fake_cctray import FakeCCTrayServer, make_cctray_xml, make_project
+from models import FeedInfo
+from poller import FeedPoller, FeedState, Snapshot
+from summary import StatusSummary, status_name
+
+MAPPING = {
+    "success": "Success",
+    "failure": "Failure",
+    "exception": "Exception",
+    "unknown": "Unknown",
+    "building": "Building",
+}
+
+
+def make_snapshot(feeds):
+    states = []
+    for name, projects in feeds.items():
+        state = FeedState(name)
+        state.projects = projects
+        states.append(state)
+    return Snapshot(states, 1000.0)
+
+
+class TestStatusSummary(unittest.TestCase):
+    """Test cases for counters updated from snapshot to snapshot"""
+
+    def setUp(self):
+        self.info = FeedInfo("Main", "http://ci.example.com/cc.xml")
+        self.other = FeedInfo("Other", "http://ci2.example.com/cc.xml")
+        self.summary = StatusSummary()
+
+    def assertMatchesRecount(self, body, snapshot):
+        """Compare incremental counts with counting the snapshot from scratch"""
+        statuses = Counter(status_name(project) for project in snapshot.projects)
+        self.assertEqual(body["counts"], {key: statuses.get(name, 0) for key, name in MAPPING.items()})
+        categories = {}
+        for project in snapshot.projects:
+            categories.setdefault(project.category, Counter())[status_name(project)] += 1
+        self.assertEqual([category["name"] for category in body["categories"]], sorted(categories))
+        for category in body["categories"]:
+            expected = categories[category["name"]]
+            self.assertEqual(category["projects"], sum(expected.values()))
+            self.assertEqual(category["counts"], {key: expected.get(name, 0) for key, name in MAPPING.items()})
+
+    def test_counts_follow_changes(self):
+        """Test that counts stay equal to a full recount across changes"""
+        main = [make_project(self.info, f"P{i}", category=f"C{i % 2}") for i in range(4)]
+        snapshots = [
+            {"Main": main},
+            {"Main": main[:1] + [make_project(self.info, "P1", "Failure", category="C1")] + main[2:]},
+            {"Main": main[:3] + [make_project(self.info, "P3", activity="Building", category="C1")]},
+            {"Main": main[:2], "Other": [make_project(self.other, "X", "Exception", category="Ops")]},
+            {"Other": [make_project(self.other, "X", "Exception", category="Ops")]},
+        ]
+        for feeds in snapshots:
+            snapshot = make_snapshot(feeds)
+            self.assertMatchesRecount(self.summary.build(snapshot, MAPPING), snapshot)
+
+    def test_building_counted_as_building(self):
+        """Test that a building project only counts as Building, like the page"""
+        projects = [
+            make_project(self.info, "A", "Failure", activity="Building"),
+            make_project(self.info, "B", "Success", activity="CheckingModifications"),
+            make_project(self.info, "C", "Failure"),
+        ]
+        snapshot = make_snapshot({"Main": projects})
+        body = self.summary.build(snapshot, MAPPING)
+        self.assertEqual(body["counts"]["building"], 2)
+        self.assertEqual(body["counts"]["failure"], 1)
+        self.assertFalse(body["feeds"][0]["all_success"])
+
+    def test_only_changed_projects_recounted(self):
+        """Test that unchanged feeds and records are not looked at again"""
+        main = [make_project(self.info, f"P{i}") for i in range(10)]
+        other = [make_project(self.other, f"Q{i}") for i in range(10)]
+        self.summary.update(make_snapshot({"Main": main, "Other": other}))
+        changed = main[:9] + [make_project(self.info, "P9", "Failure")]
+        with mock.patch("summary.status_name", wraps=summary.status_name) as counted:
+            body = self.summary.build(make_snapshot({"Main": changed, "Other": other}), MAPPING)
+        self.assertEqual(counted.call_count, 1)
+        self.assertEqual(body["feeds"][0]["counts"]["failure"], 1)
+        self.assertEqual(body["counts"]["success"], 19)
+        self.assertTrue(body["feeds"][1]["all_success"])
+
+    def test_duplicate_project_names(self):
+        """Test that a feed with repeated project names is still counted correctly"""
+        projects = [make_project(self.info, "Same"), make_project(self.info, "Same", "Failure")]
+        for feeds in ({"Main": projects}, {"Main": projects[:1]}, {"Main": list(projects)}):
+            snapshot = make_snapshot(feeds)
+            self.assertMatchesRecount(self.summary.build(snapshot, MAPPING), snapshot)
+
+
+class TestSummaryEndpoint(unittest.TestCase):
+    """Test cases for /api/summary"""
+
+    def setUp(self):
+        self.server = FakeCCTrayServer(make_cctray_xml(5, status="Failure")).start()
+        feeds = [{"name": "Main", "url": self.server.url}]
+        self.previous_poller = app_module.poller
+        app_module.poller = FeedPoller(lambda: feeds, interval=3600)
+        app_module.poller.poll_due()
+
+    def tearDown(self):
+        app_module.poller.stop()
+        app_module.poller = self.previous_poller
+        self.server.stop()
+
+    def test_summary(self):
+        """Test that /api/summary counts by the configured color keys and supports ETags"""
+        mapping = app_module.config_store.get().client_config["status_mapping"]
+        with app_module.app.test_client() as client:
+            response = client.get("/api/summary")
+            data = response.get_json()
+            self.assertEqual(set(data["counts"]), set(mapping))
+            self.assertEqual(data["counts"]["failure"], 5)
+            self.assertEqual(data["projects"], 5)
+            self.assertEqual(data["feeds"][0]["name"], "Main")
+            self.assertEqual(len(data["categories"]), 5)
+            self.assertLess(len(response.data), 1500)
+            revalidated = client.get("/api/summary", headers={"If-None-Match": response.headers["ETag"]})
+            self.assertEqual(revalidated.status_code, 304)
+
+
+if __name__ == "__main__":
+    unittest.main()
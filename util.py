@@ -2,8 +2,15 @@
 """
 Utility functions for CCTray Build Status Monitor
 """
+import functools
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
 
+# Query parameters removed from sanitized URLs
+TOKEN_KEYS = ("token", "access_token", "auth_token", "api_key", "apikey", "key")
+
+# Hosts replaced by the feed host in sanitized URLs
+LOCAL_HOSTS = ("localhost", "127.0.0.1")
+
 
 def sanitize_url(url, feed_url, main_url=""):
     """
@@ -31,50 +38,148 @@ def sanitize_url(url, feed_url, main_url=""):
         return ""
 
     try:
-        parsed = urlparse(url)
         # Use main_url for localhost replacement if provided, otherwise use feed_url
         replacement_url = main_url if main_url else feed_url
         feed_parsed = urlparse(replacement_url)
+        return _sanitize_parsed(urlparse(url), lambda: _host_and_port(feed_parsed))
+    except Exception as e:
+        # Don't print the URL as it may contain credentials
+        print(f"Error sanitizing URL: {e}")
+        return url
 
-        # Remove username, password, and token from URL
-        # Reconstruct netloc without credentials
-        netloc = parsed.hostname
-        if parsed.port:
-            netloc = f"{netloc}:{parsed.port}"
 
-        # Replace localhost or 127.0.0.1 with feed host
-        if parsed.hostname in ["localhost", "127.0.0.1"]:
-            netloc = feed_parsed.hostname
-            if feed_parsed.port:
-                netloc = f"{netloc}:{feed_parsed.port}"
+def _host_and_port(parsed):
+    """Return "hostname[:port]" of a parsed URL, dropping any credentials"""
+    netloc = parsed.hostname
+    if parsed.port:
+        netloc = f"{netloc}:{parsed.port}"
+    return netloc
 
-        # Remove any tokens from query parameters
-        query_params = parse_qs(parsed.query)
-        # Remove common token parameter names
-        token_keys = ["token", "access_token", "auth_token", "api_key", "apikey", "key"]
-        for key in token_keys:
-            query_params.pop(key, None)
 
-        # Reconstruct query string
-        query_string = urlencode(query_params, doseq=True)
+def _sanitize_parsed(parsed, replacement_netloc):
+    """
+    Rebuild a parsed URL without credentials and tokens
 
-        # Reconstruct URL
-        sanitized = urlunparse(
-            (
-                parsed.scheme,
-                netloc,
-                parsed.path,
-                parsed.params,
-                query_string,
-                parsed.fragment,
-            )
+    Args:
+        parsed: Result of urlparse() for the URL to sanitize
+        replacement_netloc: Callable returning the netloc used instead of localhost
+
+    Returns:
+        Sanitized URL string
+    """
+    # Remove username, password, and token from URL
+    # Reconstruct netloc without credentials
+    netloc = _host_and_port(parsed)
+
+    # Replace localhost or 127.0.0.1 with feed host
+    if parsed.hostname in LOCAL_HOSTS:
+        netloc = replacement_netloc()
+
+    # Remove any tokens from query parameters
+    query_params = parse_qs(parsed.query)
+    for key in TOKEN_KEYS:
+        query_params.pop(key, None)
+
+    # Reconstruct query string
+    query_string = urlencode(query_params, doseq=True)
+
+    # Reconstruct URL
+    return urlunparse(
+        (
+            parsed.scheme,
+            netloc,
+            parsed.path,
+            parsed.params,
+            query_string,
+            parsed.fragment,
         )
+    )
 
-        return sanitized
-    except Exception as e:
-        # Don't print the URL as it may contain credentials
-        print(f"Error sanitizing URL: {e}")
-        return url
+
+class UrlSanitizer:
+    """
+    sanitize_url() prepared once for one feed, with a bounded LRU cache of results
+
+    The feed/main URL is parsed once when the sanitizer is built instead of once per
+    project, and webUrls seen in earlier polls are answered from the cache. Results
+    are identical to sanitize_url(url, feed_url, main_url).
+
+    Args:
+        feed_url: The feed URL to extract the host from for localhost replacement
+        main_url: Optional main URL to use for localhost replacement (takes priority)
+        cache_size: Initial number of sanitized URLs remembered; the parser grows
+            it with reserve() to the feed's project count
+
+    Example:
+        >>> sanitizer = UrlSanitizer("http://ci.example.com:8111/feed")
+        >>> sanitizer.sanitize("http://localhost:8080/build")
+        "http://ci.example.com:8111/build"
+    """
+
+    def __init__(self, feed_url, main_url="", cache_size=4096):
+        # Errors are kept and raised where sanitize_url would raise them: an
+        # unparsable feed URL fails every call, a bad port only localhost URLs
+        self._parse_error = None
+        self._replacement_error = None
+        self._replacement_netloc = None
+        try:
+            # Use main_url for localhost replacement if provided, otherwise use feed_url
+            feed_parsed = urlparse(main_url if main_url else feed_url)
+            try:
+                self._replacement_netloc = _host_and_port(feed_parsed)
+            except Exception as e:
+                self._replacement_error = e
+        except Exception as e:
+            self._parse_error = e
+        self._cached = functools.lru_cache(maxsize=cache_size)(self._sanitize)
+
+    def sanitize(self, url):
+        """Sanitize one URL (see sanitize_url)"""
+        if not url:
+            return ""
+        return self._cached(url)
+
+    def reserve(self, count):
+        """
+        Make room for `count` URLs (a feed's project count)
+
+        A document scanned in order over more URLs than the cache holds would evict
+        each one just before the next poll needs it. Growing empties the cache once.
+        """
+        maxsize = self._cached.cache_info().maxsize
+        if count > maxsize:
+            # Headroom for projects added later
+            self._cached = functools.lru_cache(maxsize=count + count // 4)(self._sanitize)
+
+    def cache_info(self):
+        """Return the functools cache statistics (hits, misses, maxsize, currsize)"""
+        return self._cached.cache_info()
+
+    def _replacement(self):
+        if self._replacement_error is not None:
+            raise self._replacement_error
+        return self._replacement_netloc
+
+    def _sanitize(self, url):
+        try:
+            if self._parse_error is not None:
+                raise self._parse_error
+            return _sanitize_parsed(urlparse(url), self._replacement)
+        except Exception as e:
+            # Don't print the URL as it may contain credentials
+            print(f"Error sanitizing URL: {e}")
+            return url
+
+
+@functools.lru_cache(maxsize=128)
+def get_url_sanitizer(feed_url, main_url=""):
+    """
+    Return the shared UrlSanitizer for a feed/main URL pair
+
+    Sanitizers (and their caches) are kept between polls, so webUrls that repeat
+    from one poll to the next are not parsed again.
+    """
+    return UrlSanitizer(feed_url, main_url)
 
 
 def get_base_url(url):
@@ -4,22 +4,18 @@ WSGI server entry point for production deployment.
 Uses Waitress, a production WSGI server that works on Windows.
 """
 from waitress import serve
-from app import app
+import app as app_module
+from app import app, get_poller, load_config
+from shared_snapshot import PollerLock
+from stream_server import StreamServer
+import argparse
 import os
-import json
+import signal
 import socket
+import subprocess
 import sys
-
-
-def load_config():
-    """Load configuration from config.json5"""
-    config_path = "config.json5"
-    if os.path.exists(config_path):
-        import json5
-
-        with open(config_path, "r", encoding="utf-8") as f:
-            return json5.load(f)
-    return {}
+import threading
+import time
 
 
 def is_port_available(host, port):
@@ -33,11 +29,128 @@ def is_port_available(host, port):
         return False
 
 
+def start_stream_server(config, host):
+    """Start the Server-Sent Events stream if stream_port is configured"""
+    stream_port = config.get("stream_port")
+    if not stream_port:
+        return
+    feed_poller = get_poller()
+    stream_server = StreamServer(
+        feed_poller,
+        host=host,
+        port=stream_port,
+        max_clients=config.get("stream_max_clients", 500),
+        allow_origin=config.get("stream_allow_origin"),
+        # Same cached bodies as /api/status
+        status_body=lambda snapshot, criteria, since: app_module.status_response(
+            feed_poller, snapshot, criteria, since
+        ).body,
+    )
+    try:
+        stream_server.start()
+        print(f"Serving build status stream on {host}:{stream_server.port}")
+    except OSError as e:
+        print(f"ERROR: Could not start the build status stream on port {stream_port}: {e}")
+        print("Pages will poll /api/status instead")
+
+
+def run_workers(workers):
+    """
+    Start `workers` server processes and restart any that exits
+
+    Each worker serves on its own port (port, port + 1, ...) for nginx to balance
+    across; see nginx_config_example.conf.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--worker"]
+    processes = {}
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # Stopping the supervisor stops the workers too: SIGTERM from a service manager
+    # or kill, and on Windows SIGBREAK (Ctrl+Break, closing the console window);
+    # Ctrl+C already raises KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    if hasattr(signal, "SIGBREAK"):
+        signal.signal(signal.SIGBREAK, stop)
+    try:
+        while True:
+            for index in range(workers):
+                process = processes.get(index)
+                if process is None or process.poll() is not None:
+                    if process is not None:
+                        print(f"Worker {index} exited with code {process.returncode}, restarting it")
+                    processes[index] = subprocess.Popen(command + [str(index)])
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.wait()
+
+
+def local_url(host, port):
+    """URL at which the other processes on this machine reach a server bound to host"""
+    if host in ("", "0.0.0.0"):
+        host = "127.0.0.1"
+    elif host == "::":
+        host = "::1"
+    if ":" in host:
+        host = f"[{host}]"
+    return f"http://{host}:{port}"
+
+
+def start_shared_mode(directory, config, host, port):
+    """
+    Join the elected-poller scheme of a multi-process deployment
+
+    The process that gets the poller lock polls the feeds and publishes each
+    snapshot to `directory`; the others serve those snapshots, forward refreshes
+    and statistics requests to it, and keep trying to take the lock, so one of
+    them takes over if the poller process exits.
+
+    Returns:
+        The PollerLock; keep a reference to it, since closing its file releases it
+    """
+    lock = PollerLock(directory)
+
+    def become_poller():
+        app_module.start_shared_poller(directory, local_url(host, port))
+        start_stream_server(config, host)
+        print(f"Polling the feeds in this process (pid {os.getpid()})")
+
+    if lock.try_acquire():
+        become_poller()
+        return lock
+
+    app_module.serve_shared_snapshot(directory)
+    retry = max(1.0, config.get("poll_interval", config.get("refresh_interval", 5)))
+
+    def wait_for_lock():
+        while not lock.try_acquire():
+            time.sleep(retry)
+        become_poller()
+
+    threading.Thread(target=wait_for_lock, name="cctray-election", daemon=True).start()
+    return lock
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CCTray Build Status Monitor (Waitress)")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)  # Set by run_workers
+    args = parser.parse_args()
+
     config = load_config()
-    port = config.get("port", 5000)
     host = config.get("host", "127.0.0.1")
     threads = config.get("threads", 4)
+    workers = config.get("workers", 1)
+    if workers > 1 and args.worker is None:
+        print(f"Starting {workers} worker processes")
+        run_workers(workers)
+        sys.exit(0)
+    port = config.get("port", 5000) + (args.worker or 0)
 
     # Check if port is available
     if not is_port_available(host, port):
@@ -47,6 +160,14 @@ if __name__ == "__main__":
         )
         sys.exit(1)
 
+    if workers > 1:
+        poller_lock = start_shared_mode(config.get("shared_snapshot_dir", "shared_snapshot"), config, host, port)
+    else:
+        # Start polling now, so the feeds stored by the previous process are restored
+        # and fetched before the first page asks for them
+        get_poller()
+        start_stream_server(config, host)
+
     print(f"Starting Waitress WSGI server on {host}:{port}")
     print(f"Threads: {threads}")
     print("Press Ctrl+C to stop the server")